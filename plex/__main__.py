@@ -1,18 +1,30 @@
 import datetime
 import os
-import threading
+import tempfile
 import time
 from pathlib import Path
 from typing import Optional
 
 from tap import tapify
 
-from plex.daily import process_daily_file, sync_tasks_to_calendar
+from plex.daily import (
+    process_daily_file,
+    submit_tasks_to_calendar,
+    sync_tasks_to_calendar,
+)
 from plex.daily.base import TaskSource
 from plex.daily.config_format import make_daily_filename
 from plex.daily.endpoint import get_json_str
-from plex.daily.tasks.push_notes import notion_requestor, overwrite_tasks_in_notion
+from plex.daily.tasks.change_log import ChangeLog
+from plex.daily.tasks.push_notes import (
+    NOTION_CHANGES,
+    clear_notion_snapshots,
+    overwrite_tasks_in_notion,
+    reconcile_tasks_in_notion,
+    start_notion_requestor,
+)
 from plex.notion_api.page import clear_page_cache
+from plex.rate_limit import get_api_stats
 
 DAILY_BASEDIR = "daily"
 
@@ -28,6 +40,7 @@ def main(
     autoupdate: bool = False,
     source: str = "file",
     is_skip_calendar: bool = False,
+    fake_notion_latency: Optional[float] = None,
 ) -> None:
     """Plex: Planning and execution command line tool
 
@@ -44,9 +57,24 @@ def main(
             If this is the first time running with something other than file, remember to first push your changes.
             Available options: (file, notion)
         is_skip_calendar (bool, optional): skip calendar updates
+        fake_notion_latency (Optional[float], optional): if set, notion is replaced by an
+            in-process stand-in with this request latency (seconds), for offline testing.
+            Notion requests made by a push are printed. Defaults to None.
     """
     source = TaskSource(source)
-    threading.Thread(target=notion_requestor, daemon=True).start()
+    fake_notion = None
+    if fake_notion_latency is not None:
+        from plex.notion_api.fake import FakeNotion, install_fake_notion
+
+        cache_dir = tempfile.mkdtemp(prefix="plex-fake-notion-")
+        fake_notion = FakeNotion(latency=fake_notion_latency)
+        install_fake_notion(fake_notion, cache_dir)
+        clear_notion_snapshots()
+        NOTION_CHANGES.change_log = ChangeLog(
+            os.path.join(cache_dir, "pending_changes.jsonl")
+        )
+    if source == TaskSource.NOTION or push:
+        start_notion_requestor()
 
     if date:
         assert not tomorrow, "cannot specify tomorrow when date is specified."
@@ -86,7 +114,14 @@ def main(
             raise ValueError(f"Daily file {filename} doesn't exist. Unable to push.")
             # write out contents
         print("Pushing Tasks To Notion")
+        push_time = time.time()
         overwrite_tasks_in_notion(datestr)
+        if fake_notion is not None:
+            print(
+                f"Pushed in {time.time() - push_time:.2f}s, "
+                f"notion requests: {dict(fake_notion.requests)}, "
+                f"retries: {get_api_stats()['notion']}"
+            )
         if not is_skip_calendar:
             print("Pushing to calendar")
             sync_tasks_to_calendar(datestr, filename, push_only=True)
@@ -95,7 +130,7 @@ def main(
         print(f"Starting Auto Update mode. Source: {source}")
         update_process_time = time.time()
         update_calendar_time = time.time()
-        calendar_retry_times = 3
+        calendar_sync = None
 
         update_window = []
         is_sleep_mode = False
@@ -112,11 +147,11 @@ def main(
                     )
                     if process_retry_times <= 0:
                         print(
-                            "Process ERROR Attempting Overwrite "
+                            "Process ERROR Attempting Reconcile "
                             f"(retries left - {overwrite_retry_times}): {err}"
                         )
                         try:
-                            overwrite_tasks_in_notion(datestr)
+                            reconcile_tasks_in_notion(datestr)
                             overwrite_retry_times = 1
                         except Exception as err:
                             if overwrite_retry_times <= 0:
@@ -144,19 +179,16 @@ def main(
                         print("Changing to sleep mode after no changes detected")
                     is_sleep_mode = True
 
-            if not is_skip_calendar and time.time() >= update_calendar_time:
+            if (
+                not is_skip_calendar
+                and time.time() >= update_calendar_time
+                and (calendar_sync is None or calendar_sync.done())
+            ):
+                # runs in the background, api errors are retried and reported there.
                 try:
-                    sync_tasks_to_calendar(datestr, filename, push_only=True)
-                    calendar_retry_times = 3
+                    calendar_sync = submit_tasks_to_calendar(datestr, filename)
                 except Exception as err:
-                    print(
-                        f"Calendar ERROR: (retries left - {calendar_retry_times}): {err}"
-                    )
-                    if calendar_retry_times <= 0:
-                        print(f"Calendar ERROR Exiting...")
-                        raise err
-                    calendar_retry_times -= 1
-
+                    print(f"Calendar ERROR: {err}")
                 update_calendar_time = time.time() + 60
 
 
@@ -1,8 +1,17 @@
 from .base import (
+    CalendarBatchResult,
+    CalendarChange,
+    CalendarOperation,
     Event,
     create_calendar_event,
     delete_calendar_event,
+    execute_calendar_changes,
+    generate_event_id,
     get_all_plex_calendar_events,
     get_event,
+    get_plex_calendar_event_changes,
+    get_task_uuid_from_event_id,
+    is_event_cancelled,
+    make_calendar_event,
     update_calendar_event,
 )
@@ -1,16 +1,41 @@
+import base64
 import functools
-import random
+import uuid
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
+from enum import Enum
+from typing import Optional
 
 from gcsa.event import Event
 from gcsa.google_calendar import GoogleCalendar
+from gcsa.serializers.event_serializer import EventSerializer
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 
+from plex.rate_limit import (
+    ApiBackend,
+    TokenBucket,
+    get_google_retry_after,
+    get_request_builder,
+    is_retryable_google_error,
+)
 from plex.secrets import email  # you need to create this file
 
 EVENT_ID_ENCODING = "0123456789abcdefghijklmnopqrstuv"
 # added to the start of the uuid. Chars must be a part of EVENT_ID_ENCODING
 CALENDAR_EVENT_IDENTIFIER = "ple88ple88ple88ple88ple88ple88"
-GENERATED_EVENT_ID_LENGTH = 888
+# the calendar api accepts up to 1000 calls in a batch, but recommends
+# keeping batches small as each call still counts towards the quota.
+CALENDAR_BATCH_LIMIT = 50
+# calendar api allows 600 queries per minute per user, stay under it.
+# each call inside of a batch request counts as a query.
+CALENDAR_RATE_LIMITER = TokenBucket(rate=8, capacity=CALENDAR_BATCH_LIMIT)
+CALENDAR_BACKEND = ApiBackend(
+    "calendar",
+    CALENDAR_RATE_LIMITER,
+    is_retryable_google_error,
+    get_google_retry_after,
+)
 
 
 def validate_event_id(event_id: str):
@@ -23,30 +48,45 @@ def validate_event_id(event_id: str):
 
 @functools.cache
 def get_calendar():
-    return GoogleCalendar(email)
+    calendar = GoogleCalendar(email)
+    # send the calendar's requests through CALENDAR_BACKEND
+    calendar.service = build(
+        "calendar",
+        "v3",
+        credentials=calendar.credentials,
+        requestBuilder=get_request_builder(CALENDAR_BACKEND),
+    )
+    return calendar
+
 
+def generate_event_id(additional_id: str = "", task_uuid: str = "") -> str:
+    """Makes the event id for a task.
 
-def generate_event_id(additional_id: str = "") -> str:
+    Ids are derived from the task uuid (base32hex, which is a subset of EVENT_ID_ENCODING),
+    so the same task always maps to the same event.
+    """
     event_id = (
         CALENDAR_EVENT_IDENTIFIER
         + additional_id
-        + "".join(
-            [random.choice(EVENT_ID_ENCODING) for _ in range(GENERATED_EVENT_ID_LENGTH)]
-        )
+        + base64.b32hexencode(task_uuid.encode()).decode().lower().rstrip("=")
     )
     validate_event_id(event_id)
     return event_id
 
 
+def get_task_uuid_from_event_id(event_id: str, additional_id: str = "") -> str:
+    encoded = event_id.removeprefix(CALENDAR_EVENT_IDENTIFIER + additional_id).upper()
+    return base64.b32hexdecode(encoded + "=" * (-len(encoded) % 8)).decode()
+
+
 def is_event_is_plex_generated_event(event: Event, additional_id: str = "") -> bool:
     return event.id.startswith(CALENDAR_EVENT_IDENTIFIER + additional_id)
 
 
-def create_calendar_event(
-    summary: str, start: datetime, end: datetime, notes: str = "", date_id: str = ""
-) -> str:
-    event_id = generate_event_id(date_id)
-    event = Event(
+def make_calendar_event(
+    event_id: str, summary: str, start: datetime, end: datetime, notes: str = ""
+) -> Event:
+    return Event(
         summary=summary,
         start=start,
         end=end,
@@ -54,7 +94,18 @@ def create_calendar_event(
         minutes_before_popup_reminder=0,
         description=notes,
     )
-    get_calendar().add_event(event)
+
+
+def create_calendar_event(
+    summary: str,
+    start: datetime,
+    end: datetime,
+    notes: str = "",
+    date_id: str = "",
+    task_uuid: str = "",
+) -> str:
+    event_id = generate_event_id(date_id, task_uuid or str(uuid.uuid1()))
+    get_calendar().add_event(make_calendar_event(event_id, summary, start, end, notes))
     return event_id
 
 
@@ -66,15 +117,9 @@ def update_calendar_event(
     notes: str = "",
     date_id: str = "",
 ) -> None:
-    event = Event(
-        summary=summary,
-        start=start,
-        end=end,
-        event_id=event_id,
-        minutes_before_popup_reminder=0,
-        description=notes,
+    get_calendar().update_event(
+        make_calendar_event(event_id, summary, start, end, notes)
     )
-    get_calendar().update_event(event)
 
 
 def get_all_plex_calendar_events(min_date: datetime, date_id: str = "") -> list[Event]:
@@ -86,6 +131,57 @@ def get_all_plex_calendar_events(min_date: datetime, date_id: str = "") -> list[
     return events
 
 
+def is_event_cancelled(event: Event) -> bool:
+    return (event.other or {}).get("status") == "cancelled"
+
+
+def get_plex_calendar_event_changes(
+    sync_token: Optional[str] = None, date_id: str = ""
+) -> tuple[list[Event], Optional[str]]:
+    """Gets plex events edited since the sync token was issued.
+
+    Without a sync token (or if the token expired) all events are listed to get a new token.
+    Note that the calendar api doesn't allow time bounds together with sync tokens,
+    so the initial listing covers the whole calendar.
+    Deleted events are included, see is_event_cancelled.
+
+    Args:
+        sync_token (Optional[str], optional): token from the previous call. Defaults to None.
+        date_id (str, optional): only return events for this date id. Defaults to "".
+
+    Returns:
+        tuple[list[Event], Optional[str]]: changed events and the token for the next call
+    """
+    calendar = get_calendar()
+    events = []
+    page_token = None
+    while True:
+        try:
+            response = (
+                calendar.service.events()
+                .list(
+                    calendarId=calendar.default_calendar,
+                    syncToken=sync_token,
+                    pageToken=page_token,
+                    showDeleted=True,
+                )
+                .execute()
+            )
+        except HttpError as exc:
+            if sync_token is not None and exc.resp.status == 410:
+                # sync token expired, full sync is required.
+                return get_plex_calendar_event_changes(None, date_id)
+            raise
+        events += [
+            EventSerializer.to_object(item)
+            for item in response.get("items", [])
+            if item["id"].startswith(CALENDAR_EVENT_IDENTIFIER + date_id)
+        ]
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return events, response.get("nextSyncToken")
+
+
 def get_event(event_id: str) -> Event:
     return get_calendar().get_event(event_id)
 
@@ -94,3 +190,122 @@ def delete_calendar_event(
     event: Event = None,
 ) -> None:
     get_calendar().delete_event(event)
+
+
+class CalendarOperation(Enum):
+    create = "create"
+    update = "update"
+    upsert = "upsert"  # update, or create if the event doesn't exist
+    delete = "delete"
+
+
+@dataclass(frozen=True)
+class CalendarChange:
+    operation: CalendarOperation
+    event_id: str
+    event: Optional[Event] = None  # required for create and update
+
+
+@dataclass
+class CalendarBatchResult:
+    succeeded: list[CalendarChange] = field(default_factory=list)
+    failed: list[tuple[CalendarChange, Exception]] = field(default_factory=list)
+
+
+def make_calendar_request(change: CalendarChange):
+    """Creates the (unexecuted) api request for a calendar change."""
+    calendar = get_calendar()
+    events = calendar.service.events()
+    if change.operation == CalendarOperation.delete:
+        # delete by id directly, no need to fetch the event first.
+        return events.delete(
+            calendarId=calendar.default_calendar, eventId=change.event_id
+        )
+    assert change.event is not None, f"{change.operation} requires an event"
+    body = EventSerializer.to_json(change.event)
+    if change.operation == CalendarOperation.create:
+        return events.insert(calendarId=calendar.default_calendar, body=body)
+    if change.operation == CalendarOperation.upsert:
+        # updating a deleted event restores it, inserting it would conflict on the id.
+        body["status"] = "confirmed"
+    return events.update(
+        calendarId=calendar.default_calendar, eventId=change.event_id, body=body
+    )
+
+
+def is_event_already_deleted(change: CalendarChange, exc: Exception) -> bool:
+    return (
+        change.operation == CalendarOperation.delete
+        and isinstance(exc, HttpError)
+        and exc.resp.status in (404, 410)
+    )
+
+
+def is_upsert_of_missing_event(change: CalendarChange, exc: Exception) -> bool:
+    return (
+        change.operation == CalendarOperation.upsert
+        and isinstance(exc, HttpError)
+        and exc.resp.status == 404
+    )
+
+
+def execute_calendar_changes(
+    changes: list[CalendarChange], batch_limit: int = CALENDAR_BATCH_LIMIT
+) -> CalendarBatchResult:
+    """Executes calendar changes as multipart batch requests.
+
+    Each batch holds up to batch_limit changes and is sent as a single http request.
+    Failures are reported per change rather than failing the whole batch.
+
+    Args:
+        changes (list[CalendarChange]): changes to apply to the calendar
+        batch_limit (int, optional): max changes per http request. Defaults to CALENDAR_BATCH_LIMIT.
+
+    Returns:
+        CalendarBatchResult: changes that succeeded and changes that failed with their errors
+    """
+    result = CalendarBatchResult()
+    missing: list[CalendarChange] = []
+    service = get_calendar().service
+    for batch_start in range(0, len(changes), batch_limit):
+        batch_changes = changes[batch_start : batch_start + batch_limit]
+        reported: set[int] = set()
+
+        def callback(request_id: str, response: dict, exc: Optional[Exception]):
+            idx = int(request_id)
+            reported.add(idx)
+            if exc is None or is_event_already_deleted(batch_changes[idx], exc):
+                result.succeeded.append(batch_changes[idx])
+            elif is_upsert_of_missing_event(batch_changes[idx], exc):
+                missing.append(batch_changes[idx])
+            else:
+                result.failed.append((batch_changes[idx], exc))
+
+        batch = service.new_batch_http_request(callback=callback)
+        for idx, change in enumerate(batch_changes):
+            batch.add(make_calendar_request(change), request_id=str(idx))
+        try:
+            batch.execute()
+        except Exception as exc:
+            # whole batch failed (eg. network error), fail changes without a response
+            result.failed += [
+                (change, exc)
+                for idx, change in enumerate(batch_changes)
+                if idx not in reported
+            ]
+
+    if missing:
+        # create upserted events that don't exist yet
+        created = execute_calendar_changes(
+            [
+                CalendarChange(CalendarOperation.create, change.event_id, change.event)
+                for change in missing
+            ],
+            batch_limit,
+        )
+        upserts = {change.event_id: change for change in missing}
+        result.succeeded += [upserts[change.event_id] for change in created.succeeded]
+        result.failed += [
+            (upserts[change.event_id], exc) for change, exc in created.failed
+        ]
+    return result
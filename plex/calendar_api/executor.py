@@ -0,0 +1,96 @@
+"""
+Runs calendar syncs in the background.
+
+Syncs are submitted as plans (callables that compute the calendar changes) and run on
+a worker thread. Their changes are split into batches that are executed concurrently
+under a shared rate limit, and failed changes are retried with jittered backoff, or
+after the delay the api asks for.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from plex.calendar_api.base import (
+    CALENDAR_BACKEND,
+    CALENDAR_BATCH_LIMIT,
+    CALENDAR_RATE_LIMITER,
+    CalendarBatchResult,
+    CalendarChange,
+    execute_calendar_changes,
+)
+from plex.rate_limit import TokenBucket
+
+CalendarSyncPlan = Callable[[], list[CalendarChange]]
+
+
+class CalendarSyncExecutor:
+    def __init__(
+        self,
+        max_workers: int = 4,
+        rate_limiter: TokenBucket = CALENDAR_RATE_LIMITER,
+        max_retries: int = 3,
+        batch_limit: int = CALENDAR_BATCH_LIMIT,
+    ):
+        # plans run one at a time so syncs of the same date don't race each other
+        self.plan_pool = ThreadPoolExecutor(1, thread_name_prefix="calendar-plan")
+        self.batch_pool = ThreadPoolExecutor(
+            max_workers, thread_name_prefix="calendar-batch"
+        )
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.batch_limit = batch_limit
+
+    def submit(
+        self,
+        plan: CalendarSyncPlan,
+        callback: Optional[Callable[[Future], None]] = None,
+    ) -> Future:
+        """Runs the sync plan in the background.
+
+        Args:
+            plan (CalendarSyncPlan): computes the changes to make to the calendar
+            callback (Optional[Callable[[Future], None]], optional): called with the
+                future once the sync is done. Defaults to None.
+
+        Returns:
+            Future: resolves to the CalendarBatchResult of the sync
+        """
+        future = self.plan_pool.submit(self.run_plan, plan)
+        if callback is not None:
+            future.add_done_callback(callback)
+        return future
+
+    def run_plan(self, plan: CalendarSyncPlan) -> CalendarBatchResult:
+        # the plan's calendar requests are rate limited and retried by CALENDAR_BACKEND
+        changes = plan()
+        batches = [
+            changes[idx : idx + self.batch_limit]
+            for idx in range(0, len(changes), self.batch_limit)
+        ]
+        result = CalendarBatchResult()
+        for batch_result in self.batch_pool.map(self.run_batch, batches):
+            result.succeeded += batch_result.succeeded
+            result.failed += batch_result.failed
+        return result
+
+    def run_batch(self, changes: list[CalendarChange]) -> CalendarBatchResult:
+        result = CalendarBatchResult()
+
+        def execute_batch(batch: list[CalendarChange]) -> list:
+            batch_result = execute_calendar_changes(batch, self.batch_limit)
+            result.succeeded += batch_result.succeeded
+            return batch_result.failed
+
+        # changes that failed for good, or were deferred as the circuit is open
+        result.failed = CALENDAR_BACKEND.call_batches(
+            changes,
+            execute_batch,
+            self.batch_limit,
+            rate_limiter=self.rate_limiter,
+            max_retries=self.max_retries,
+        )
+        return result
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.plan_pool.shutdown(wait=wait)
+        self.batch_pool.shutdown(wait=wait)
@@ -0,0 +1,237 @@
+"""
+Local stand-in for the google calendar api, for offline testing.
+
+Implements the subset of the events resource used by plex, including sync tokens
+and batch requests. Use FakeGoogleCalendar in place of get_calendar().
+"""
+
+import copy
+import threading
+from datetime import datetime
+from typing import Callable, Optional
+
+import httplib2
+from gcsa.event import Event
+from gcsa.serializers.event_serializer import EventSerializer
+from googleapiclient.errors import HttpError
+
+
+def make_http_error(status: int, reason: str = "") -> HttpError:
+    return HttpError(httplib2.Response({"status": status}), reason.encode())
+
+
+class FakeRequest:
+    def __init__(self, service: "FakeCalendarService", method: Callable[[], dict]):
+        self.service = service
+        self.method = method
+
+    def execute(self) -> dict:
+        with self.service.lock:
+            self.service.num_http_requests += 1
+            return self.method()
+
+
+class FakeBatchHttpRequest:
+    def __init__(self, service: "FakeCalendarService", callback: Callable):
+        self.service = service
+        self.callback = callback
+        self.requests: list[tuple[str, FakeRequest]] = []
+
+    def add(self, request: FakeRequest, callback=None, request_id=None):
+        self.requests.append((request_id or str(len(self.requests)), request))
+
+    def execute(self):
+        with self.service.lock:
+            self.service.num_http_requests += 1
+            responses = []
+            for request_id, request in self.requests:
+                try:
+                    responses.append((request_id, request.method(), None))
+                except HttpError as err:
+                    responses.append((request_id, None, err))
+        for request_id, response, exc in responses:
+            self.callback(request_id, response, exc)
+
+
+class FakeEventsResource:
+    def __init__(self, service: "FakeCalendarService"):
+        self.service = service
+
+    def insert(self, calendarId: str, body: dict, **kwargs) -> FakeRequest:
+        def method():
+            event_id = body.get("id") or str(len(self.service.event_store))
+            if event_id in self.service.event_store:
+                # like the real api, ids of deleted events can't be reused by insert.
+                raise make_http_error(409, "The requested identifier already exists.")
+            return self.service.save_event(event_id, {**body, "status": "confirmed"})
+
+        return FakeRequest(self.service, method)
+
+    def update(self, calendarId: str, eventId: str, body: dict, **kwargs):
+        def method():
+            if eventId not in self.service.event_store:
+                raise make_http_error(404, "Not Found")
+            status = body.get("status", self.service.event_store[eventId]["status"])
+            return self.service.save_event(eventId, {**body, "status": status})
+
+        return FakeRequest(self.service, method)
+
+    def get(self, calendarId: str, eventId: str, **kwargs) -> FakeRequest:
+        def method():
+            if eventId not in self.service.event_store:
+                raise make_http_error(404, "Not Found")
+            return copy.deepcopy(self.service.event_store[eventId])
+
+        return FakeRequest(self.service, method)
+
+    def delete(self, calendarId: str, eventId: str, **kwargs) -> FakeRequest:
+        def method():
+            if eventId not in self.service.event_store:
+                raise make_http_error(404, "Not Found")
+            event = self.service.event_store[eventId]
+            if event["status"] == "cancelled":
+                raise make_http_error(410, "Resource has been deleted")
+            self.service.save_event(eventId, {**event, "status": "cancelled"})
+            return {}
+
+        return FakeRequest(self.service, method)
+
+    def list(
+        self,
+        calendarId: str,
+        syncToken: Optional[str] = None,
+        pageToken: Optional[str] = None,
+        timeMin: Optional[str] = None,
+        showDeleted: bool = False,
+        maxResults: Optional[int] = None,
+        **kwargs,
+    ) -> FakeRequest:
+        def method():
+            revisions = self.service.revisions
+            events = sorted(
+                self.service.event_store.values(),
+                key=lambda event: revisions[event["id"]],
+            )
+            if syncToken is not None:
+                if syncToken not in self.service.sync_tokens:
+                    raise make_http_error(410, "Sync token is no longer valid")
+                # edits since the token was issued, deletions are always included.
+                events = [
+                    event for event in events if revisions[event["id"]] > int(syncToken)
+                ]
+            else:
+                if not showDeleted:
+                    events = [
+                        event for event in events if event["status"] != "cancelled"
+                    ]
+                if timeMin is not None:
+                    time_min = datetime.fromisoformat(timeMin)
+                    events = [
+                        event
+                        for event in events
+                        if event["status"] == "cancelled"
+                        or datetime.fromisoformat(event["end"]["dateTime"]) >= time_min
+                    ]
+            offset = int(pageToken or 0)
+            page_size = maxResults or self.service.page_size
+            response = {"items": copy.deepcopy(events[offset : offset + page_size])}
+            if offset + page_size < len(events):
+                response["nextPageToken"] = str(offset + page_size)
+            else:
+                response["nextSyncToken"] = str(self.service.revision)
+                self.service.sync_tokens.add(response["nextSyncToken"])
+            return response
+
+        return FakeRequest(self.service, method)
+
+
+class FakeCalendarService:
+    """In memory events store mimicking the calendar v3 service resource."""
+
+    def __init__(self, page_size: int = 250):
+        self.event_store: dict[str, dict] = {}
+        self.revisions: dict[str, int] = {}  # event id: revision of last edit
+        self.revision = 0
+        self.sync_tokens: set[str] = set()  # valid issued tokens
+        self.page_size = page_size
+        self.num_http_requests = 0
+        self.lock = threading.RLock()  # requests may come from multiple threads
+
+    def events(self) -> FakeEventsResource:
+        return FakeEventsResource(self)
+
+    def new_batch_http_request(self, callback=None) -> FakeBatchHttpRequest:
+        return FakeBatchHttpRequest(self, callback)
+
+    def save_event(self, event_id: str, body: dict) -> dict:
+        self.revision += 1
+        self.revisions[event_id] = self.revision
+        self.event_store[event_id] = {
+            **copy.deepcopy(body),
+            "id": event_id,
+            "etag": f'"{self.revision}"',
+        }
+        return copy.deepcopy(self.event_store[event_id])
+
+    def expire_sync_tokens(self):
+        """Invalidates all previously issued sync tokens."""
+        self.sync_tokens.clear()
+
+
+class FakeGoogleCalendar:
+    """Stand-in for gcsa's GoogleCalendar backed by a FakeCalendarService."""
+
+    def __init__(self, service: Optional[FakeCalendarService] = None):
+        self.service = service or FakeCalendarService()
+        self.default_calendar = "primary"
+
+    def get_events(self, time_min: Optional[datetime] = None, **kwargs):
+        page_token = None
+        while True:
+            response = (
+                self.service.events()
+                .list(
+                    calendarId=self.default_calendar,
+                    timeMin=time_min.isoformat() if time_min else None,
+                    pageToken=page_token,
+                )
+                .execute()
+            )
+            for item in response["items"]:
+                yield EventSerializer.to_object(item)
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+
+    def get_event(self, event_id: str, **kwargs) -> Event:
+        return EventSerializer.to_object(
+            self.service.events()
+            .get(calendarId=self.default_calendar, eventId=event_id)
+            .execute()
+        )
+
+    def add_event(self, event: Event, **kwargs) -> Event:
+        return EventSerializer.to_object(
+            self.service.events()
+            .insert(
+                calendarId=self.default_calendar, body=EventSerializer.to_json(event)
+            )
+            .execute()
+        )
+
+    def update_event(self, event: Event, **kwargs) -> Event:
+        return EventSerializer.to_object(
+            self.service.events()
+            .update(
+                calendarId=self.default_calendar,
+                eventId=event.id,
+                body=EventSerializer.to_json(event),
+            )
+            .execute()
+        )
+
+    def delete_event(self, event, **kwargs) -> None:
+        event_id = event if isinstance(event, str) else event.id
+        self.service.events().delete(
+            calendarId=self.default_calendar, eventId=event_id
+        ).execute()
@@ -0,0 +1,236 @@
+"""
+Local sqlite mirror of plex calendar events.
+
+Keeps the last known state of each plex event (as reported by the calendar api) along
+with the sync token of the calendar, which covers the events of every date.
+Rows are updated transactionally together with the sync token, so the mirror stays
+consistent if the process dies mid-sync.
+The database is in WAL mode, so other processes can read it while it's being synced.
+"""
+
+import binascii
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator, Optional
+
+from plex.calendar_api.base import (
+    CALENDAR_EVENT_IDENTIFIER,
+    Event,
+    get_task_uuid_from_event_id,
+    is_event_cancelled,
+)
+
+MIRROR_FILE = "cache_files/calendar/calendar_mirror.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plex_events (
+    event_id TEXT PRIMARY KEY,
+    task_uuid TEXT NOT NULL,
+    date TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    description TEXT NOT NULL,
+    start TEXT NOT NULL,
+    end TEXT NOT NULL,
+    etag TEXT NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS plex_events_date ON plex_events (date);
+CREATE INDEX IF NOT EXISTS plex_events_task_uuid ON plex_events (task_uuid);
+CREATE TABLE IF NOT EXISTS calendar_sync_token (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    sync_token TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS calendar_edits (
+    event_id TEXT PRIMARY KEY,
+    date TEXT NOT NULL
+);
+"""
+
+
+@dataclass(frozen=True)
+class MirrorEvent:
+    event_id: str
+    task_uuid: str
+    date: str  # %Y-%m-%d
+    summary: str
+    description: str
+    start: datetime
+    end: datetime
+    etag: str
+    last_seen: float  # unix time of the last sync that reported the event
+
+
+@contextmanager
+def connect_to_mirror() -> Iterator[sqlite3.Connection]:
+    """Connects to the mirror, the block is run as a single transaction."""
+    os.makedirs(os.path.dirname(MIRROR_FILE), exist_ok=True)
+    connection = sqlite3.connect(MIRROR_FILE, timeout=30)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def get_date_id(datestr: str) -> str:
+    return datestr.replace("-", "")
+
+
+def get_task_uuid(event_id: str, datestr: str) -> str:
+    try:
+        return get_task_uuid_from_event_id(event_id, get_date_id(datestr))
+    except (binascii.Error, UnicodeDecodeError):
+        return ""  # not generated from a task
+
+
+def get_event_datestr(event_id: str) -> Optional[str]:
+    """Gets the date of a plex event from its id, None if it isn't for a date."""
+    date_id = event_id.removeprefix(CALENDAR_EVENT_IDENTIFIER)[:8]
+    try:
+        return datetime.strptime(date_id, "%Y%m%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def get_sync_token() -> Optional[str]:
+    with connect_to_mirror() as connection:
+        row = connection.execute(
+            "SELECT sync_token FROM calendar_sync_token WHERE id = 0"
+        ).fetchone()
+    return row[0] if row else None
+
+
+def save_events_to_mirror(
+    events: list[Event],
+    sync_token: Optional[str] = None,
+    is_full_sync: bool = False,
+    edited_event_ids: Optional[set[str]] = None,
+) -> None:
+    """Saves events reported by the calendar api, and the sync token they came with.
+
+    Each event is saved under the date of its id, events without a date are skipped.
+    Cancelled events are removed from the mirror.
+    If is_full_sync, events replace all mirrored events.
+
+    Args:
+        edited_event_ids (Optional[set[str]], optional): events edited in the calendar,
+            kept until their date is polled (see pop_calendar_edits). Defaults to None,
+            for events written by plex, which drops their edits.
+    """
+    last_seen = time.time()
+    with connect_to_mirror() as connection:
+        if is_full_sync:
+            connection.execute("DELETE FROM plex_events")
+            connection.execute("DELETE FROM calendar_edits")
+        for event in events:
+            datestr = get_event_datestr(event.id)
+            if datestr is None:
+                continue
+            if edited_event_ids is None:  # written by plex, overwriting any edit
+                connection.execute(
+                    "DELETE FROM calendar_edits WHERE event_id = ?", (event.id,)
+                )
+            elif event.id in edited_event_ids:
+                connection.execute(
+                    "INSERT OR REPLACE INTO calendar_edits VALUES (?, ?)",
+                    (event.id, datestr),
+                )
+            if is_event_cancelled(event):
+                connection.execute(
+                    "DELETE FROM plex_events WHERE event_id = ?", (event.id,)
+                )
+                continue
+            connection.execute(
+                "INSERT OR REPLACE INTO plex_events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    event.id,
+                    get_task_uuid(event.id, datestr),
+                    datestr,
+                    event.summary or "",
+                    event.description or "",
+                    event.start.isoformat(),
+                    event.end.isoformat(),
+                    (event.other or {}).get("etag", ""),
+                    last_seen,
+                ),
+            )
+        if sync_token is not None:
+            connection.execute(
+                "INSERT OR REPLACE INTO calendar_sync_token VALUES (0, ?)",
+                (sync_token,),
+            )
+
+
+def remove_events_from_mirror(event_ids: list[str]) -> None:
+    """Removes events deleted by plex, without touching the sync token."""
+    with connect_to_mirror() as connection:
+        connection.executemany(
+            "DELETE FROM plex_events WHERE event_id = ?",
+            [(event_id,) for event_id in event_ids],
+        )
+
+
+def make_mirror_event(row: tuple) -> MirrorEvent:
+    event_id, task_uuid, date, summary, description, start, end, etag, last_seen = row
+    return MirrorEvent(
+        event_id=event_id,
+        task_uuid=task_uuid,
+        date=date,
+        summary=summary,
+        description=description,
+        start=datetime.fromisoformat(start),
+        end=datetime.fromisoformat(end),
+        etag=etag,
+        last_seen=last_seen,
+    )
+
+
+def get_mirror_events(
+    start_datestr: str, end_datestr: Optional[str] = None
+) -> dict[str, MirrorEvent]:
+    """Gets mirrored events from start to end date (inclusive), keyed by event id."""
+    with connect_to_mirror() as connection:
+        rows = connection.execute(
+            "SELECT * FROM plex_events WHERE date BETWEEN ? AND ? ORDER BY start",
+            (start_datestr, end_datestr or start_datestr),
+        ).fetchall()
+    return {row[0]: make_mirror_event(row) for row in rows}
+
+
+def get_mirror_events_by_id(event_ids: list[str]) -> dict[str, MirrorEvent]:
+    with connect_to_mirror() as connection:
+        rows = [
+            row
+            for event_id in event_ids
+            for row in connection.execute(
+                "SELECT * FROM plex_events WHERE event_id = ?", (event_id,)
+            )
+        ]
+    return {row[0]: make_mirror_event(row) for row in rows}
+
+
+def pop_calendar_edits(datestr: str) -> list[MirrorEvent]:
+    """Gets the events of the date edited in the calendar, and forgets the edits."""
+    with connect_to_mirror() as connection:
+        rows = connection.execute(
+            "SELECT plex_events.* FROM calendar_edits JOIN plex_events"
+            " USING (event_id) WHERE calendar_edits.date = ? ORDER BY start",
+            (datestr,),
+        ).fetchall()
+        connection.execute("DELETE FROM calendar_edits WHERE date = ?", (datestr,))
+    return [make_mirror_event(row) for row in rows]
+
+
+def get_mirror_event_for_task(datestr: str, task_uuid: str) -> Optional[MirrorEvent]:
+    with connect_to_mirror() as connection:
+        row = connection.execute(
+            "SELECT * FROM plex_events WHERE date = ? AND task_uuid = ?",
+            (datestr, task_uuid),
+        ).fetchone()
+    return make_mirror_event(row) if row else None
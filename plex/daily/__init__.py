@@ -1 +1,5 @@
-from plex.daily.base import process_daily_file, sync_tasks_to_calendar
+from plex.daily.base import (
+    process_daily_file,
+    submit_tasks_to_calendar,
+    sync_tasks_to_calendar,
+)
@@ -1,10 +1,12 @@
 import time
+from concurrent.futures import Future
 from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
 from pprint import pformat
 
 from plex.daily.calendar import (
+    submit_calendar_sync,
     update_calendar_with_taskgroups,
     update_calendar_with_tasks,
 )
@@ -170,3 +172,20 @@ def sync_tasks_to_calendar(
                 write_taskgroups(taskgroups, filename)
             else:
                 time.sleep(10)
+
+
+def submit_tasks_to_calendar(datestr: str, filename: str) -> Future:
+    """Pushes tasks to calendar in the background, without blocking on the calendar api.
+
+    Args:
+        datestr (str): date in the form of %Y-%m-%d
+        filename (str): filename for daily processing
+
+    Returns:
+        Future: resolves once the calendar is synced
+    """
+    date = datetime.strptime(datestr, "%Y-%m-%d").astimezone()
+    date = date.replace(**DEFAULT_START_TIME)
+    taskgroups = read_taskgroups(filename, date)
+    taskgroups = calculate_times_in_taskgroup_list(taskgroups, date)
+    return submit_calendar_sync(flatten_taskgroups_into_tasks(taskgroups), datestr)
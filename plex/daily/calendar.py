@@ -1,114 +1,207 @@
+import functools
 import math
-import os
-import pickle
-from datetime import datetime, timedelta
+from concurrent.futures import Future
+from datetime import timedelta
+from typing import Optional
 
 from plex.calendar_api import (
-    create_calendar_event,
-    delete_calendar_event,
-    get_all_plex_calendar_events,
-    get_event,
-    update_calendar_event,
+    CalendarBatchResult,
+    CalendarChange,
+    CalendarOperation,
+    Event,
+    execute_calendar_changes,
+    generate_event_id,
+    get_plex_calendar_event_changes,
+    is_event_cancelled,
+    make_calendar_event,
 )
-from plex.daily.cache import load_from_cache, save_to_cache
-from plex.daily.tasks import (
-    DEFAULT_START_TIME,
-    Task,
-    TaskGroup,
-    flatten_taskgroups_into_tasks,
+from plex.calendar_api.executor import CalendarSyncExecutor
+from plex.calendar_api.mirror import (
+    MirrorEvent,
+    get_mirror_events,
+    get_mirror_events_by_id,
+    get_sync_token,
+    pop_calendar_edits,
+    remove_events_from_mirror,
+    save_events_to_mirror,
 )
+from plex.daily.tasks import Task, TaskGroup, flatten_taskgroups_into_tasks
 from plex.daily.tasks.base import update_taskgroups_with_changes
 
-CACHE_FILE = "cache_files/calendar/calendar_cache.pickle"
+CALENDAR_SYNC_EXECUTOR = CalendarSyncExecutor()
 
 
-def update_calendar_with_tasks(tasks: list[Task], datestr: str) -> dict[str, Task]:
-    """Syncs tasks with calendar tasks.
+def is_event_up_to_date(existing: Optional[MirrorEvent], event: Event) -> bool:
+    return (
+        existing is not None
+        and existing.summary == event.summary
+        and existing.start == event.start
+        and existing.end == event.end
+        and existing.description == (event.description or "")
+    )
+
+
+def plan_calendar_changes(tasks: list[Task], datestr: str) -> list[CalendarChange]:
+    """Gets the calendar changes needed to sync tasks with calendar tasks.
 
-    Given a cache (task_mapping), will update, create, or delete depending on __eq__ evaluation of tasks
+    Event ids are derived from the date and task uuid, so tasks are upserted by id.
+    Tasks are compared against the local mirror of calendar events, which is first
+    brought up to date with the events changed since the last poll.
 
-    Will update if __eq__ is true but other fields are not the same.
-    Will create if task doesn't exist in calendar
-    Will delete if task doesn't exist in cache or in tasks
+    Will upsert if the event doesn't exist or its summary, times or notes changed.
+    Will delete plex events of the date that don't correspond to a task.
 
     Args:
         tasks (list[Task]): list of tasks to be created
         datestr (str): datestr. To be used as key for calendar
-        task_mapping (dict[str, Task]): cache
 
     Returns:
-        dict[str, Task]: new updated cache (task_mapping)
+        list[CalendarChange]: changes to execute
     """
-    task_mapping: dict[str, Task] = load_from_cache(datestr, CACHE_FILE)
     date_id = datestr.replace("-", "")
-    date = datetime.strptime(datestr, "%Y-%m-%d").astimezone()
-    date = date.replace(**DEFAULT_START_TIME)
-    cal_event_ids = [
-        i.event_id
-        for i in get_all_plex_calendar_events(
-            date - timedelta(days=10), date_id=date_id
+    poll_calendar_changes()
+    cal_events = get_mirror_events(datestr)
+
+    changes: list[CalendarChange] = []
+    for task in tasks:
+        assert task.start and task.end
+        event_id = generate_event_id(date_id, task.uuid)
+        event = make_calendar_event(
+            event_id,
+            summary=task.name,
+            start=task.start,
+            end=task.end,
+            notes="".join(task.notes),
         )
-    ]
+        if not is_event_up_to_date(cal_events.pop(event_id, None), event):
+            changes.append(CalendarChange(CalendarOperation.upsert, event_id, event))
+    if changes:
+        print(f"Updating {len(changes)} tasks.")
 
-    # delete tasks that don't exist in task_mapping
-    # filter out tasks that have changed
-    new_task_mapping = {}
-    for event_id, task in task_mapping.items():
-        if task in tasks and event_id in cal_event_ids:
-            cal_event_ids.pop(cal_event_ids.index(event_id))
-            new_task = tasks.pop(tasks.index(task))
-            # use task from new tasks to be created
-            new_task_mapping[event_id] = new_task
-            if task.start != new_task.start or task.end != new_task.end:
-                assert new_task.start and new_task.end
-                update_calendar_event(
-                    event_id,
-                    summary=task.name,
-                    start=new_task.start,
-                    end=new_task.end,
-                    notes="".join(task.notes),
-                    date_id=date_id,
-                )
-    task_mapping = new_task_mapping
-    if len(cal_event_ids):
+    if cal_events:
         print(
-            f"Deleting {len(cal_event_ids)} tasks that are in the calendar but not in latest config"
+            f"Deleting {len(cal_events)} tasks that are in the calendar but not in latest config"
         )
-    for event_id in cal_event_ids:
-        # delete events that are in the cal but not in task_mapping
-        # we do this since we don't have a way to convert from event to task
-        # so even if an event matches a task, since it's not in the cache, delete.
-        delete_calendar_event(get_event(event_id))
-
-    # create tasks that don't exist in task_mapping
-    if len(tasks):
-        print(f"Creating {len(tasks)} tasks.")
-    for task in tasks:
-        assert task.start and task.end
-        try:
-            event_id = create_calendar_event(
-                summary=task.name,
-                start=task.start,
-                end=task.end,
-                notes="".join(task.notes),
-                date_id=date_id,
-            )
-        except Exception as exc:
-            print(f"Unable to add task '{task}'. Exception: {str(exc)}")
-        task_mapping[event_id] = task
-
-    save_to_cache(task_mapping, datestr, CACHE_FILE)
-    return task_mapping
+    for event_id in cal_events:
+        changes.append(CalendarChange(CalendarOperation.delete, event_id))
+    return changes
+
+
+def update_calendar_with_tasks(tasks: list[Task], datestr: str) -> dict[str, Task]:
+    """Syncs tasks with calendar tasks. See plan_calendar_changes.
+
+    Returns:
+        dict[str, Task]: event id to task mapping (task_mapping)
+    """
+    result = execute_calendar_changes(plan_calendar_changes(tasks, datestr))
+    save_pushed_changes_to_mirror(result)
+    for change, exc in result.failed:
+        print(f"Unable to {change.operation.value} event. Exception: {str(exc)}")
+    date_id = datestr.replace("-", "")
+    return {generate_event_id(date_id, task.uuid): task for task in tasks}
+
+
+def save_pushed_changes_to_mirror(result: CalendarBatchResult) -> None:
+    """Saves the events written by plex to the mirror.
+
+    The next poll reports them back as changed, they're told apart from calendar
+    edits by matching the mirror (see get_calendar_events_changed_since_last_poll).
+    """
+    save_events_to_mirror(
+        [
+            change.event
+            for change in result.succeeded
+            if change.operation != CalendarOperation.delete and change.event
+        ]
+    )
+    remove_events_from_mirror(
+        [
+            change.event_id
+            for change in result.succeeded
+            if change.operation == CalendarOperation.delete
+        ]
+    )
+
+
+def report_calendar_sync(future: Future) -> None:
+    if future.exception() is not None:
+        print(f"Calendar ERROR: {future.exception()}")
+        return
+    # done callbacks run on the plan thread, before the next sync is planned
+    save_pushed_changes_to_mirror(future.result())
+    for change, exc in future.result().failed:
+        print(f"Unable to {change.operation.value} event. Exception: {str(exc)}")
+
+
+def submit_calendar_sync(tasks: list[Task], datestr: str) -> Future:
+    """Syncs tasks with calendar tasks in the background. See plan_calendar_changes.
+
+    Failed changes are retried with backoff, remaining failures are reported once done.
+    """
+    return CALENDAR_SYNC_EXECUTOR.submit(
+        functools.partial(plan_calendar_changes, tasks, datestr),
+        callback=report_calendar_sync,
+    )
+
+
+def poll_calendar_changes() -> None:
+    """Brings the mirror up to date with the plex events edited since the previous poll.
+
+    Uses the calendar api's sync token, which covers the whole calendar, so only the
+    first poll (or one after the mirror is lost) lists every event.
+    Changed events are saved to the mirror under their date, together with the new
+    sync token. Events that no longer match the mirror are recorded as edits, events
+    that still match are plex's own writes coming back.
+    The first poll records no edits, as edits made before then can't be told apart
+    from events that are pending an update.
+    """
+    sync_token = get_sync_token()
+    events, next_sync_token = get_plex_calendar_event_changes(sync_token)
+    edited_event_ids = set()
+    if sync_token is not None:
+        mirror_events = get_mirror_events_by_id([event.id for event in events])
+        edited_event_ids = {
+            event.id
+            for event in events
+            if not is_event_cancelled(event)
+            and not is_event_up_to_date(mirror_events.get(event.id), event)
+        }
+    save_events_to_mirror(
+        events,
+        next_sync_token,
+        is_full_sync=sync_token is None,
+        edited_event_ids=edited_event_ids,
+    )
+
+
+def get_calendar_events_changed_since_last_poll(datestr: str) -> list[Event]:
+    """Gets plex events for the date edited in the calendar. See poll_calendar_changes.
+
+    Edits of other dates are kept in the mirror until their date is polled.
+    """
+    poll_calendar_changes()
+    return [
+        make_calendar_event(
+            event.event_id,
+            summary=event.summary,
+            start=event.start,
+            end=event.end,
+            notes=event.description,
+        )
+        for event in pop_calendar_edits(datestr)
+    ]
 
 
 def get_updates_from_calendar(
-    task_mapping: dict[str, Task]
+    task_mapping: dict[str, Task], events: list[Event]
 ) -> dict[str, dict[str, int]]:
-    # get new diffs
+    # get new diffs, only for events that were changed.
     changes = {}
-    for event_id, task in task_mapping.items():
+    for event in events:
+        if event.id not in task_mapping or is_event_cancelled(event):
+            continue
+        task = task_mapping[event.id]
         assert task.start and task.end
-        event = get_event(event_id)
         start_diff = math.ceil(
             (
                 event.start
@@ -150,11 +243,16 @@ def get_updates_from_calendar(
 def update_calendar_with_taskgroups(
     taskgroups: list[TaskGroup], datestr: str
 ) -> list[TaskGroup]:
-    # modify existing calendar
     tasks = flatten_taskgroups_into_tasks(taskgroups)
-    task_mapping = update_calendar_with_tasks(tasks, datestr)
-    changes = get_updates_from_calendar(task_mapping)
+    date_id = datestr.replace("-", "")
+    task_mapping = {generate_event_id(date_id, task.uuid): task for task in tasks}
+    # get calendar edits before pushing, otherwise the push would overwrite them.
+    changes = get_updates_from_calendar(
+        task_mapping, get_calendar_events_changed_since_last_poll(datestr)
+    )
     if changes:
         print(f"Found Changed Items: {changes}")
         return update_taskgroups_with_changes(taskgroups, changes)
+    # modify existing calendar
+    update_calendar_with_tasks(tasks, datestr)
     return []
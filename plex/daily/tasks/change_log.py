@@ -0,0 +1,74 @@
+"""
+Append-only log of pending changes, so they survive restarts.
+
+Each line is a json record, either an entry ({"id": int, "data": {...}}) or an
+acknowledgement of a completed entry ({"ack": int}). Entries that were never
+acknowledged are outstanding, and are replayed on startup.
+"""
+
+import json
+import os
+
+
+class ChangeLog:
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.is_loaded = False
+        self.next_id = 0
+        self.num_outstanding = 0
+
+    def write(self, records: list[dict], mode: str = "a") -> None:
+        os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+        with open(self.filepath, mode) as file:
+            for record in records:
+                file.write(json.dumps(record) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+    def read_outstanding(self) -> dict[int, dict]:
+        outstanding: dict[int, dict] = {}
+        if not os.path.exists(self.filepath):
+            return outstanding
+        with open(self.filepath) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # partially written line
+                if "ack" in record:
+                    outstanding.pop(record["ack"], None)
+                else:
+                    outstanding[record["id"]] = record["data"]
+                    self.next_id = max(self.next_id, record["id"] + 1)
+        return outstanding
+
+    def replay(self) -> list[tuple[int, dict]]:
+        """Gets the outstanding entries in the order they were logged.
+
+        Returns:
+            list[tuple[int, dict]]: entry id and data of each outstanding entry
+        """
+        entries = list(self.read_outstanding().items())
+        # compact the log to the outstanding entries
+        self.write([{"id": entry_id, "data": data} for entry_id, data in entries], "w")
+        self.num_outstanding = len(entries)
+        self.is_loaded = True
+        return entries
+
+    def append(self, data: dict) -> int:
+        """Logs the data, and returns the entry id used to acknowledge it."""
+        if not self.is_loaded:
+            self.replay()
+        entry_id = self.next_id
+        self.next_id += 1
+        self.write([{"id": entry_id, "data": data}])
+        self.num_outstanding += 1
+        return entry_id
+
+    def ack(self, entry_id: int) -> None:
+        self.num_outstanding -= 1
+        if self.num_outstanding:
+            self.write([{"ack": entry_id}])
+        else:
+            # nothing is outstanding, start over.
+            self.write([], "w")
@@ -1,12 +1,16 @@
 """
 Defines functions for pushing notes to the google tasks
 """
-import queue
+
+import dataclasses
+import difflib
 import re
+import threading
 import time
 from collections import defaultdict
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 from datetime import date, datetime
+from enum import Enum, IntEnum
 from functools import reduce
 from typing import Optional, TypedDict, Union
 
@@ -14,6 +18,7 @@ from notion_client.errors import APIResponseError
 
 from plex.daily.cache import load_from_cache, save_to_cache
 from plex.daily.tasks.base import Task, TaskGroup, flatten_taskgroups_into_tasks
+from plex.daily.tasks.change_log import ChangeLog
 from plex.daily.tasks.config import (
     TaskType,
     convert_string_section_to_config_str,
@@ -44,58 +49,443 @@ from plex.notion_api.page import (
     clear_page_cache,
     delete_block,
     get_block,
+    get_child_blocks,
     get_contents,
+    get_contents_incrementally,
     get_page,
     get_subpages,
+    invalidate_page_mirrors,
+    make_notion_json,
     update_task,
 )
 from plex.transform.base import TRANSFORM, LineSection, Metadata, TransformStr
 
-# critical queues (as it's not a pure replacement)
-PREPROCESSED = queue.Queue()
 
-# non critical queues (pure replacement, idempotent)
-DELETIONS = queue.Queue()
-REGULAR = queue.Queue()
+class ChangePriority(IntEnum):
+    """Order in which changes are sent to notion, lowest first."""
+
+    # critical (as it's not a pure replacement)
+    preprocessed = 0
+    # non critical (pure replacement, idempotent)
+    deletion = 1
+    regular = 2
+
+
+class ChangeDispatcher:
+    """Priority queue of notion changes.
+
+    get blocks while there are no changes, and returns the highest priority change
+    (first in, first out within a priority). Changes under the same parent block are
+    handed out one at a time, in order, so workers can run changes concurrently
+    without reordering the blocks of a parent.
+
+    Pending changes are coalesced per notion block: a change for a block that
+    already has a pending change replaces it, as pending changes haven't touched the
+    block and the latest one is computed from the latest notion state.
+
+    If a change log is given, changes are logged when put and acknowledged once
+    applied (or replaced), so the changes outstanding on exit can be replayed.
+    """
+
+    def __init__(self, change_log: Optional[ChangeLog] = None):
+        self.condition = threading.Condition()
+        self.change_log = change_log
+        # notion uuid to pending change, in insertion order
+        self.pending: dict[ChangePriority, dict[str, "ChangeSet"]] = {
+            priority: {} for priority in ChangePriority
+        }
+        # pending + in progress changes
+        self.unfinished: dict[ChangePriority, int] = {
+            priority: 0 for priority in ChangePriority
+        }
+        self.num_coalesced = 0
+        # change log entries of pending changes, keyed by notion uuid
+        self.pending_entries: dict[str, int] = {}
+        # parents with a change in progress, to the change's log entry
+        self.active_parents: dict[str, Optional[int]] = {}
+
+    def ack(self, entry_id: Optional[int]) -> None:
+        if self.change_log is not None and entry_id is not None:
+            self.change_log.ack(entry_id)
+
+    def pop_pending(self, notion_uuid: str) -> Optional["ChangeSet"]:
+        for priority in ChangePriority:
+            if notion_uuid in self.pending[priority]:
+                self.unfinished[priority] -= 1
+                self.ack(self.pending_entries.pop(notion_uuid, None))
+                return self.pending[priority].pop(notion_uuid)
+        return None
+
+    def add_pending(
+        self, change_set: "ChangeSet", priority: ChangePriority, entry_id: Optional[int]
+    ) -> None:
+        if self.pop_pending(change_set.notion_uuid) is not None:
+            self.num_coalesced += 1
+        if is_noop_change(change_set):
+            self.ack(entry_id)
+            return
+        self.pending[priority][change_set.notion_uuid] = change_set
+        self.unfinished[priority] += 1
+        if entry_id is not None:
+            self.pending_entries[change_set.notion_uuid] = entry_id
+
+    def put(self, change_set: "ChangeSet", priority: ChangePriority) -> None:
+        with self.condition:
+            entry_id = None
+            if self.change_log is not None and not is_noop_change(change_set):
+                entry_id = self.change_log.append(
+                    {"priority": int(priority), "change_set": asdict(change_set)}
+                )
+            self.add_pending(change_set, priority, entry_id)
+            self.condition.notify_all()
+
+    def replay(self) -> int:
+        """Queues the changes that were outstanding in the change log.
+
+        Returns:
+            int: number of replayed changes
+        """
+        if self.change_log is None:
+            return 0
+        with self.condition:
+            entries = self.change_log.replay()
+            for entry_id, data in entries:
+                self.add_pending(
+                    ChangeSet(**data["change_set"]),
+                    ChangePriority(data["priority"]),
+                    entry_id,
+                )
+            self.condition.notify_all()
+        return len(entries)
+
+    def discard(self, notion_uuid: str) -> None:
+        """Drops the pending change of the block, if any."""
+        with self.condition:
+            if self.pop_pending(notion_uuid) is not None:
+                self.num_coalesced += 1
+            self.condition.notify_all()
+
+    def get_next_ready(self) -> Optional[tuple[ChangePriority, "ChangeSet"]]:
+        for priority in ChangePriority:
+            for notion_uuid, change_set in self.pending[priority].items():
+                if get_parent_key(change_set) not in self.active_parents:
+                    del self.pending[priority][notion_uuid]
+                    self.active_parents[get_parent_key(change_set)] = (
+                        self.pending_entries.pop(notion_uuid, None)
+                    )
+                    return priority, change_set
+        return None
+
+    def get(self) -> tuple[ChangePriority, "ChangeSet"]:
+        with self.condition:
+            while (ready := self.get_next_ready()) is None:
+                self.condition.wait()
+            return ready
+
+    def task_done(
+        self, priority: ChangePriority, change_set: "ChangeSet", is_applied=True
+    ) -> None:
+        """Marks the change from get as done.
+
+        Changes that weren't applied stay in the change log, to be replayed.
+        """
+        with self.condition:
+            self.unfinished[priority] -= 1
+            entry_id = self.active_parents.pop(get_parent_key(change_set), None)
+            if is_applied:
+                self.ack(entry_id)
+            self.condition.notify_all()
+
+    def empty(self, priority: Optional[ChangePriority] = None) -> bool:
+        """If there are no pending changes (of the priority if specified)."""
+        with self.condition:
+            priorities = ChangePriority if priority is None else [priority]
+            return not any(self.pending[p] for p in priorities)
+
+    def join(self, priority: Optional[ChangePriority] = None) -> None:
+        """Blocks until all changes (of the priority if specified) are done."""
+        with self.condition:
+            priorities = ChangePriority if priority is None else [priority]
+            while any(self.unfinished[p] for p in priorities):
+                self.condition.wait()
+
+    def clear(self) -> None:
+        """Drops pending changes and waits for the ones in progress."""
+        with self.condition:
+            for priority in ChangePriority:
+                self.unfinished[priority] -= len(self.pending[priority])
+                self.pending[priority].clear()
+            for entry_id in self.pending_entries.values():
+                self.ack(entry_id)
+            self.pending_entries.clear()
+            self.condition.notify_all()
+        self.join()
+
+
+def is_noop_change(change_set: "ChangeSet") -> bool:
+    return change_set.final_states == [change_set.initial_state]
+
+
+def get_parent_key(change_set: "ChangeSet") -> str:
+    # blocks without a parent block are at the top level of the date's page
+    return change_set.parent_notion_uuid or change_set.datestr
+
+
+NOTION_CHANGE_LOG_FILE = "cache_files/notion/pending_changes.jsonl"
+NOTION_CHANGES = ChangeDispatcher(ChangeLog(NOTION_CHANGE_LOG_FILE))
+# requests of all workers share the notion client's rate limiter.
+NOTION_CHANGE_WORKERS = 4
+NOTION_REQUESTOR_LOCK = threading.Lock()
+NOTION_REQUESTOR: list[threading.Thread] = []
 
 
 def notion_requestor():
     while True:
-        cur_queue = None
-        if not PREPROCESSED.empty():
-            cur_queue = PREPROCESSED
-        elif not DELETIONS.empty():
-            cur_queue = DELETIONS
-        elif not REGULAR.empty():
-            cur_queue = REGULAR
-        if cur_queue:
-            update_latest_representations(cur_queue.get())
-            cur_queue.task_done()
-
-
-def clear_queues(current_q: queue.Queue) -> None:
-    while not current_q.empty():
+        priority, change_set = NOTION_CHANGES.get()
+        is_applied = False
         try:
-            current_q.get(block=False)
-        except queue.Empty:
-            continue
-        current_q.task_done()
-    current_q.join()
+            update_latest_representations(change_set)
+            is_applied = True
+        except Exception as err:
+            print(f"Notion ERROR: Unable to apply {change_set}. Error: {str(err)}")
+        finally:
+            NOTION_CHANGES.task_done(priority, change_set, is_applied)
+
+
+def start_notion_requestor(num_workers: int = NOTION_CHANGE_WORKERS) -> None:
+    """Starts the threads that send queued changes to notion, if not started yet.
+
+    Changes left outstanding by a previous run are replayed first.
+    """
+    with NOTION_REQUESTOR_LOCK:
+        if not NOTION_REQUESTOR and (num_replayed := NOTION_CHANGES.replay()):
+            print(f"Replaying {num_replayed} outstanding notion changes")
+        while len(NOTION_REQUESTOR) < num_workers:
+            thread = threading.Thread(target=notion_requestor, daemon=True)
+            thread.start()
+            NOTION_REQUESTOR.append(thread)
 
 
 def overwrite_tasks_in_notion(datestr: str):
     if subpage_id := get_subpages().get(datestr):
         print("Removing Existing Page...")
-        for current_q in [PREPROCESSED, DELETIONS, REGULAR]:
-            clear_queues(current_q)
+        NOTION_CHANGES.clear()
         delete_block(notion_uuid=subpage_id)
         while datestr in get_subpages():
             time.sleep(0.5)
     return sync_tasks_to_notion(datestr, force_push=True)
 
 
+class NotionEditOperation(Enum):
+    insert = "insert"
+    update = "update"
+    delete = "delete"
+
+
+@dataclass
+class NotionEdit:
+    operation: NotionEditOperation
+    # block to update or delete, or block to insert after (None inserts at the end)
+    notion_uuid: Optional[str] = None
+    parent_notion_uuid: Optional[str] = None
+    sections: list[StringSection] = dataclasses.field(default_factory=list)
+
+
+def get_section_json(section: StringSection) -> list[dict]:
+    """Notion json of the section's own block(s), without children."""
+    if isinstance(section, TaskStringSections):
+        section = dataclasses.replace(section, children=[])
+    return [
+        make_notion_json(ncontent)
+        for ncontent in convert_sections_to_notion_contents([section])
+    ]
+
+
+def get_section_key(section: StringSection) -> str:
+    # tasks are matched by task uuid, other lines by content.
+    if isinstance(section, TaskStringSections):
+        return section.uuid.strip()
+    return repr(get_section_json(section))
+
+
+def plan_notion_edits(
+    local_sections: list[StringSection],
+    notion_sections: list[StringSection],
+    parent_notion_uuid: Optional[str] = None,
+) -> list[NotionEdit]:
+    """Gets the edits that make the notion sections match the local sections.
+
+    Sections of a level are aligned by task uuid. Aligned tasks are updated if they
+    differ and their children are reconciled, the rest is deleted or inserted (moves
+    are a delete and an insert). Blocks can only be inserted after an existing block,
+    so sections before the first kept block are inserted after it along with a copy
+    of it, and the original is deleted.
+
+    Args:
+        local_sections (list[StringSection]): sections to have in notion
+        notion_sections (list[StringSection]): sections pulled from notion
+        parent_notion_uuid (Optional[str], optional): parent block of the sections.
+            Defaults to None, the date's page.
+
+    Returns:
+        list[NotionEdit]: edits to apply, in order
+    """
+    matcher = difflib.SequenceMatcher(
+        None,
+        [get_section_key(section) for section in notion_sections],
+        [get_section_key(section) for section in local_sections],
+        autojunk=False,
+    )
+    opcodes = matcher.get_opcodes()
+    edits = []
+    if (
+        opcodes
+        and opcodes[0][0] in ("insert", "replace")
+        and any(tag == "equal" for tag, *_ in opcodes)
+    ):
+        edits, opcodes = plan_prefix_edits(
+            local_sections, notion_sections, opcodes, parent_notion_uuid
+        )
+
+    after_notion_uuid = None
+    for tag, notion_start, notion_end, local_start, local_end in opcodes:
+        if tag == "equal":
+            for notion_section, local_section in zip(
+                notion_sections[notion_start:notion_end],
+                local_sections[local_start:local_end],
+            ):
+                if get_section_json(notion_section) != get_section_json(local_section):
+                    edits.append(
+                        NotionEdit(
+                            NotionEditOperation.update,
+                            notion_section.notion_uuid,
+                            parent_notion_uuid,
+                            [local_section],
+                        )
+                    )
+                if isinstance(local_section, TaskStringSections):
+                    edits += plan_notion_edits(
+                        local_section.children,
+                        notion_section.children,
+                        notion_section.notion_uuid,
+                    )
+                after_notion_uuid = notion_section.notion_uuid
+            continue
+        for notion_section in notion_sections[notion_start:notion_end]:
+            edits.append(
+                NotionEdit(
+                    NotionEditOperation.delete,
+                    notion_section.notion_uuid,
+                    parent_notion_uuid,
+                )
+            )
+        if local_start < local_end:
+            edits.append(
+                NotionEdit(
+                    NotionEditOperation.insert,
+                    after_notion_uuid,
+                    parent_notion_uuid,
+                    local_sections[local_start:local_end],
+                )
+            )
+    return edits
+
+
+def plan_prefix_edits(
+    local_sections: list[StringSection],
+    notion_sections: list[StringSection],
+    opcodes: list[tuple],
+    parent_notion_uuid: Optional[str],
+) -> tuple[list[NotionEdit], list[tuple]]:
+    """Edits for the inserts before the first kept block, see plan_notion_edits.
+
+    Returns:
+        tuple[list[NotionEdit], list[tuple]]: edits, and the opcodes left to plan
+    """
+    _, notion_start, notion_end, local_start, local_end = opcodes[0]
+    deleted = notion_sections[notion_start:notion_end]
+    inserted = local_sections[local_start:local_end]
+    _, notion_start, notion_end, local_start, local_end = opcodes[1]
+    kept = notion_sections[notion_start]
+    inserted.append(local_sections[local_start])
+    rest = opcodes[2:]
+    if notion_end - notion_start > 1:
+        rest.insert(
+            0, ("equal", notion_start + 1, notion_end, local_start + 1, local_end)
+        )
+    elif rest and rest[0][0] in ("insert", "replace"):
+        # sections after the copy can't be inserted after it (it has no id yet)
+        _, notion_start, notion_end, local_start, local_end = rest.pop(0)
+        deleted += notion_sections[notion_start:notion_end]
+        inserted += local_sections[local_start:local_end]
+
+    edits = [
+        NotionEdit(NotionEditOperation.delete, section.notion_uuid, parent_notion_uuid)
+        for section in deleted
+    ]
+    edits.append(
+        NotionEdit(
+            NotionEditOperation.insert, kept.notion_uuid, parent_notion_uuid, inserted
+        )
+    )
+    edits.append(
+        NotionEdit(NotionEditOperation.delete, kept.notion_uuid, parent_notion_uuid)
+    )
+    return edits, rest
+
+
+def apply_notion_edit(edit: NotionEdit, datestr: str) -> None:
+    if edit.operation == NotionEditOperation.delete:
+        delete_block(notion_uuid=edit.notion_uuid)
+    elif edit.operation == NotionEditOperation.update:
+        # only tasks are updated, their children are reconciled separately.
+        (section,) = edit.sections
+        (ncontent,) = convert_sections_to_notion_contents(
+            [dataclasses.replace(section, children=[])]
+        )
+        update_task(ncontent, notion_uuid=edit.notion_uuid)
+    else:
+        add_tasks_after(
+            convert_sections_to_notion_contents(edit.sections),
+            edit.notion_uuid,
+            parent_uuid=edit.parent_notion_uuid,
+            default_page_name=datestr,
+        )
+
+
+def reconcile_tasks_in_notion(datestr: str) -> bool:
+    """Makes the notion page match the local tasks, by applying only the differences.
+
+    Pending changes are dropped, as the reconciliation supersedes them.
+    Falls back to overwriting if the page has no content.
+
+    Returns:
+        bool: if notion was changed
+    """
+    NOTION_CHANGES.clear()
+    clear_page_cache()
+    # pull the whole page again, rather than diffing against the previous pull
+    invalidate_page_mirrors()
+    PULLED_SECTIONS.pop(datestr, None)
+    notion_sections = pull_tasks_from_notion(datestr)
+    if not notion_sections:
+        return overwrite_tasks_in_notion(datestr)
+    _, _, new_tasks = split_lines_across_splitter(
+        TRANSFORM.construct_content(), is_separate_splitter=True
+    )
+    local_sections = unflatten_string_sections(
+        [convert_config_str_to_string_section(new_task) for new_task in new_tasks]
+    )
+    edits = plan_notion_edits(local_sections, notion_sections)
+    print(f"Reconciling Notion Tasks for {datestr} with {len(edits)} edits...")
+    for edit in edits:
+        apply_notion_edit(edit, datestr)
+    return bool(edits)
+
+
 def sync_tasks_to_notion(datestr, force_push=False) -> bool:
     """Syncs with notion tasks"""
+    pulled_time = time.time()
     notion_sections = None if force_push else pull_tasks_from_notion(datestr)
     is_changed = False
     # find tasks to add, update, delete
@@ -138,17 +528,22 @@ def sync_tasks_to_notion(datestr, force_push=False) -> bool:
                     show_all_lines_generated_from_focus=True,
                 )
             if len(final_state) == 1 and final_state[0] == initial_state:
+                # notion already has the latest state, pending changes are obsolete
+                if notion_uuid is not None:
+                    NOTION_CHANGES.discard(notion_uuid)
                 continue
             if notion_uuid in current_tasks:
                 if not final_state:
-                    DELETIONS.put(
+                    NOTION_CHANGES.put(
                         ChangeSet(
                             datestr,
                             notion_uuid,
                             initial_state,
                             final_state,
                             parent_notion_uuid=current_tasks[notion_uuid],
-                        )
+                            pulled_time=pulled_time,
+                        ),
+                        ChangePriority.deletion,
                     )
                 elif (
                     any(
@@ -156,7 +551,7 @@ def sync_tasks_to_notion(datestr, force_push=False) -> bool:
                     )
                     or len(final_state) > 1
                 ):
-                    PREPROCESSED.put(
+                    NOTION_CHANGES.put(
                         ChangeSet(
                             datestr,
                             notion_uuid,
@@ -164,7 +559,9 @@ def sync_tasks_to_notion(datestr, force_push=False) -> bool:
                             final_state,
                             is_replace_ok=False,
                             parent_notion_uuid=current_tasks[notion_uuid],
-                        )
+                            pulled_time=pulled_time,
+                        ),
+                        ChangePriority.preprocessed,
                     )
                 else:
                     new_regular.append(
@@ -174,15 +571,16 @@ def sync_tasks_to_notion(datestr, force_push=False) -> bool:
                             initial_state,
                             final_state,
                             parent_notion_uuid=current_tasks[notion_uuid],
+                            pulled_time=pulled_time,
                         )
                     )
 
-        if DELETIONS.empty() and PREPROCESSED.empty() and REGULAR.empty():
+        if NOTION_CHANGES.empty():
             # update regular infrequently - only when the previous batch is fully processed.
             if new_regular:
                 # note: we don't clear the queue here to prevent excessive clearing.
                 for nreg in new_regular:
-                    REGULAR.put(nreg)
+                    NOTION_CHANGES.put(nreg, ChangePriority.regular)
                 is_changed = True
         else:
             is_changed = True
@@ -197,6 +595,8 @@ class ChangeSet:
     final_states: list[str]
     is_replace_ok: bool = True
     parent_notion_uuid: Optional[str] = None
+    # when the notion state the change was computed from was pulled
+    pulled_time: float = 0.0
 
 
 def update_latest_representations(change_set: ChangeSet):
@@ -206,10 +606,12 @@ def update_latest_representations(change_set: ChangeSet):
             [convert_config_str_to_string_section(fs) for fs in change_set.final_states]
         )
     )
-    latest_str_rep = get_latest_str_representation(
-        change_set.notion_uuid,
+    latest_str_rep = convert_block_to_config_str(
+        get_latest_block(change_set),
         len(convert_config_str_to_string_section(change_set.initial_state).indentation),
     )
+    # the block is being rewritten, its snapshot is outdated.
+    drop_block_from_snapshot(change_set)
     if latest_str_rep == change_set.initial_state:
         print(
             f"Updating '{repr(change_set.initial_state)}' to '{change_set.final_states}'"
@@ -231,10 +633,9 @@ def update_latest_representations(change_set: ChangeSet):
         )
 
 
-def get_latest_str_representation(
-    notion_uuid: int, indent_level: int = 0
+def convert_block_to_config_str(
+    block: Optional[NotionContent], indent_level: int = 0
 ) -> Optional[str]:
-    block = get_block(notion_uuid)
     if block:
         return convert_string_section_to_config_str(
             convert_notion_contents_to_string_sections(
@@ -243,6 +644,64 @@ def get_latest_str_representation(
         )
 
 
+def get_latest_str_representation(
+    notion_uuid: int, indent_level: int = 0
+) -> Optional[str]:
+    return convert_block_to_config_str(get_block(notion_uuid), indent_level)
+
+
+# parent key: (fetch time, block id: block), children listings shared by the
+# staleness checks of all changes under the parent.
+BLOCK_SNAPSHOTS: dict[str, tuple[float, dict[str, NotionContent]]] = {}
+BLOCK_SNAPSHOTS_LOCK = threading.Lock()
+BLOCK_SNAPSHOT_TTL = 1  # seconds
+
+
+def get_latest_block(change_set: ChangeSet) -> Optional[NotionContent]:
+    """Gets the latest version of the change's block, None if it was deleted.
+
+    Blocks are looked up in a recent children listing of the change's parent. It's
+    listed again if it's too old, doesn't have the block, or was fetched before the
+    change was computed, as it could miss edits the change didn't see.
+    """
+    key = get_parent_key(change_set)
+    with BLOCK_SNAPSHOTS_LOCK:
+        fetched_time, blocks = BLOCK_SNAPSHOTS.get(key, (0.0, {}))
+    if (
+        change_set.pulled_time <= fetched_time
+        and time.time() - fetched_time < BLOCK_SNAPSHOT_TTL
+        and change_set.notion_uuid in blocks
+    ):
+        return blocks[change_set.notion_uuid]
+    fetched_time = time.time()
+    try:
+        blocks = get_child_blocks(
+            change_set.parent_notion_uuid or get_page(change_set.datestr)["id"]
+        )
+    except (APIResponseError, PageNotFoundError):
+        return None
+    with BLOCK_SNAPSHOTS_LOCK:
+        BLOCK_SNAPSHOTS[key] = (fetched_time, blocks)
+    return blocks.get(change_set.notion_uuid)
+
+
+def drop_block_from_snapshot(change_set: ChangeSet) -> None:
+    with BLOCK_SNAPSHOTS_LOCK:
+        if (snapshot := BLOCK_SNAPSHOTS.get(get_parent_key(change_set))) is not None:
+            snapshot[1].pop(change_set.notion_uuid, None)
+
+
+# datestr: string sections of the last notion pull
+PULLED_SECTIONS: dict[str, list[StringSection]] = {}
+
+
+def clear_notion_snapshots() -> None:
+    """Forgets the blocks and sections pulled from notion, eg. for a fake workspace."""
+    with BLOCK_SNAPSHOTS_LOCK:
+        BLOCK_SNAPSHOTS.clear()
+    PULLED_SECTIONS.clear()
+
+
 def pull_tasks_from_notion(datestr: str) -> Optional[list[StringSection]]:
     """pulls tasks from notion and formats them into config lines.
 
@@ -253,15 +712,15 @@ def pull_tasks_from_notion(datestr: str) -> Optional[list[StringSection]]:
         list[str]: config lines
     """
     # don't pull tasks if we still have preprocessed items as these could cause duplications
-    PREPROCESSED.join()
+    NOTION_CHANGES.join(ChangePriority.preprocessed)
     try:
-        if contents := convert_notion_contents_to_string_sections(
-            get_contents(default_page_name=datestr)
-        ):
-            return contents
-        return None
+        ncontents, is_changed = get_contents_incrementally(default_page_name=datestr)
     except PageNotFoundError:
         return None
+    # notion is unchanged since the last pull, reuse its sections.
+    if is_changed or datestr not in PULLED_SECTIONS:
+        PULLED_SECTIONS[datestr] = convert_notion_contents_to_string_sections(ncontents)
+    return list(PULLED_SECTIONS[datestr]) or None
 
 
 def convert_sections_to_notion_contents(
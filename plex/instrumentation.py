@@ -0,0 +1,41 @@
+"""
+Timings of the phases of api syncs.
+
+Call counts (retried, throttled, ...) of each api are in plex.rate_limit.get_api_stats.
+"""
+
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# last duration (seconds) of each phase
+PHASE_TIMINGS: dict[str, float] = {}
+# total duration (seconds) and number of runs of each phase
+PHASE_TOTALS: Counter = Counter()
+PHASE_COUNTS: Counter = Counter()
+PHASE_LOCK = threading.Lock()
+
+
+@contextmanager
+def time_phase(name: str):
+    """Records how long the block takes as the phase `name`."""
+    start_time = time.monotonic()
+    try:
+        yield
+    finally:
+        duration = time.monotonic() - start_time
+        with PHASE_LOCK:
+            PHASE_TIMINGS[name] = duration
+            PHASE_TOTALS[name] += duration
+            PHASE_COUNTS[name] += 1
+
+
+def get_phase_timings(prefix: str = "") -> dict[str, float]:
+    """Last duration of the phases starting with prefix."""
+    with PHASE_LOCK:
+        return {
+            name: duration
+            for name, duration in PHASE_TIMINGS.items()
+            if name.startswith(prefix)
+        }
@@ -0,0 +1,485 @@
+"""
+In-process stand-in for the subset of the notion api used by plex.notion_api.page.
+
+Serves search, blocks (retrieve, update, delete, children list and append), pages
+(create, retrieve) and databases (create, retrieve, query) from memory, through
+httpx transports. Latency, rate limiting (429s) and pagination are configurable,
+so notion syncs can be tested and benchmarked offline.
+
+Usage:
+    fake = FakeNotion(latency=0.2)
+    install_fake_notion(fake, cache_dir)
+    ...  # plex.notion_api.page now talks to fake
+    print(fake.requests)
+"""
+
+import asyncio
+import copy
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Optional
+
+import httpx
+
+from plex.notion_api import page
+from plex.rate_limit import TokenBucket
+
+# notion limits of a single append request
+MAX_APPENDED_CHILDREN = 100
+MAX_APPEND_NESTING = 2
+
+
+class FakeNotionError(Exception):
+    def __init__(self, status: int, code: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+
+
+def get_edit_time() -> str:
+    # notion reports edit times rounded down to the minute
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:00.000Z")
+
+
+def make_rich_text(rich_text: list[dict]) -> list[dict]:
+    """Fills in the rich text fields notion adds to the ones in requests."""
+    filled = []
+    for item in rich_text:
+        item = copy.deepcopy(item)
+        if "mention" in item:
+            item.setdefault("type", "mention")
+            item.setdefault(
+                "plain_text", (item["mention"].get("date") or {}).get("start") or ""
+            )
+        else:
+            item.setdefault("type", "text")
+            item["text"].setdefault("link", None)
+            item.setdefault("plain_text", item["text"]["content"])
+        item.setdefault("annotations", {})
+        item["annotations"].setdefault("color", "default")
+        filled.append(item)
+    return filled
+
+
+def make_properties(properties: dict) -> dict:
+    filled = {}
+    for name, value in properties.items():
+        if isinstance(value, list):  # title shorthand
+            value = {"title": value}
+        for ptype in ("title", "rich_text"):
+            if ptype in value:
+                filled[name] = {
+                    "id": name,
+                    "type": ptype,
+                    ptype: make_rich_text(value[ptype]),
+                }
+    return filled
+
+
+def get_title(record: dict) -> str:
+    if record["object"] == "database":
+        return "".join(item["plain_text"] for item in record["title"])
+    for value in record["properties"].values():
+        if value["type"] == "title":
+            return "".join(item["plain_text"] for item in value["title"])
+    return ""
+
+
+def get_parent_id(parent: dict) -> str:
+    for key in ("page_id", "database_id", "block_id"):
+        if key in parent:
+            return parent[key]
+    raise FakeNotionError(400, "validation_error", f"Invalid parent {parent}")
+
+
+class FakeNotion:
+    """Notion workspace held in memory, with a page named page.PAGE_NAME.
+
+    Args:
+        latency (float, optional): seconds each request takes. Defaults to 0.
+        rate_limiter (Optional[TokenBucket], optional): requests beyond its rate get
+            a 429 with Retry-After. Defaults to None (no rate limit).
+        rate_limit_every (int, optional): every nth request gets a 429, regardless
+            of rate_limiter. Defaults to 0 (never).
+        max_page_size (int, optional): most results returned per page of a listing.
+            Defaults to page.NOTION_PAGE_SIZE.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0,
+        rate_limiter: Optional[TokenBucket] = None,
+        rate_limit_every: int = 0,
+        max_page_size: int = page.NOTION_PAGE_SIZE,
+    ):
+        self.latency = latency
+        self.rate_limiter = rate_limiter
+        self.rate_limit_every = rate_limit_every
+        self.max_page_size = max_page_size
+        self.lock = threading.Lock()
+        self.records: dict[str, dict] = {}  # id to block, page or database
+        self.children: dict[str, list[str]] = {}  # parent id to child ids, in order
+        # requests served, by "METHOD route", and the number that got a 429
+        self.requests: Counter = Counter()
+        self.num_rate_limited = 0
+        self.num_in_flight = 0
+        self.max_in_flight = 0
+        self.root_id = self.add_record(
+            {
+                "object": "page",
+                "properties": make_properties(
+                    {"title": [{"text": {"content": page.PAGE_NAME}}]}
+                ),
+            },
+            {"type": "workspace", "workspace": True},
+        )["id"]
+
+    def add_record(self, record: dict, parent: dict) -> dict:
+        now = get_edit_time()
+        record.update(
+            id=str(uuid.uuid4()),
+            parent=parent,
+            created_time=now,
+            last_edited_time=now,
+            archived=False,
+            in_trash=False,
+        )
+        self.records[record["id"]] = record
+        self.children[record["id"]] = []
+        if not parent.get("workspace"):
+            self.children[get_parent_id(parent)].append(record["id"])
+            self.touch(get_parent_id(parent))
+        return record
+
+    def touch(self, record_id: Optional[str]) -> None:
+        """Updates the edit time of the record and its ancestors."""
+        now = get_edit_time()
+        while record_id in self.records:
+            record = self.records[record_id]
+            record["last_edited_time"] = now
+            if record["parent"].get("workspace"):
+                return
+            record_id = get_parent_id(record["parent"])
+
+    def get_record(self, record_id: str, object_type: Optional[str] = None) -> dict:
+        record = self.records.get(record_id)
+        if record is None or (object_type and record["object"] != object_type):
+            raise FakeNotionError(
+                404,
+                "object_not_found",
+                f"Could not find {object_type or 'block'} {record_id}",
+            )
+        return record
+
+    def get_block_json(self, record: dict) -> dict:
+        """Record as a block, pages and databases are child_page / child_database."""
+        if record["object"] == "block":
+            block = dict(record)
+        else:
+            block_type = f"child_{record['object']}"
+            block = {
+                key: record[key]
+                for key in (
+                    "id",
+                    "parent",
+                    "created_time",
+                    "last_edited_time",
+                    "archived",
+                    "in_trash",
+                )
+            }
+            block.update(object="block", type=block_type)
+            block[block_type] = {"title": get_title(record)}
+        block["has_children"] = any(
+            not self.records[child_id]["archived"]
+            for child_id in self.children[record["id"]]
+        )
+        return copy.deepcopy(block)
+
+    def paginate(self, results: list[dict], body: dict) -> dict:
+        start = 0
+        if cursor := body.get("start_cursor"):
+            ids = [result["id"] for result in results]
+            if cursor not in ids:
+                raise FakeNotionError(
+                    400, "validation_error", f"Invalid cursor {cursor}"
+                )
+            start = ids.index(cursor)
+        page_size = min(int(body.get("page_size") or 100), self.max_page_size)
+        end = start + page_size
+        return {
+            "object": "list",
+            "results": results[start:end],
+            "has_more": end < len(results),
+            "next_cursor": results[end]["id"] if end < len(results) else None,
+        }
+
+    def list_children(self, record_id: str) -> list[dict]:
+        return [
+            self.records[child_id]
+            for child_id in self.children[record_id]
+            if not self.records[child_id]["archived"]
+        ]
+
+    def search(self, body: dict) -> dict:
+        query = body.get("query", "").lower()
+        results = [
+            copy.deepcopy(record)
+            for record in self.records.values()
+            if record["object"] != "block"
+            and not record["archived"]
+            and query in get_title(record).lower()
+        ]
+        return self.paginate(results, body)
+
+    def append_blocks(
+        self, parent: dict, children: list[dict], depth: int = 1
+    ) -> list[dict]:
+        if len(children) > MAX_APPENDED_CHILDREN:
+            raise FakeNotionError(
+                400,
+                "validation_error",
+                f"body.children.length should be ≤ `{MAX_APPENDED_CHILDREN}`",
+            )
+        if depth > MAX_APPEND_NESTING:
+            raise FakeNotionError(
+                400, "validation_error", "Too many levels of nesting in children"
+            )
+        blocks = []
+        for child in children:
+            child = copy.deepcopy(child)
+            (block_type,) = [key for key in child if key not in ("object", "type")]
+            content = child[block_type]
+            nested = content.pop("children", [])
+            if "rich_text" in content:
+                content["rich_text"] = make_rich_text(content["rich_text"])
+            block = self.add_record(
+                {"object": "block", "type": block_type, block_type: content}, parent
+            )
+            self.append_blocks(
+                {"type": "block_id", "block_id": block["id"]}, nested, depth + 1
+            )
+            blocks.append(block)
+        return blocks
+
+    def insert_after(self, parent_id: str, blocks: list[dict], after: str) -> None:
+        """Moves the appended blocks (at the end of the parent) after a child."""
+        child_ids = self.children[parent_id]
+        if after not in child_ids:
+            raise FakeNotionError(400, "validation_error", f"Block {after} not found")
+        del child_ids[-len(blocks) :]
+        idx = child_ids.index(after) + 1
+        child_ids[idx:idx] = [block["id"] for block in blocks]
+
+    def handle_route(self, method: str, path: list[str], body: dict) -> dict:
+        """Serves a request, path being the segments after the api version."""
+        match (method, path):
+            case ("POST", ["search"]):
+                return self.search(body)
+            case ("GET", ["blocks", block_id]):
+                return self.get_block_json(self.get_record(block_id))
+            case ("PATCH", ["blocks", block_id]):
+                record = self.get_record(block_id, "block")
+                for key, value in body.items():
+                    if key == record["type"]:
+                        value = dict(value)
+                        value.pop("children", None)
+                        if "rich_text" in value:
+                            value["rich_text"] = make_rich_text(value["rich_text"])
+                        record[key].update(value)
+                    elif key == "archived":
+                        record["archived"] = record["in_trash"] = value
+                self.touch(block_id)
+                return self.get_block_json(record)
+            case ("DELETE", ["blocks", block_id]):
+                record = self.get_record(block_id)
+                record["archived"] = record["in_trash"] = True
+                self.touch(block_id)
+                return self.get_block_json(record)
+            case ("GET", ["blocks", block_id, "children"]):
+                self.get_record(block_id)
+                return self.paginate(
+                    [
+                        self.get_block_json(child)
+                        for child in self.list_children(block_id)
+                    ],
+                    body,
+                )
+            case ("PATCH", ["blocks", block_id, "children"]):
+                parent_record = self.get_record(block_id)
+                parent = (
+                    {"type": "block_id", "block_id": block_id}
+                    if parent_record["object"] == "block"
+                    else {"type": "page_id", "page_id": block_id}
+                )
+                blocks = self.append_blocks(parent, body.get("children", []))
+                if body.get("after"):
+                    self.insert_after(block_id, blocks, body["after"])
+                return {
+                    "object": "list",
+                    "results": [self.get_block_json(block) for block in blocks],
+                    "has_more": False,
+                    "next_cursor": None,
+                }
+            case ("POST", ["pages"]):
+                parent = body["parent"]
+                parent_record = self.get_record(get_parent_id(parent))
+                if "database_id" in parent and parent_record["object"] != "database":
+                    raise FakeNotionError(404, "object_not_found", "Database not found")
+                record = self.add_record(
+                    {
+                        "object": "page",
+                        "properties": make_properties(body["properties"]),
+                    },
+                    parent,
+                )
+                self.append_blocks(
+                    {"type": "page_id", "page_id": record["id"]},
+                    body.get("children", []),
+                )
+                return copy.deepcopy(record)
+            case ("GET", ["pages", page_id]):
+                return copy.deepcopy(self.get_record(page_id, "page"))
+            case ("POST", ["databases"]):
+                self.get_record(get_parent_id(body["parent"]), "page")
+                record = self.add_record(
+                    {
+                        "object": "database",
+                        "title": make_rich_text(body.get("title", [])),
+                        "properties": {
+                            name: {"id": name, "name": name, "type": ptype, **value}
+                            for name, value in body.get("properties", {}).items()
+                            for ptype in value
+                        },
+                    },
+                    body["parent"],
+                )
+                return copy.deepcopy(record)
+            case ("GET", ["databases", database_id]):
+                return copy.deepcopy(self.get_record(database_id, "database"))
+            case ("POST", ["databases", database_id, "query"]):
+                self.get_record(database_id, "database")
+                return self.paginate(
+                    [copy.deepcopy(row) for row in self.list_children(database_id)],
+                    body,
+                )
+        raise FakeNotionError(
+            400, "invalid_request_url", f"Invalid request {method} {'/'.join(path)}"
+        )
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        """Serves a request (with its content read) to the notion api."""
+        path = request.url.path.removeprefix("/v1/").strip("/").split("/")
+        route = " ".join(
+            [request.method, path[0]]
+            + ["{id}" if idx % 2 else part for idx, part in enumerate(path[1:], 1)]
+        )
+        body = dict(request.url.params)
+        if request.content:
+            body.update(json.loads(request.content))
+        with self.lock:
+            self.requests[route] += 1
+            wait_time = self.rate_limiter.try_acquire() if self.rate_limiter else 0
+            if (
+                self.rate_limit_every
+                and not sum(self.requests.values()) % self.rate_limit_every
+            ):
+                wait_time = max(wait_time, 1)
+            if wait_time:
+                self.num_rate_limited += 1
+                return make_error_response(
+                    FakeNotionError(429, "rate_limited", "You have been rate limited."),
+                    {"Retry-After": str(math.ceil(wait_time))},
+                )
+            try:
+                return httpx.Response(
+                    200, json=self.handle_route(request.method, path, body)
+                )
+            except FakeNotionError as err:
+                return make_error_response(err)
+            except (KeyError, ValueError, TypeError) as err:
+                return make_error_response(
+                    FakeNotionError(400, "validation_error", f"Invalid body: {err!r}")
+                )
+
+    def start_request(self) -> None:
+        with self.lock:
+            self.num_in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.num_in_flight)
+
+    def finish_request(self) -> None:
+        with self.lock:
+            self.num_in_flight -= 1
+
+
+def make_error_response(
+    err: FakeNotionError, headers: Optional[dict] = None
+) -> httpx.Response:
+    return httpx.Response(
+        err.status,
+        headers=headers,
+        json={
+            "object": "error",
+            "status": err.status,
+            "code": err.code,
+            "message": str(err),
+        },
+    )
+
+
+class FakeNotionTransport(httpx.BaseTransport):
+    def __init__(self, fake: FakeNotion):
+        self.fake = fake
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.read()
+        self.fake.start_request()
+        try:
+            time.sleep(self.fake.latency)
+            return self.fake.handle(request)
+        finally:
+            self.fake.finish_request()
+
+
+class FakeNotionAsyncTransport(httpx.AsyncBaseTransport):
+    def __init__(self, fake: FakeNotion):
+        self.fake = fake
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()
+        self.fake.start_request()
+        try:
+            await asyncio.sleep(self.fake.latency)
+            return self.fake.handle(request)
+        finally:
+            self.fake.finish_request()
+
+
+def install_fake_notion(fake: Optional[FakeNotion], cache_dir: str) -> None:
+    """Sends the requests of plex.notion_api.page to fake (None for the notion api).
+
+    Page and database caches are reset, and the page directory is kept in cache_dir
+    so the directory of the real workspace isn't overwritten.
+    """
+    page.NOTION_TRANSPORTS[0] = (
+        None
+        if fake is None
+        else (FakeNotionTransport(fake), FakeNotionAsyncTransport(fake))
+    )
+    page.get_client.cache_clear()
+    page.get_async_client.cache_clear()
+    page.get_database.cache_clear()
+    with page.PAGE_CACHE_LOCK:
+        page.PAGE_DIRECTORY_FILE = os.path.join(cache_dir, "page_directory.json")
+        page.PAGE_CACHE.clear()
+        page.LISTED_SUBPAGES.clear()
+        page.PAGE_CACHE_LOADED[0] = False
+    page.DATABASE_INDEX_CACHE.clear()
+    page.clear_database_entry_index()
+    page.invalidate_page_mirrors()
@@ -1,22 +1,56 @@
+import asyncio
 import functools
+import json
 import os
+import threading
+import time
 import uuid
-from dataclasses import dataclass, field
+from collections import Counter
+from dataclasses import dataclass, field, replace
 from datetime import date, datetime
 from enum import Enum
 from pprint import pprint
-from typing import Optional, Union
+from typing import Callable, Iterator, Optional, Union
 
+import httpx
 import requests
-from notion_client import Client
+from notion_client import AsyncClient, Client
 from notion_client.errors import APIResponseError
 
+from plex.rate_limit import (
+    ApiBackend,
+    AsyncBackendTransport,
+    BackendTransport,
+    TokenBucket,
+    get_response_retry_after,
+    is_retryable_response_error,
+)
+
 CREDENTIALS_BASEPATH = os.path.join(os.environ["HOME"], ".credentials/")
 PAGE_NAME = "Schedule"
 DATABASE = "Task Details"
 
+# notion allows an average of 3 requests per second, with some bursts.
+NOTION_RATE_LIMITER = TokenBucket(rate=3, capacity=10)
+NOTION_BACKEND = ApiBackend(
+    "notion",
+    NOTION_RATE_LIMITER,
+    is_retryable_response_error,
+    get_response_retry_after,
+)
+NOTION_MAX_WORKERS = 8
+NOTION_PAGE_SIZE = 100  # max page size allowed by the notion api
+
+
+# (sync, async) transports that stand in for the notion api, see plex.notion_api.fake
+NOTION_TRANSPORTS: list[
+    Optional[tuple[httpx.BaseTransport, httpx.AsyncBaseTransport]]
+] = [None]
+
 
 def get_secret():
+    if NOTION_TRANSPORTS[0] is not None:
+        return "stand-in"
     filepath = os.path.join(CREDENTIALS_BASEPATH, "notion-api-key")
     with open(filepath) as file:
         secret = file.read()
@@ -25,21 +59,257 @@ def get_secret():
 
 @functools.cache
 def get_client() -> Client:
-    return Client(auth=get_secret())
+    """Notion client, its requests are rate limited and retried by NOTION_BACKEND."""
+    transport = NOTION_TRANSPORTS[0] and NOTION_TRANSPORTS[0][0]
+    return Client(
+        auth=get_secret(),
+        client=httpx.Client(transport=BackendTransport(NOTION_BACKEND, transport)),
+    )
+
+
+@functools.cache
+def get_async_client() -> AsyncClient:
+    """Async notion client, reusing up to NOTION_MAX_WORKERS connections.
+
+    Shares NOTION_BACKEND with the sync client. Use it on the notion event loop.
+    """
+    transport = (NOTION_TRANSPORTS[0] and NOTION_TRANSPORTS[0][1]) or (
+        httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_connections=NOTION_MAX_WORKERS)
+        )
+    )
+    return AsyncClient(
+        auth=get_secret(),
+        client=httpx.AsyncClient(
+            transport=AsyncBackendTransport(NOTION_BACKEND, transport)
+        ),
+    )
+
+
+@functools.cache
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Event loop, on a background thread, that all async notion requests run on."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="notion-loop", daemon=True).start()
+    return loop
+
+
+@functools.cache
+def get_request_semaphore() -> asyncio.Semaphore:
+    return asyncio.Semaphore(NOTION_MAX_WORKERS)
+
+
+def run_async(coroutine):
+    """Runs the coroutine on the notion event loop, and waits for its result.
+
+    Must not be called from the notion event loop.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result()
+
+
+async def request_async(endpoint: Callable, *args, **kwargs) -> dict:
+    """Sends a request with the async client, at most NOTION_MAX_WORKERS at a time."""
+    async with get_request_semaphore():
+        return await endpoint(*args, **kwargs)
+
+
+async def list_paginated_async(
+    list_function: Callable, *args, page_size: int = NOTION_PAGE_SIZE, **kwargs
+) -> list[dict]:
+    """Gets all results of a paginated notion endpoint, see iterate_paginated."""
+    results = []
+    start_cursor = None
+    while True:
+        response = await request_async(
+            list_function,
+            *args,
+            start_cursor=start_cursor,
+            page_size=page_size,
+            **kwargs,
+        )
+        results += response.get("results")
+        start_cursor = response.get("next_cursor")
+        if not response.get("has_more") or not start_cursor:
+            return results
+
+
+def iterate_paginated(
+    list_function: Callable[..., dict],
+    *args,
+    page_size: int = NOTION_PAGE_SIZE,
+    **kwargs,
+) -> Iterator[dict]:
+    """Yields the results of a paginated notion endpoint, following next_cursor.
+
+    Pages are requested as results are consumed, so consumers can stop early.
+    """
+    start_cursor = None
+    while True:
+        response = list_function(
+            *args, start_cursor=start_cursor, page_size=page_size, **kwargs
+        )
+        yield from response.get("results")
+        start_cursor = response.get("next_cursor")
+        if not response.get("has_more") or not start_cursor:
+            return
+
+
+def iterate_block_children(
+    block_id: str, page_size: int = NOTION_PAGE_SIZE
+) -> Iterator[dict]:
+    return iterate_paginated(
+        get_client().blocks.children.list, block_id, page_size=page_size
+    )
 
 
 class PageNotFoundError(ValueError):
     """Page is not found"""
 
 
-PAGE_CACHE = {}
+# directory of page names (and datestrs) to pages, persisted across runs.
+PAGE_DIRECTORY_FILE = "cache_files/notion/page_directory.json"
+PAGE_DIRECTORY_TTL = 7 * 24 * 60 * 60  # seconds
+PAGE_DIRECTORY_MAX_SIZE = 64
+
+
+@dataclass
+class PageDirectoryEntry:
+    page: dict
+    resolved_time: float
+    last_used_time: float
+    # unverified entries are checked to still exist on their next use
+    is_verified: bool = True
+
+
+PAGE_CACHE: dict[str, PageDirectoryEntry] = {}
+PAGE_CACHE_LOADED = [False]
+PAGE_CACHE_LOCK = threading.RLock()
+# hits, misses, revalidations, invalidations, expirations, evictions
+PAGE_CACHE_STATS: Counter = Counter()
+# subpages of the main page by title, from its last listing (see iterate_subpages).
+# kept out of the directory, so listing many days doesn't evict the pages in use.
+LISTED_SUBPAGES: dict[str, dict] = {}
+
+
+def load_page_directory() -> None:
+    with PAGE_CACHE_LOCK:
+        if PAGE_CACHE_LOADED[0]:
+            return
+        PAGE_CACHE_LOADED[0] = True
+        if not os.path.exists(PAGE_DIRECTORY_FILE):
+            return
+        try:
+            with open(PAGE_DIRECTORY_FILE) as file:
+                entries = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            return
+        for page_name, entry in entries.items():
+            # pages may have changed while we weren't running
+            PAGE_CACHE.setdefault(
+                page_name, PageDirectoryEntry(**{**entry, "is_verified": False})
+            )
+
+
+def save_page_directory() -> None:
+    with PAGE_CACHE_LOCK:
+        entries = {
+            page_name: {
+                "page": entry.page,
+                "resolved_time": entry.resolved_time,
+                "last_used_time": entry.last_used_time,
+            }
+            for page_name, entry in PAGE_CACHE.items()
+        }
+        os.makedirs(os.path.dirname(PAGE_DIRECTORY_FILE), exist_ok=True)
+        with open(PAGE_DIRECTORY_FILE + ".tmp", "w") as file:
+            json.dump(entries, file)
+        os.replace(PAGE_DIRECTORY_FILE + ".tmp", PAGE_DIRECTORY_FILE)
+
+
+def cache_page(page_name: str, page: dict) -> None:
+    with PAGE_CACHE_LOCK:
+        load_page_directory()
+        now = time.time()
+        entry = PAGE_CACHE.get(page_name)
+        if entry is not None and entry.page["id"] == page["id"]:
+            # already in the directory, no need to save
+            entry.page, entry.is_verified, entry.last_used_time = page, True, now
+            return
+        PAGE_CACHE[page_name] = PageDirectoryEntry(page, now, now)
+        while len(PAGE_CACHE) > PAGE_DIRECTORY_MAX_SIZE:
+            PAGE_CACHE.pop(
+                min(PAGE_CACHE, key=lambda name: PAGE_CACHE[name].last_used_time)
+            )
+            PAGE_CACHE_STATS["evictions"] += 1
+        save_page_directory()
+
+
+def uncache_page_id(page_id: str) -> None:
+    with PAGE_CACHE_LOCK:
+        load_page_directory()
+        page_names = [
+            page_name
+            for page_name, entry in PAGE_CACHE.items()
+            if entry.page["id"] == page_id
+        ]
+        for page_name in page_names:
+            PAGE_CACHE.pop(page_name)
+            PAGE_CACHE_STATS["invalidations"] += 1
+        for title, subpage in list(LISTED_SUBPAGES.items()):
+            if subpage["id"] == page_id:
+                LISTED_SUBPAGES.pop(title)
+        if page_names:
+            save_page_directory()
+
+
+def retrieve_page(page: dict) -> Optional[dict]:
+    """Gets the latest version of the page, None if it no longer exists."""
+    endpoint = {"database": "databases", "page": "pages"}.get(page["object"], "blocks")
+    try:
+        result = getattr(get_client(), endpoint).retrieve(page["id"])
+    except APIResponseError as err:
+        if err.status == 404:
+            return None
+        raise
+    if result.get("archived") or result.get("in_trash"):
+        return None
+    return result
+
+
+def get_cached_page(page_name: str) -> Optional[dict]:
+    with PAGE_CACHE_LOCK:
+        load_page_directory()
+        entry = PAGE_CACHE.get(page_name)
+        if entry is None:
+            return None
+        if time.time() - entry.resolved_time >= PAGE_DIRECTORY_TTL:
+            PAGE_CACHE.pop(page_name)
+            PAGE_CACHE_STATS["expirations"] += 1
+            return None
+        is_verified = entry.is_verified
+    if not is_verified:
+        PAGE_CACHE_STATS["revalidations"] += 1
+        if (page := retrieve_page(entry.page)) is None:
+            uncache_page_id(entry.page["id"])
+            return None
+        entry.page, entry.is_verified = page, True
+    entry.last_used_time = time.time()
+    return entry.page
 
 
 def get_page(page_name):
-    if page_name in PAGE_CACHE:
-        return PAGE_CACHE[page_name]
+    if (page := get_cached_page(page_name)) is not None:
+        PAGE_CACHE_STATS["hits"] += 1
+        return page
+    with PAGE_CACHE_LOCK:
+        page = LISTED_SUBPAGES.get(page_name)
+    if page is not None:
+        PAGE_CACHE_STATS["hits"] += 1
+        cache_page(page_name, page)
+        return page
+    PAGE_CACHE_STATS["misses"] += 1
     notion = get_client()
-    for result in notion.search(query=page_name).get("results"):
+    for result in iterate_paginated(notion.search, query=page_name):
         if not result["archived"] and not result["in_trash"]:
             try:
                 if (
@@ -49,7 +319,7 @@ def get_page(page_name):
                     )
                     == page_name
                 ):
-                    PAGE_CACHE[page_name] = result
+                    cache_page(page_name, result)
                     return result
             except KeyError:
                 pass
@@ -58,6 +328,16 @@ def get_page(page_name):
     )
 
 
+@functools.lru_cache(maxsize=1024)
+def get_database_content_from_link(url: str) -> "DatabaseContent":
+    """Gets the database row a link points to, shared by all block reads."""
+    if url in DATABASE_INDEX_CACHE:
+        return DATABASE_INDEX_CACHE[url]
+    return get_database_content_from_row(
+        get_client().pages.retrieve(uuid.UUID(url.replace("/", "")))
+    )
+
+
 def process_notion_result_to_notion_content(
     result: dict,
     existing_database_content: Optional[dict[str, "DatabaseContent"]] = None,
@@ -72,26 +352,24 @@ def process_notion_result_to_notion_content(
                     sections.append(
                         NotionSection(
                             content="",
-                            start_datetime=datetime.fromisoformat(
-                                date_data["start"]
-                            ).date()
-                            if date_data["start"]
-                            else None,
-                            end_datetime=datetime.fromisoformat(date_data["end"]).date()
-                            if date_data["end"]
-                            else None,
+                            start_datetime=(
+                                datetime.fromisoformat(date_data["start"]).date()
+                                if date_data["start"]
+                                else None
+                            ),
+                            end_datetime=(
+                                datetime.fromisoformat(date_data["end"]).date()
+                                if date_data["end"]
+                                else None
+                            ),
                         )
                     )
                 else:
                     database_content = None
                     if nsection["text"].get("link"):
                         if existing_database_content is None:
-                            database_content = get_database_content_from_row(
-                                get_client().pages.retrieve(
-                                    uuid.UUID(
-                                        nsection["text"]["link"]["url"].replace("/", "")
-                                    )
-                                )
+                            database_content = get_database_content_from_link(
+                                nsection["text"]["link"]["url"]
                             )
                         else:
                             database_content = existing_database_content.get(
@@ -111,42 +389,195 @@ def process_notion_result_to_notion_content(
     return None
 
 
-def get_subpages():
-    subpages = {}
-    for result in (
-        get_client().blocks.children.list(get_page(PAGE_NAME)["id"]).get("results")
-    ):
+def iterate_subpages(page_size: int = NOTION_PAGE_SIZE) -> Iterator[tuple[str, str]]:
+    """Yields (title, id) of each subpage of the main page.
+
+    Subpages are kept in LISTED_SUBPAGES, so get_page finds them without a search.
+    """
+    titles = set()
+    for result in iterate_block_children(get_page(PAGE_NAME)["id"], page_size):
         if "child_page" in result:
-            PAGE_CACHE[result["child_page"]["title"]] = result
-            subpages[result["child_page"]["title"]] = result["id"]
-    return subpages
+            title = result["child_page"]["title"]
+            titles.add(title)
+            with PAGE_CACHE_LOCK:
+                LISTED_SUBPAGES[title] = result
+            yield title, result["id"]
+    # the listing is complete, forget the subpages that are gone
+    with PAGE_CACHE_LOCK:
+        for title in LISTED_SUBPAGES.keys() - titles:
+            LISTED_SUBPAGES.pop(title)
+
+
+def get_subpages():
+    return dict(iterate_subpages())
 
 
 def get_contents(
-    block_id: Optional[str] = None, default_page_name: str = PAGE_NAME
+    block_id: Optional[str] = None,
+    default_page_name: str = PAGE_NAME,
+    database_content: Optional[dict[str, "DatabaseContent"]] = None,
 ) -> list["NotionContent"]:
+    """Gets the block tree under block_id (default page if None).
+
+    Args:
+        database_content (Optional[dict[str, DatabaseContent]], optional): database index
+            shared by the whole tree walk, pulled once if None. Defaults to None.
+    """
+    return run_async(get_contents_async(block_id, default_page_name, database_content))
+
+
+async def get_contents_async(
+    block_id: Optional[str] = None,
+    default_page_name: str = PAGE_NAME,
+    database_content: Optional[dict[str, "DatabaseContent"]] = None,
+) -> list["NotionContent"]:
+    """See get_contents. The children of all blocks in a level are fetched at once."""
     contents = []
-    notion = get_client()
     if block_id is None:
         try:
-            block_id = get_page(default_page_name)["id"]
+            block_id = (await asyncio.to_thread(get_page, default_page_name))["id"]
         except PageNotFoundError:
             return contents
-    database_content = {
-        make_database_content_into_link(content)["url"]: content
-        for content in pull_database_contents_from_notion()
-    }
-    for result in notion.blocks.children.list(block_id).get("results"):
+    if database_content is None:
+        database_content = await asyncio.to_thread(get_database_index)
+    await fetch_block_trees_async([(block_id, contents)], database_content)
+    return contents
+
+
+async def fetch_block_trees_async(
+    level: list[tuple[str, list["NotionContent"]]],
+    database_content: dict[str, "DatabaseContent"],
+) -> None:
+    """Fetches the trees under blocks breadth first.
+
+    Args:
+        level (list[tuple[str, list[NotionContent]]]): block id and the list to add
+            the block's children to, for each block
+    """
+    client = get_async_client()
+    while level:
+        next_level = []
+        for (_, children), results in zip(
+            level,
+            await asyncio.gather(
+                *(
+                    list_paginated_async(client.blocks.children.list, parent_id)
+                    for parent_id, _ in level
+                )
+            ),
+        ):
+            for result in results:
+                notion_content = process_notion_result_to_notion_content(
+                    result, database_content
+                )
+                if notion_content is not None:
+                    if result.get("has_children"):
+                        next_level.append((result["id"], notion_content.children))
+                    children.append(notion_content)
+        level = next_level
+
+
+# notion reports last_edited_time rounded down to the minute
+EDIT_TIME_RESOLUTION = 60  # seconds
+# pull whole trees at least this often, as edits to nested blocks don't always
+# advance the edit time of their top level block.
+FULL_PULL_INTERVAL = 60  # seconds
+
+
+@dataclass
+class PageMirror:
+    """Last pulled block tree of a page, with the edit times it was pulled at."""
+
+    last_edited_time: str
+    fetched_time: float
+    full_pull_time: float
+    contents: list["NotionContent"]
+    # top level blocks with children: (last_edited_time, block content)
+    blocks: dict[str, tuple[str, "NotionContent"]]
+
+
+PAGE_MIRRORS: dict[str, PageMirror] = {}
+# incremented after writes, so mirrors pulled across a write aren't saved.
+PAGE_MIRROR_GENERATION = [0]
+
+
+def invalidate_page_mirrors() -> None:
+    PAGE_MIRROR_GENERATION[0] += 1
+    PAGE_MIRRORS.clear()
+
+
+def is_edit_time_settled(last_edited_time: str, fetched_time: float) -> bool:
+    """If no edits within the same minute could have happened after the fetch."""
+    edited_time = datetime.fromisoformat(last_edited_time).timestamp()
+    return fetched_time - edited_time >= EDIT_TIME_RESOLUTION
+
+
+def get_contents_incrementally(
+    default_page_name: str = PAGE_NAME,
+) -> tuple[list["NotionContent"], bool]:
+    """Gets the same block tree as get_contents, reusing the previous pull.
+
+    If the page's edit time hasn't advanced, the previous pull is returned.
+    Otherwise the top level blocks are listed, and only the children of blocks whose
+    edit time advanced are pulled again.
+
+    Returns:
+        tuple[list[NotionContent], bool]: block tree, and if it changed since the
+            previous pull
+    """
+    try:
+        page_id = get_page(default_page_name)["id"]
+    except PageNotFoundError:
+        return [], True
+    generation = PAGE_MIRROR_GENERATION[0]
+    mirror = PAGE_MIRRORS.get(page_id)
+    fetched_time = time.time()
+    last_edited_time = get_client().pages.retrieve(page_id)["last_edited_time"]
+    is_full_pull = mirror is None or (
+        fetched_time - mirror.full_pull_time >= FULL_PULL_INTERVAL
+    )
+    if (
+        not is_full_pull
+        and last_edited_time == mirror.last_edited_time
+        and is_edit_time_settled(last_edited_time, mirror.fetched_time)
+    ):
+        return mirror.contents, False
+
+    database_content = get_database_index()
+    contents = []
+    blocks = {}
+    outdated = []
+    for result in iterate_block_children(page_id):
         notion_content = process_notion_result_to_notion_content(
             result, database_content
         )
-        if notion_content is not None:
-            if result.get("has_children"):
-                notion_content.children = get_contents(
-                    block_id=result["id"], default_page_name=default_page_name
-                )
-            contents.append(notion_content)
-    return contents
+        if notion_content is None:
+            continue
+        contents.append(notion_content)
+        if not result.get("has_children"):
+            continue
+        blocks[result["id"]] = (result["last_edited_time"], notion_content)
+        previous = None if is_full_pull else mirror.blocks.get(result["id"])
+        if (
+            previous is not None
+            and previous[0] == result["last_edited_time"]
+            and is_edit_time_settled(previous[0], mirror.fetched_time)
+        ):
+            notion_content.children = previous[1].children
+        else:
+            outdated.append((result["id"], notion_content.children))
+
+    run_async(fetch_block_trees_async(outdated, database_content))
+
+    if generation == PAGE_MIRROR_GENERATION[0]:
+        PAGE_MIRRORS[page_id] = PageMirror(
+            last_edited_time=last_edited_time,
+            fetched_time=fetched_time,
+            full_pull_time=fetched_time if is_full_pull else mirror.full_pull_time,
+            contents=contents,
+            blocks=blocks,
+        )
+    return contents, True
 
 
 class NotionType(Enum):
@@ -201,12 +632,16 @@ def make_notion_json(content: Union[NotionContentGroup, NotionContent]):
                     {
                         "mention": {
                             "date": {
-                                "start": None
-                                if section.start_datetime is None
-                                else section.start_datetime.isoformat(),
-                                "end": None
-                                if section.end_datetime is None
-                                else section.end_datetime.isoformat(),
+                                "start": (
+                                    None
+                                    if section.start_datetime is None
+                                    else section.start_datetime.isoformat()
+                                ),
+                                "end": (
+                                    None
+                                    if section.end_datetime is None
+                                    else section.end_datetime.isoformat()
+                                ),
                             },
                             "type": "date",
                         },
@@ -248,26 +683,38 @@ def update_task(
     n_content: Union[NotionContentGroup, NotionContent],
     notion_uuid: Optional[str] = None,
 ):
-    notion = get_client()
+    return run_async(update_task_async(n_content, notion_uuid))
+
+
+async def update_task_async(
+    n_content: Union[NotionContentGroup, NotionContent],
+    notion_uuid: Optional[str] = None,
+):
     if notion_uuid is None:
         notion_uuid = n_content.notion_uuid
 
-    update_database_contents_in_notion(
+    await update_database_contents_async(
         get_all_database_contents_from_notion_content(n_content)
     )
 
     if notion_uuid is not None:  # updated existing block
         if isinstance(n_content, NotionContent):
             try:
-                return notion.blocks.update(notion_uuid, **make_notion_json(n_content))
+                return await request_async(
+                    get_async_client().blocks.update,
+                    notion_uuid,
+                    **make_notion_json(n_content),
+                )
             except APIResponseError as err:
                 print(f"Skipping update for {n_content}. Error: {str(err)}")
                 pass
+            finally:
+                invalidate_page_mirrors()
     return None  # no item found
 
 
 def get_all_database_contents_from_notion_content(
-    content: Union[NotionContentGroup, NotionContent]
+    content: Union[NotionContentGroup, NotionContent],
 ):
     database_contents = []
     if isinstance(content, NotionContentGroup):
@@ -295,13 +742,67 @@ def create_page(page_name: str):
             "title": [{"text": {"content": page_name}}],
         },
     )
-    PAGE_CACHE[page_name] = page
+    cache_page(page_name, page)
     return page
 
 
 def clear_page_cache():
-    for key in list(PAGE_CACHE.keys()):
-        PAGE_CACHE.pop(key)
+    """Marks cached pages to be checked on their next use, rather than searched."""
+    with PAGE_CACHE_LOCK:
+        for entry in PAGE_CACHE.values():
+            entry.is_verified = False
+        LISTED_SUBPAGES.clear()
+    clear_database_entry_index()
+
+
+# notion limits the blocks appended per request, and the nesting of each request.
+NOTION_APPEND_LIMIT = 100
+
+
+def get_appended_children(
+    n_content: Union[NotionContentGroup, NotionContent],
+) -> list[NotionContent]:
+    """Children of a block that are appended in follow up requests."""
+    if isinstance(n_content, NotionContent) and n_content.ntype not in [
+        NotionType.heading_1,
+        NotionType.heading_2,
+        NotionType.paragraph,
+    ]:
+        return n_content.children
+    return []  # synced blocks need their children on creation
+
+
+async def append_blocks_async(
+    parent_uuid: str,
+    n_contents: list[Union[NotionContentGroup, NotionContent]],
+    after_uuid: Optional[str] = None,
+) -> None:
+    """Appends blocks (without their nested children) in chunks, in order."""
+    client = get_async_client()
+    for idx in range(0, len(n_contents), NOTION_APPEND_LIMIT):
+        chunk = n_contents[idx : idx + NOTION_APPEND_LIMIT]
+        children = [
+            make_notion_json(
+                replace(n_content, children=[])
+                if get_appended_children(n_content)
+                else n_content
+            )
+            for n_content in chunk
+        ]
+        kwargs = {} if after_uuid is None else {"after": after_uuid}
+        output = (
+            await request_async(
+                client.blocks.children.append, parent_uuid, children=children, **kwargs
+            )
+        )["results"]
+        for n_content, result in zip(chunk, output):
+            n_content.notion_uuid = result["id"]
+            if isinstance(n_content, NotionContentGroup):
+                for child_content, child in zip(
+                    n_content.contents, await get_contents_async(block_id=result["id"])
+                ):
+                    child_content.notion_uuid = child.notion_uuid
+        after_uuid = chunk[-1].notion_uuid
 
 
 def add_tasks_after(
@@ -310,56 +811,78 @@ def add_tasks_after(
     parent_uuid: Optional[str] = None,
     default_page_name: str = PAGE_NAME,
 ):
-    notion = get_client()
+    """Adds the blocks after after_uuid (at the end if None), under parent_uuid.
+
+    Blocks are appended in chunks of NOTION_APPEND_LIMIT. Each level of nested
+    children is appended in follow up requests under the created blocks, in
+    parallel across blocks. Created block ids are set as the contents' notion_uuid.
+    """
+    return run_async(
+        add_tasks_after_async(n_contents, after_uuid, parent_uuid, default_page_name)
+    )
+
+
+async def add_tasks_after_async(
+    n_contents: list[Union[NotionContentGroup, NotionContent]],
+    after_uuid: Optional[str] = None,
+    parent_uuid: Optional[str] = None,
+    default_page_name: str = PAGE_NAME,
+):
     if parent_uuid is None:
         try:
-            parent_uuid = get_page(default_page_name)["id"]
+            parent_uuid = (await asyncio.to_thread(get_page, default_page_name))["id"]
         except PageNotFoundError:
-            parent_uuid = create_page(default_page_name)["id"]
+            parent_uuid = (await asyncio.to_thread(create_page, default_page_name))[
+                "id"
+            ]
             print(f"Creating new notion page {default_page_name}")
 
     database_contents = []
     for content in n_contents:
         database_contents += get_all_database_contents_from_notion_content(content)
 
-    update_database_contents_in_notion(database_contents)
-
-    # append after specified block
-    if after_uuid is None:
-        output = notion.blocks.children.append(
-            parent_uuid,
-            children=[make_notion_json(n_content) for n_content in n_contents],
-        )["results"]
-    else:
-        output = notion.blocks.children.append(
-            parent_uuid,
-            children=[make_notion_json(n_content) for n_content in n_contents],
-            after=after_uuid,
-        )["results"]
+    await update_database_contents_async(database_contents)
 
-    for n_content, result in zip(n_contents, output):
-        n_content.notion_uuid = result["id"]
-        if isinstance(n_content, NotionContentGroup):
-            for child_content, child_result in zip(
-                n_content.contents,
-                get_contents(
-                    block_id=result["id"], default_page_name=default_page_name
-                )["results"],
-            ):
-                child_content.notion_uuid = child_result["id"]
+    try:
+        await append_blocks_async(parent_uuid, n_contents, after_uuid)
+        level = n_contents
+        while level := [
+            n_content for n_content in level if get_appended_children(n_content)
+        ]:
+            await asyncio.gather(
+                *(
+                    append_blocks_async(
+                        n_content.notion_uuid, get_appended_children(n_content)
+                    )
+                    for n_content in level
+                )
+            )
+            level = [
+                child
+                for n_content in level
+                for child in get_appended_children(n_content)
+            ]
+    finally:
+        invalidate_page_mirrors()
 
 
 def delete_block(
     block: Optional[NotionContent] = None, notion_uuid: Optional[str] = None
+):
+    return run_async(delete_block_async(block, notion_uuid))
+
+
+async def delete_block_async(
+    block: Optional[NotionContent] = None, notion_uuid: Optional[str] = None
 ):
     if notion_uuid is None:
         notion_uuid = block.notion_uuid
     if notion_uuid:
-        notion = get_client()
-        notion.blocks.delete(notion_uuid)
-        for page_name, page in list(PAGE_CACHE.items()):
-            if page["id"] == notion_uuid:
-                PAGE_CACHE.pop(page_name)
+        try:
+            await request_async(get_async_client().blocks.delete, notion_uuid)
+        finally:
+            invalidate_page_mirrors()
+        uncache_page_id(notion_uuid)
 
 
 @dataclass
@@ -416,42 +939,165 @@ def get_database_content_from_row(result):
 
 
 def pull_database_contents_from_notion():
+    return run_async(pull_database_contents_async())
+
+
+async def pull_database_contents_async() -> list[DatabaseContent]:
     try:
+        database_id = (await asyncio.to_thread(get_page, DATABASE))["id"]
         return [
             get_database_content_from_row(result)
-            for result in get_client()
-            .databases.query(get_page(DATABASE)["id"])
-            .get("results")
+            for result in await list_paginated_async(
+                get_async_client().databases.query, database_id
+            )
         ]
     except (ValueError, PageNotFoundError):
         return []
 
 
+# database index (link url: content) reused across pulls, see get_database_index
+DATABASE_INDEX_CACHE: dict[str, DatabaseContent] = {}
+DATABASE_INDEX_PULL_TIME = [0.0]
+DATABASE_INDEX_TTL = 60  # seconds
+
+
+def get_database_index(ttl: float = DATABASE_INDEX_TTL) -> dict[str, DatabaseContent]:
+    """Gets database contents keyed by their link url.
+
+    Reuses the previous pull if it was within ttl seconds. Use ttl=0 to force a pull.
+    """
+    if not DATABASE_INDEX_CACHE or time.time() - DATABASE_INDEX_PULL_TIME[0] >= ttl:
+        DATABASE_INDEX_CACHE.clear()
+        DATABASE_INDEX_CACHE.update(
+            {
+                make_database_content_into_link(content)["url"]: content
+                for content in pull_database_contents_from_notion()
+            }
+        )
+        DATABASE_INDEX_PULL_TIME[0] = time.time()
+        DATABASE_ENTRY_INDEX.update(
+            {
+                content.uuid: content.entry_uuid
+                for content in DATABASE_INDEX_CACHE.values()
+            }
+        )
+        DATABASE_ENTRY_INDEX_LOADED[0] = True
+    return DATABASE_INDEX_CACHE
+
+
+# database row uuid: entry uuid, pulled once and updated as rows are created
+DATABASE_ENTRY_INDEX: dict[str, str] = {}
+DATABASE_ENTRY_INDEX_LOADED = [False]
+DATABASE_ENTRY_INDEX_LOCK = threading.Lock()
+
+
+def get_database_entry_index() -> dict[str, str]:
+    with DATABASE_ENTRY_INDEX_LOCK:
+        if not DATABASE_ENTRY_INDEX_LOADED[0]:
+            DATABASE_ENTRY_INDEX.update(
+                {
+                    content.uuid: content.entry_uuid
+                    for content in pull_database_contents_from_notion()
+                }
+            )
+            DATABASE_ENTRY_INDEX_LOADED[0] = True
+    return DATABASE_ENTRY_INDEX
+
+
+def clear_database_entry_index():
+    with DATABASE_ENTRY_INDEX_LOCK:
+        DATABASE_ENTRY_INDEX.clear()
+        DATABASE_ENTRY_INDEX_LOADED[0] = False
+    get_database_content_from_link.cache_clear()
+
+
+@functools.cache
+def get_database_row_lock() -> asyncio.Lock:
+    # rows are created one batch at a time, so they aren't created twice
+    return asyncio.Lock()
+
+
+async def create_database_row_async(content: DatabaseContent, database_id: str) -> str:
+    page = await request_async(
+        get_async_client().pages.create,
+        parent={"type": "database_id", "database_id": database_id},
+        properties={
+            DatabaseProperties.name.value: {
+                "title": [{"text": {"content": content.name}}],
+            },
+            DatabaseProperties.uuid.value: {
+                "rich_text": [{"text": {"content": content.uuid}}],
+            },
+        },
+    )
+    return page["id"]
+
+
 def update_database_contents_in_notion(contents: list[DatabaseContent]):
-    notion = get_client()
-    database = get_database()
-    cur_contents = {
-        content.uuid: content for content in pull_database_contents_from_notion()
-    }
-
-    for content in contents:
-        if not content.entry_uuid:
-            if content.uuid in cur_contents:
-                content.entry_uuid = cur_contents[content.uuid].entry_uuid
-            else:
-                page = notion.pages.create(
-                    parent={"type": "database_id", "database_id": database["id"]},
-                    properties={
-                        DatabaseProperties.name.value: {
-                            "title": [{"text": {"content": content.name}}],
-                        },
-                        DatabaseProperties.uuid.value: {
-                            "rich_text": [{"text": {"content": content.uuid}}],
-                        },
-                    },
-                )
-                content.entry_uuid = page["id"]
-                cur_contents[content.uuid] = content
+    """Links contents to their database rows, creating the missing rows concurrently.
+
+    Rows are looked up in the entry index, so contents with existing rows don't
+    query the database.
+    """
+    return run_async(update_database_contents_async(contents))
+
+
+async def update_database_contents_async(contents: list[DatabaseContent]):
+    contents = [content for content in contents if not content.entry_uuid]
+    if not contents:
+        return
+    async with get_database_row_lock():
+        entry_index = await asyncio.to_thread(get_database_entry_index)
+        missing = {
+            content.uuid: content
+            for content in contents
+            if content.uuid not in entry_index
+        }
+        if missing:
+            database_id = (await asyncio.to_thread(get_database))["id"]
+            entry_uuids = await asyncio.gather(
+                *(
+                    create_database_row_async(content, database_id)
+                    for content in missing.values()
+                ),
+                return_exceptions=True,
+            )
+            # index the created rows before raising, so they aren't created again
+            errors = [err for err in entry_uuids if isinstance(err, BaseException)]
+            entry_index.update(
+                (content_uuid, entry_uuid)
+                for content_uuid, entry_uuid in zip(missing, entry_uuids)
+                if not isinstance(entry_uuid, BaseException)
+            )
+            if errors:
+                raise errors[0]
+        for content in contents:
+            content.entry_uuid = entry_index[content.uuid]
+    if DATABASE_INDEX_CACHE:
+        for content in missing.values():
+            DATABASE_INDEX_CACHE[make_database_content_into_link(content)["url"]] = (
+                content
+            )
+
+
+def get_child_blocks(parent_id: str) -> dict[str, NotionContent]:
+    """Gets the child blocks (without their children) of a block from one listing."""
+    return run_async(get_child_blocks_async(parent_id))
+
+
+async def get_child_blocks_async(parent_id: str) -> dict[str, NotionContent]:
+    blocks = {}
+    for result in await list_paginated_async(
+        get_async_client().blocks.children.list, parent_id
+    ):
+        if result.get("archived") or result.get("in_trash"):
+            continue
+        notion_content = await asyncio.to_thread(
+            process_notion_result_to_notion_content, result
+        )
+        if notion_content is not None:
+            blocks[result["id"]] = notion_content
+    return blocks
 
 
 def get_block(block_id: int):
@@ -0,0 +1,497 @@
+"""
+Rate limiting and backoff helpers shared by the api clients.
+"""
+
+import asyncio
+import itertools
+import json
+import random
+import socket
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Optional
+
+import httplib2
+import httpx
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+
+class TokenBucket:
+    """Token bucket rate limiter.
+
+    Tokens refill continuously at `rate` per second, up to `capacity` tokens,
+    which allows bursts of up to `capacity` requests.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.last_refill) * self.rate
+        )
+        self.last_refill = now
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """Takes the tokens if available.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise seconds until they're available
+        """
+        assert tokens <= self.capacity, f"can't take {tokens} from {self.capacity}"
+        with self.lock:
+            self.refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens: float = 1) -> None:
+        """Blocks until the tokens are available, then takes them."""
+        while wait_time := self.try_acquire(tokens):
+            time.sleep(wait_time)
+
+    async def acquire_async(self, tokens: float = 1) -> None:
+        """Waits (without blocking the event loop) for the tokens, then takes them."""
+        while wait_time := self.try_acquire(tokens):
+            await asyncio.sleep(wait_time)
+
+
+def get_backoff_delay(
+    attempt: int, base_delay: float = 1.0, max_delay: float = 60.0
+) -> float:
+    """Exponential backoff with full jitter for the given retry attempt (starting at 0)."""
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+class CircuitOpenError(RuntimeError):
+    """Call was rejected, as its backend's circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Stops calls to a backend that keeps failing.
+
+    Opens after failure_threshold consecutive failures, rejecting calls for
+    reset_timeout seconds. Then one trial call is let through, which closes the
+    breaker if it succeeds, or opens it again if it fails.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.num_failures = 0
+        self.opened_time: Optional[float] = None
+        self.is_trial_running = False
+        self.lock = threading.Lock()
+
+    def check(self) -> None:
+        """Raises CircuitOpenError if calls aren't allowed."""
+        with self.lock:
+            if self.opened_time is None:
+                return
+            if (
+                self.is_trial_running
+                or time.monotonic() - self.opened_time < self.reset_timeout
+            ):
+                raise CircuitOpenError(
+                    f"Circuit open after {self.num_failures} consecutive failures"
+                )
+            self.is_trial_running = True
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.num_failures = 0
+            self.opened_time = None
+            self.is_trial_running = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.num_failures += 1
+            if self.is_trial_running or self.num_failures >= self.failure_threshold:
+                self.opened_time = time.monotonic()
+            self.is_trial_running = False
+
+
+# backends by name, see get_api_stats
+API_BACKENDS: dict[str, "ApiBackend"] = {}
+
+
+class ApiBackend:
+    """Rate limit, retries and circuit breaker shared by all calls to an api.
+
+    Args:
+        name (str): name of the api, in API_BACKENDS
+        rate_limiter (TokenBucket): a token is taken for each attempt
+        is_retryable (Callable[[Exception], bool]): if a failed call can be retried
+        get_retry_after (Callable[[Exception], Optional[float]], optional): seconds
+            the api asked to wait before retrying, 0 if it throttled without asking
+            for a delay, None if the call wasn't throttled.
+        max_retries (int, optional): Defaults to 3.
+        max_delay (float, optional): longest wait before a retry. Defaults to 60.
+        circuit_breaker (Optional[CircuitBreaker], optional): Defaults to a new one.
+        register (bool, optional): whether to add it to API_BACKENDS (and
+            get_api_stats). Defaults to True.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate_limiter: TokenBucket,
+        is_retryable: Callable[[Exception], bool],
+        get_retry_after: Callable[[Exception], Optional[float]] = lambda exc: None,
+        max_retries: int = 3,
+        max_delay: float = 60.0,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        register: bool = True,
+    ):
+        self.name = name
+        self.rate_limiter = rate_limiter
+        self.is_retryable = is_retryable
+        self.get_retry_after = get_retry_after
+        self.max_retries = max_retries
+        self.max_delay = max_delay
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        # calls, retried, throttled, failed and rejected (by the circuit breaker)
+        self.stats: Counter = Counter()
+        if register:
+            API_BACKENDS[name] = self
+
+    def start_attempt(self) -> None:
+        try:
+            self.circuit_breaker.check()
+        except CircuitOpenError:
+            self.stats["rejected"] += 1
+            raise
+
+    def get_retry_delay(self, exc: Exception, attempt: int) -> Optional[float]:
+        """Records a failed attempt.
+
+        Returns:
+            Optional[float]: seconds to wait before retrying, None to not retry
+        """
+        if not self.is_retryable(exc):
+            # the api responded, it's the call that's wrong
+            self.circuit_breaker.record_success()
+            self.stats["failed"] += 1
+            return None
+        self.circuit_breaker.record_failure()
+        retry_after = self.get_retry_after(exc)
+        if retry_after is not None:
+            self.stats["throttled"] += 1
+        if attempt >= self.max_retries:
+            self.stats["failed"] += 1
+            return None
+        self.stats["retried"] += 1
+        return min(self.max_delay, retry_after or get_backoff_delay(attempt))
+
+    def call(self, function: Callable, *args, **kwargs):
+        """Calls the function, retrying failures with backoff."""
+        self.stats["calls"] += 1
+        for attempt in itertools.count():
+            self.start_attempt()
+            self.rate_limiter.acquire()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as exc:
+                if (delay := self.get_retry_delay(exc, attempt)) is None:
+                    raise
+                time.sleep(delay)
+            else:
+                self.circuit_breaker.record_success()
+                return result
+
+    async def call_async(self, function: Callable, *args, **kwargs):
+        """Awaits the coroutine function, retrying failures with backoff."""
+        self.stats["calls"] += 1
+        for attempt in itertools.count():
+            self.start_attempt()
+            await self.rate_limiter.acquire_async()
+            try:
+                result = await function(*args, **kwargs)
+            except Exception as exc:
+                if (delay := self.get_retry_delay(exc, attempt)) is None:
+                    raise
+                await asyncio.sleep(delay)
+            else:
+                self.circuit_breaker.record_success()
+                return result
+
+    def call_batches(
+        self,
+        items: list,
+        execute_batch: Callable[[list], list[tuple[Any, Exception]]],
+        batch_limit: int,
+        is_retryable: Optional[Callable[[Exception], bool]] = None,
+        rate_limiter: Optional[TokenBucket] = None,
+        max_retries: Optional[int] = None,
+    ) -> list[tuple[Any, Exception]]:
+        """Executes the items in batches, retrying the items that failed with backoff.
+
+        Each batch takes a token per item, and is recorded on the circuit breaker as
+        one call. Once the circuit is open, the remaining items fail with
+        CircuitOpenError rather than being sent.
+
+        Args:
+            items (list): items to execute (eg. requests)
+            execute_batch (Callable[[list], list[tuple[Any, Exception]]]): executes up
+                to batch_limit items in one request, returns the items that failed
+            batch_limit (int): max items per batch
+            is_retryable (Optional[Callable[[Exception], bool]], optional): errors to
+                retry. Defaults to the backend's.
+            rate_limiter (Optional[TokenBucket], optional): Defaults to the backend's.
+            max_retries (Optional[int], optional): Defaults to the backend's.
+
+        Returns:
+            list[tuple[Any, Exception]]: items that failed, with their last error
+        """
+        is_retryable = is_retryable or self.is_retryable
+        rate_limiter = rate_limiter or self.rate_limiter
+        max_retries = self.max_retries if max_retries is None else max_retries
+        self.stats["calls"] += len(items)
+        failed_items: list[tuple[Any, Exception]] = []
+        for attempt in itertools.count():
+            failed: list[tuple[Any, Exception]] = []
+            for start in range(0, len(items), batch_limit):
+                batch = items[start : start + batch_limit]
+                try:
+                    self.start_attempt()
+                except CircuitOpenError as exc:
+                    # the api is failing, the items are left to the caller
+                    unsent = [(item, exc) for item in items[start:]]
+                    return failed_items + failed + unsent
+                rate_limiter.acquire(len(batch))
+                batch_failed = execute_batch(batch)
+                if any(is_retryable(exc) for _, exc in batch_failed):
+                    self.circuit_breaker.record_failure()
+                else:
+                    self.circuit_breaker.record_success()
+                failed += batch_failed
+
+            items = []
+            for item, exc in failed:
+                if attempt < max_retries and is_retryable(exc):
+                    items.append(item)
+                else:
+                    failed_items.append((item, exc))
+            self.stats["failed"] += len(failed) - len(items)
+            retry_afters = [
+                retry_after
+                for _, exc in failed
+                if (retry_after := self.get_retry_after(exc)) is not None
+            ]
+            self.stats["throttled"] += len(retry_afters)
+            self.stats["retried"] += len(items)
+            if not items:
+                return failed_items
+            time.sleep(
+                min(
+                    self.max_delay,
+                    max(retry_afters, default=0) or get_backoff_delay(attempt),
+                )
+            )
+
+
+def get_api_stats() -> dict[str, dict[str, int]]:
+    """Counts of calls, retried, throttled, failed and rejected calls per api."""
+    return {name: dict(backend.stats) for name, backend in API_BACKENDS.items()}
+
+
+# google apis
+
+
+GOOGLE_RATE_LIMIT_REASONS = {"ratelimitexceeded", "userratelimitexceeded"}
+
+
+def get_google_error_reasons(exc: HttpError) -> set[str]:
+    """Lowercased reasons (error.errors[].reason) of a google api error."""
+    try:
+        error = json.loads(exc.content or b"{}")["error"]
+        return {
+            str(details.get("reason", "")).lower()
+            for details in error.get("errors", [])
+        }
+    except (ValueError, KeyError, TypeError, AttributeError):
+        # not a json error, look for the reason in the raw content
+        content = (exc.content or b"").lower()
+        return {
+            reason for reason in GOOGLE_RATE_LIMIT_REASONS if reason.encode() in content
+        }
+
+
+def is_google_rate_limit_error(exc: Exception) -> bool:
+    """Whether the request was throttled (429, or 403 with a rate limit reason).
+
+    Throttled requests weren't applied, so they're safe to retry even if they write.
+    """
+    return isinstance(exc, HttpError) and (
+        exc.resp.status == 429
+        or (
+            exc.resp.status == 403
+            and bool(get_google_error_reasons(exc) & GOOGLE_RATE_LIMIT_REASONS)
+        )
+    )
+
+
+# errors of requests that didn't get a response
+GOOGLE_NETWORK_ERRORS = (
+    httplib2.HttpLib2Error,
+    socket.gaierror,
+    TimeoutError,
+    ConnectionError,
+)
+
+
+def is_retryable_google_error(exc: Exception) -> bool:
+    """Used by the google backends and the calendar sync executor."""
+    if isinstance(exc, GOOGLE_NETWORK_ERRORS):
+        return True
+    if not isinstance(exc, HttpError):
+        return False  # eg. auth errors, bugs
+    if exc.resp.status == 403:
+        return is_google_rate_limit_error(exc)
+    return exc.resp.status in (429, 500, 502, 503, 504)
+
+
+def is_retryable_google_write_error(exc: Exception) -> bool:
+    """If a write that isn't idempotent (eg. insert) can be retried.
+
+    Server errors and dropped connections don't tell whether the write was applied,
+    so only throttled writes and writes that never reached the api are retried.
+    """
+    return is_google_rate_limit_error(exc) or isinstance(
+        exc, (ConnectionRefusedError, httplib2.ServerNotFoundError)
+    )
+
+
+def get_google_retry_after(exc: Exception) -> Optional[float]:
+    if not is_google_rate_limit_error(exc):
+        return None
+    try:
+        return float(exc.resp.get("retry-after", 0))
+    except ValueError:  # http date
+        return 0
+
+
+class BackendHttpRequest(HttpRequest):
+    """googleapiclient request executed through an ApiBackend.
+
+    See get_request_builder.
+    """
+
+    backend: ApiBackend
+
+    def execute(self, http=None, num_retries=0):
+        return self.backend.call(super().execute, http=http)
+
+
+def get_request_builder(backend: ApiBackend) -> type[HttpRequest]:
+    """requestBuilder for googleapiclient.discovery.build, calls go through backend."""
+    return type(
+        f"{backend.name.title()}HttpRequest",
+        (BackendHttpRequest,),
+        {"backend": backend},
+    )
+
+
+# httpx (notion)
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+# a server error doesn't tell whether other requests were applied, so they aren't
+# retried, as that could append blocks or create pages twice.
+IDEMPOTENT_METHODS = ("GET", "HEAD", "DELETE")
+
+
+def is_retryable_status(method: str, status_code: int) -> bool:
+    """Throttled requests are always retried, server errors only if idempotent."""
+    return status_code == 429 or (
+        status_code in RETRYABLE_STATUSES and method.upper() in IDEMPOTENT_METHODS
+    )
+
+
+class RetryableResponseError(Exception):
+    """Response with a retryable status, raised so that ApiBackend retries it."""
+
+    def __init__(self, response: httpx.Response):
+        super().__init__(f"{response.status_code} response")
+        self.response = response
+
+
+def is_retryable_response_error(exc: Exception) -> bool:
+    # requests that never reached the api
+    return isinstance(
+        exc, (RetryableResponseError, httpx.ConnectError, httpx.ConnectTimeout)
+    )
+
+
+def get_response_retry_after(exc: Exception) -> Optional[float]:
+    if not isinstance(exc, RetryableResponseError) or exc.response.status_code != 429:
+        return None
+    try:
+        return float(exc.response.headers.get("Retry-After", 0))
+    except ValueError:  # http date
+        return 0
+
+
+class BackendTransport(httpx.BaseTransport):
+    """httpx transport that sends requests through an ApiBackend.
+
+    Responses with a retryable status (see is_retryable_status) are retried, the
+    last one is returned once out of retries.
+    """
+
+    def __init__(
+        self, backend: ApiBackend, transport: Optional[httpx.BaseTransport] = None
+    ):
+        self.backend = backend
+        self.transport = transport or httpx.HTTPTransport()
+
+    def send(self, request: httpx.Request) -> httpx.Response:
+        response = self.transport.handle_request(request)
+        if is_retryable_status(request.method, response.status_code):
+            response.read()
+            raise RetryableResponseError(response)
+        return response
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        try:
+            return self.backend.call(self.send, request)
+        except RetryableResponseError as err:
+            return err.response
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncBackendTransport(httpx.AsyncBaseTransport):
+    """Async version of BackendTransport."""
+
+    def __init__(
+        self,
+        backend: ApiBackend,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.backend = backend
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def send(self, request: httpx.Request) -> httpx.Response:
+        response = await self.transport.handle_async_request(request)
+        if is_retryable_status(request.method, response.status_code):
+            await response.aread()
+            raise RetryableResponseError(response)
+        return response
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        try:
+            return await self.backend.call_async(self.send, request)
+        except RetryableResponseError as err:
+            return err.response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
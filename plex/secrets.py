@@ -0,0 +1 @@
+email = "test@example.com"
@@ -1,14 +1,26 @@
-import multiprocessing
 import os
 import os.path
-import time
+import threading
+from collections import Counter
 from functools import cache
-from typing import Optional, TypedDict, Union
+from typing import Callable, Iterator, Optional, TypedDict, Union
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+from plex.instrumentation import time_phase
+from plex.rate_limit import (
+    ApiBackend,
+    TokenBucket,
+    get_google_retry_after,
+    get_request_builder,
+    is_retryable_google_error,
+    is_retryable_google_write_error,
+)
 
 # If modifying these scopes, delete the file token.json.
 # note: documentation - https://googleapis.github.io/google-api-python-client/docs/dyn/tasks_v1.html
@@ -16,6 +28,16 @@ SCOPES = ["https://www.googleapis.com/auth/tasks"]
 
 CREDENTIALS_BASEPATH = os.path.join(os.environ["HOME"], ".credentials/")
 
+# each call in a batch counts towards the quota, keep batches within a burst.
+TASKS_BATCH_LIMIT = 20
+# tasks api quota is per day, but bursts get rate limited.
+TASKS_BACKEND = ApiBackend(
+    "tasks",
+    TokenBucket(rate=10, capacity=TASKS_BATCH_LIMIT),
+    is_retryable_google_error,
+    get_google_retry_after,
+)
+
 
 @cache
 def get_task_service():
@@ -38,29 +60,126 @@ def get_task_service():
         # Save the credentials for the next run
         with open(credentials_token_file, "w") as token:
             token.write(creds.to_json())
-    service = build("tasks", "v1", credentials=creds)
+    service = build(
+        "tasks",
+        "v1",
+        credentials=creds,
+        requestBuilder=get_request_builder(TASKS_BACKEND),
+    )
     return service
 
 
-@cache
+# max page sizes allowed by the tasks api
+TASKS_PAGE_SIZE = 100
+TASKLISTS_PAGE_SIZE = 100
+
+
+def iterate_paginated(
+    list_function: Callable[..., HttpRequest], page_size: int, **kwargs
+) -> Iterator[dict]:
+    """Yields the items of every page of a tasks api list method."""
+    page_token = None
+    while True:
+        results = list_function(
+            maxResults=page_size, pageToken=page_token, **kwargs
+        ).execute()
+        yield from results.get("items", [])
+        if not (page_token := results.get("nextPageToken")):
+            return
+
+
+def get_tasklists():
+    """Gets all tasklists"""
+    return list(
+        iterate_paginated(get_task_service().tasklists().list, TASKLISTS_PAGE_SIZE)
+    )
+
+
+def get_tasklist_prefix(title: str) -> str:
+    # tasklists made by put_gtasklists are titled "<tasklist_id> - <tasklist_name>"
+    return title.split(" - ", 1)[0]
+
+
+# tasklists by title, and by title prefix. Kept up to date by insert_tasklist and
+# update_tasklist, call clear_tasklist_index if tasklists are changed elsewhere.
+TASKLIST_INDEX: dict[str, dict] = {}
+TASKLIST_PREFIX_INDEX: dict[str, list[dict]] = {}
+TASKLIST_INDEX_LOADED = [False]
+TASKLIST_INDEX_LOCK = threading.RLock()
+
+
+def index_tasklist(tasklist: dict) -> None:
+    with TASKLIST_INDEX_LOCK:
+        # first instance of a title is used
+        TASKLIST_INDEX.setdefault(tasklist["title"], tasklist)
+        TASKLIST_PREFIX_INDEX.setdefault(
+            get_tasklist_prefix(tasklist["title"]), []
+        ).append(tasklist)
+
+
+def unindex_tasklist(tasklist: dict) -> None:
+    with TASKLIST_INDEX_LOCK:
+        if TASKLIST_INDEX.get(tasklist["title"], {}).get("id") == tasklist["id"]:
+            TASKLIST_INDEX.pop(tasklist["title"])
+        prefix = get_tasklist_prefix(tasklist["title"])
+        TASKLIST_PREFIX_INDEX[prefix] = [
+            indexed
+            for indexed in TASKLIST_PREFIX_INDEX.get(prefix, [])
+            if indexed["id"] != tasklist["id"]
+        ]
+
+
+def load_tasklist_index() -> None:
+    with TASKLIST_INDEX_LOCK:
+        if TASKLIST_INDEX_LOADED[0]:
+            return
+        for tasklist in get_tasklists():
+            index_tasklist(tasklist)
+        TASKLIST_INDEX_LOADED[0] = True
+
+
+def clear_tasklist_index() -> None:
+    with TASKLIST_INDEX_LOCK:
+        TASKLIST_INDEX.clear()
+        TASKLIST_PREFIX_INDEX.clear()
+        TASKLIST_INDEX_LOADED[0] = False
+
+
 def get_tasklist(tasklist_name: str) -> Optional[dict[str, str]]:
-    service = get_task_service()
-    # Call the Tasks API
-    results = service.tasklists().list().execute()
-    tasklists = results.get("items", [])
+    load_tasklist_index()
+    return TASKLIST_INDEX.get(tasklist_name)
+
+
+def get_tasklists_with_prefix(prefix: str) -> list[dict]:
+    """Gets the tasklists titled "<prefix> - <name>" (or just "<prefix>")."""
+    load_tasklist_index()
+    return list(TASKLIST_PREFIX_INDEX.get(prefix, []))
+
 
-    if tasklists:
-        for tasklist in tasklists:
-            if tasklist["title"] == tasklist_name:
-                return tasklist
-    return None
+def insert_tasklist(title: str) -> dict:
+    tasklist = get_task_service().tasklists().insert(body={"title": title}).execute()
+    index_tasklist(tasklist)
+    return tasklist
+
+
+def update_tasklist(tasklist: dict, title: str) -> dict:
+    updated = (
+        get_task_service()
+        .tasklists()
+        .update(tasklist=tasklist["id"], body={**tasklist, "title": title})
+        .execute()
+    )
+    with TASKLIST_INDEX_LOCK:
+        unindex_tasklist(tasklist)
+        index_tasklist(updated)
+    return updated
 
 
 def get_tasks(
     tasklist_name: str, show_completed: bool = False
 ) -> list[dict[str, Union[list, str]]]:
     """
-    Gets tasks to do.
+    Gets tasks to do, following every page of results.
     Will look at the first instance of a tasklist named 'tasklist_name'.
     """
 
@@ -69,128 +188,203 @@ def get_tasks(
     tasklist = get_tasklist(tasklist_name)
     if not tasklist:
         return []
-    results = (
-        service.tasks()
-        .list(
+    tasks = list(
+        iterate_paginated(
+            service.tasks().list,
+            TASKS_PAGE_SIZE,
             tasklist=tasklist["id"],
             showCompleted=show_completed,
             showHidden=show_completed,
         )
-        .execute()
     )
-    tasks = results.get("items", [])
     # if not show_completed:
     #     tasks = [task for task in tasks if task["status"] == "needsAction"]
     return tasks
 
 
-def get_tasklists():
-    """Gets all tasklists"""
-    service = get_task_service()
-    results = service.tasklists().list().execute()
-    tasklists = results.get("items", [])
-    return tasklists
-
-
 class GTaskList(TypedDict):
     name: str  # name of task.
     subtasks: list[str]  # subtasks of task
 
 
-def delete_task(tasklist, task):
+def is_task_already_deleted(exc: Exception) -> bool:
+    return isinstance(exc, HttpError) and exc.resp.status in (404, 410)
+
+
+def execute_task_requests(
+    make_requests: list[Callable[[], HttpRequest]],
+    is_ok: Callable[[Exception], bool] = lambda exc: False,
+    is_retryable: Callable[[Exception], bool] = is_retryable_google_error,
+) -> list[Optional[dict]]:
+    """Executes tasks api requests as batch requests of up to TASKS_BATCH_LIMIT calls.
+
+    Calls that fail with retryable errors are retried in later batches.
+
+    Args:
+        make_requests (list[Callable[[], HttpRequest]]): makes each request
+        is_ok (Callable[[Exception], bool], optional): errors that count as done.
+            Defaults to none.
+        is_retryable (Callable[[Exception], bool], optional): errors to retry.
+            Defaults to is_retryable_google_error, use
+            is_retryable_google_write_error for requests that aren't idempotent.
+
+    Returns:
+        list[Optional[dict]]: response of each request (None for ok errors)
+
+    Raises:
+        HttpError: first error that isn't retryable (or is out of retries)
+    """
     service = get_task_service()
-    service.tasks().delete(tasklist=tasklist["id"], task=task["id"]).execute()
-    print(f"done: {task['title']}")
+    responses: list[Optional[dict]] = [None] * len(make_requests)
+
+    def execute_batch(batch_indices: list[int]) -> list[tuple[int, Exception]]:
+        failed: dict[int, Exception] = {}
+        reported: set[int] = set()
+
+        def callback(request_id: str, response: dict, exc: Optional[Exception]):
+            reported.add(int(request_id))
+            if exc is None:
+                responses[int(request_id)] = response
+            elif not is_ok(exc):
+                failed[int(request_id)] = exc
+
+        batch = service.new_batch_http_request(callback=callback)
+        for idx in batch_indices:
+            batch.add(make_requests[idx](), request_id=str(idx))
+        try:
+            batch.execute()
+        except Exception as exc:  # whole batch failed (eg. network error)
+            failed.update((idx, exc) for idx in batch_indices if idx not in reported)
+        return list(failed.items())
+
+    failed = TASKS_BACKEND.call_batches(
+        list(range(len(make_requests))),
+        execute_batch,
+        TASKS_BATCH_LIMIT,
+        is_retryable=is_retryable,
+    )
+    if failed:
+        raise failed[0][1]
+    return responses
+
+
+def get_gtask_key(task: dict, titles: dict[str, str]) -> tuple[str, str]:
+    """(title, parent title) of a task, parent is a title (new) or id (current)"""
+    parent = task.get("parent", "")
+    return task["title"], titles.get(parent, parent)
+
+
+def diff_gtasks(
+    cur_tasks: list[dict], new_tasks: list[dict]
+) -> tuple[list[dict], list[dict], dict[str, str]]:
+    """Matches current and new tasks by (title, parent title), counting duplicates.
+
+    Args:
+        cur_tasks (list[dict]): tasks in the tasklist, parents are ids
+        new_tasks (list[dict]): tasks to have, parents are titles
+
+    Returns:
+        tuple[list[dict], list[dict], dict[str, str]]: current tasks to delete (not
+            including subtasks of deleted tasks), new tasks to insert, and ids of the
+            kept top level tasks by title
+    """
+    titles = {task["id"]: task["title"] for task in cur_tasks}
+    unmatched = Counter(get_gtask_key(task, {}) for task in new_tasks)
+    kept, old_tasks = [], []
+    for task in cur_tasks:
+        key = get_gtask_key(task, titles)
+        if unmatched[key]:
+            unmatched[key] -= 1
+            kept.append(task)
+        else:
+            old_tasks.append(task)
+
+    # subtasks are deleted with their parent, so kept ones need to be inserted again
+    deleted_ids = {task["id"] for task in old_tasks}
+    for task in kept:
+        if task.get("parent") in deleted_ids:
+            unmatched[get_gtask_key(task, titles)] += 1
+    old_tasks = [task for task in old_tasks if task.get("parent") not in deleted_ids]
+    parents = {task["title"]: task["id"] for task in kept if not task.get("parent")}
+
+    inserted = []
+    for task in new_tasks:
+        key = get_gtask_key(task, {})
+        if unmatched[key]:
+            unmatched[key] -= 1
+            inserted.append(task)
+    return old_tasks, inserted, parents
 
 
 def put_gtasklists(tasklist_id: str, tasklist_name: str, gtasklists: list[GTaskList]):
-    """Creates/updates task (and tasklist if not created already)"""
+    """Creates/updates task (and tasklist if not created already)
+
+    Tasks are deleted and inserted with batch requests, subtasks are inserted under
+    their parent directly. Phase timings are recorded as "tasks.<phase>".
+    """
     ### Get or Create Tasklist ###
     tasklist_title = f"{tasklist_id} - {tasklist_name}"
     service = get_task_service()
-    # find tasklist that begins with tasklist_id
-    for tasklist in get_tasklists():
-        if tasklist["title"].startswith(tasklist_id):
+    # find tasklists of tasklist_id
+    for tasklist in get_tasklists_with_prefix(tasklist_id):
+        if tasklist["title"] != tasklist_title:
             # update tasklist to new title
-            tasklist["title"] = tasklist_title
-            service.tasklists().update(tasklist=tasklist["id"], body=tasklist).execute()
+            update_tasklist(tasklist, tasklist_title)
 
     # create tasklist if not found
     tasklist = get_tasklist(tasklist_title)
     if tasklist is None:
-        tasklist = service.tasklists().insert(body={"title": tasklist_title}).execute()
+        tasklist = insert_tasklist(tasklist_title)
 
     ### Populate with Tasks ###
-    # cur tasks
-    start_time = time.time()
-    cur_tasks = get_tasks(tasklist_title)
-    # consolidate cur tasks
-    parents = {task["title"]: task["id"] for task in cur_tasks}  # name: id
-    parents[""] = ""
-    # convert gtaskslists
-    new_tasks = []
-    for gtasklist in gtasklists:
-        new_tasks.append({"title": gtasklist["name"]})
-        for subtask in gtasklist["subtasks"]:
-            new_tasks.append({"title": subtask, "parent": gtasklist["name"]})
-
-    # identify diff
-    old_tasks = []
-    for ctask in cur_tasks:
-        nchange = len(new_tasks)
-        if new_tasks := [
-            ntask
-            for ntask in new_tasks
-            if not (
-                ntask["title"] == ctask["title"]
-                and (
-                    parents[ntask.get("parent", "")]
-                    == ctask.get(
-                        "parent", ""
-                    )  # these parents don't match since one is an id and one is a title
-                    or ctask["status"] == "completed"
-                )
-            )
-        ]:
-            if len(new_tasks) == nchange:  # task doesn't exist in new_tasks, delete
-                old_tasks.append(ctask)
-    print(f"getting tasks took {time.time() - start_time} seconds")
-
-    # delete tasks
-    start_time = time.time()
-
-    multiprocessing.Pool(10).starmap(
-        func=delete_task, iterable=[(tasklist, i) for i in old_tasks]
-    )
-    print(f"deleting tasks took {time.time() - start_time} seconds")
-    start_time = time.time()
+    with time_phase("tasks.diff"):
+        cur_tasks = get_tasks(tasklist_title)
+        # convert gtaskslists
+        new_tasks = []
+        for gtasklist in gtasklists:
+            new_tasks.append({"title": gtasklist["name"]})
+            for subtask in gtasklist["subtasks"]:
+                new_tasks.append({"title": subtask, "parent": gtasklist["name"]})
+        old_tasks, new_tasks, parents = diff_gtasks(cur_tasks, new_tasks)
 
-    for task in new_tasks:
-        if "parent" not in task:
-            response = (
-                service.tasks().insert(tasklist=tasklist["id"], body=task).execute()
-            )
-    print(f"inserting parent tasks took {time.time() - start_time} seconds")
-    start_time = time.time()
+    tasks = service.tasks()
+    with time_phase("tasks.delete"):
+        execute_task_requests(
+            [
+                lambda task=task: tasks.delete(tasklist=tasklist["id"], task=task["id"])
+                for task in old_tasks
+            ],
+            is_ok=is_task_already_deleted,
+        )
 
-    # regen parents
-    parents = {
-        task["title"]: task["id"] for task in get_tasks(tasklist_title)
-    }  # name: id
-    parents[""] = ""
+    with time_phase("tasks.insert_parents"):
+        parent_tasks = [task for task in new_tasks if "parent" not in task]
+        responses = execute_task_requests(
+            [
+                lambda task=task: tasks.insert(tasklist=tasklist["id"], body=task)
+                for task in parent_tasks
+            ],
+            is_retryable=is_retryable_google_write_error,
+        )
+        parents.update(
+            (task["title"], response["id"])
+            for task, response in zip(parent_tasks, responses)
+        )
 
-    # assign children
-    for task in new_tasks:
-        if "parent" in task:
-            response = (
-                service.tasks().insert(tasklist=tasklist["id"], body=task).execute()
-            )
-            service.tasks().move(
-                tasklist=tasklist["id"],
-                task=response["id"],
-                parent=parents[task["parent"]],
-            ).execute()
-    print(f"inserting and moving child tasks took {time.time() - start_time} seconds")
+    # subtasks are inserted under their parent, rather than inserted then moved
+    with time_phase("tasks.insert_children"):
+        execute_task_requests(
+            [
+                lambda task=task: tasks.insert(
+                    tasklist=tasklist["id"],
+                    parent=parents[task["parent"]],
+                    body={"title": task["title"]},
+                )
+                for task in new_tasks
+                if "parent" in task
+            ],
+            is_retryable=is_retryable_google_write_error,
+        )
 
     # # get current tasks
     # parents = {}
@@ -0,0 +1,280 @@
+"""
+Tests calendar syncing against the local fake calendar.
+"""
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import plex.calendar_api.base as calendar_base
+import plex.daily.calendar as daily_calendar
+from plex.calendar_api import (
+    CalendarChange,
+    CalendarOperation,
+    execute_calendar_changes,
+    generate_event_id,
+    get_plex_calendar_event_changes,
+    get_task_uuid_from_event_id,
+    is_event_cancelled,
+    make_calendar_event,
+)
+from plex.calendar_api.executor import CalendarSyncExecutor
+from plex.calendar_api.fake import (
+    FakeBatchHttpRequest,
+    FakeCalendarService,
+    FakeGoogleCalendar,
+    make_http_error,
+)
+from plex.calendar_api.mirror import MIRROR_FILE, get_mirror_event_for_task
+from plex.daily.calendar import (
+    update_calendar_with_taskgroups,
+    update_calendar_with_tasks,
+)
+from plex.daily.tasks import Task, TaskGroup
+from plex.rate_limit import CircuitBreaker, CircuitOpenError, TokenBucket
+
+DATESTR = "2024-01-15"
+DATE_ID = DATESTR.replace("-", "")
+START = datetime(2024, 1, 15, 7, 30).astimezone()
+
+
+@pytest.fixture
+def calendar(monkeypatch, tmp_path) -> FakeGoogleCalendar:
+    monkeypatch.chdir(tmp_path)  # cache files are written relative to cwd
+    fake_calendar = FakeGoogleCalendar(FakeCalendarService(page_size=3))
+    monkeypatch.setattr(calendar_base, "get_calendar", lambda: fake_calendar)
+    return fake_calendar
+
+
+def make_events(num: int) -> list[CalendarChange]:
+    changes = []
+    for idx in range(num):
+        event_id = generate_event_id(DATE_ID, f"task:{idx}")
+        changes.append(
+            CalendarChange(
+                CalendarOperation.create,
+                event_id,
+                make_calendar_event(
+                    event_id,
+                    f"task {idx}",
+                    START + timedelta(hours=idx),
+                    START + timedelta(hours=idx + 1),
+                ),
+            )
+        )
+    return changes
+
+
+def test_batch_changes(calendar: FakeGoogleCalendar) -> None:
+    changes = make_events(120)
+    result = execute_calendar_changes(changes)
+    assert len(result.succeeded) == 120 and not result.failed
+    assert calendar.service.num_http_requests == 3
+
+    result = execute_calendar_changes(
+        [CalendarChange(CalendarOperation.delete, changes[0].event_id)]
+        + [CalendarChange(CalendarOperation.update, "missing", changes[1].event)]
+    )
+    assert result.succeeded == [
+        CalendarChange(CalendarOperation.delete, changes[0].event_id)
+    ]
+    assert [change.event_id for change, _ in result.failed] == ["missing"]
+
+
+def test_sync_token_changes(calendar: FakeGoogleCalendar) -> None:
+    changes = make_events(5)
+    execute_calendar_changes(changes)
+
+    events, sync_token = get_plex_calendar_event_changes(date_id=DATE_ID)
+    assert len(events) == 5
+
+    events, sync_token = get_plex_calendar_event_changes(sync_token, DATE_ID)
+    assert events == []
+
+    execute_calendar_changes(
+        [
+            CalendarChange(
+                CalendarOperation.update, changes[2].event_id, changes[2].event
+            ),
+            CalendarChange(CalendarOperation.delete, changes[3].event_id),
+        ]
+    )
+    events, sync_token = get_plex_calendar_event_changes(sync_token, DATE_ID)
+    assert [event.id for event in events] == [
+        changes[2].event_id,
+        changes[3].event_id,
+    ]
+    assert [is_event_cancelled(event) for event in events] == [False, True]
+
+    # expired tokens fall back to a full sync
+    calendar.service.expire_sync_tokens()
+    events, sync_token = get_plex_calendar_event_changes(sync_token, DATE_ID)
+    assert len(events) == 5
+
+
+def test_calendar_edits_become_diffs(calendar: FakeGoogleCalendar) -> None:
+    tasks = [
+        Task("wake up", 30, START, START + timedelta(minutes=30), uuid="wake:0"),
+        Task(
+            "workout",
+            60,
+            START + timedelta(minutes=30),
+            START + timedelta(minutes=90),
+            uuid="workout:0",
+        ),
+    ]
+    assert update_calendar_with_taskgroups([TaskGroup(list(tasks))], DATESTR) == []
+
+    # move workout 10 minutes later in the calendar
+    event = next(event for event in calendar.get_events() if event.summary == "workout")
+    event.start += timedelta(minutes=10)
+    event.end += timedelta(minutes=10)
+    calendar.update_event(event)
+
+    taskgroups = update_calendar_with_taskgroups([TaskGroup(list(tasks))], DATESTR)
+    workout = taskgroups[0].tasks[1]
+    assert (workout.start_diff, workout.end_diff) == (10, None)
+
+    # no new edits, nothing to update
+    assert update_calendar_with_taskgroups([TaskGroup(list(tasks))], DATESTR) == []
+
+
+def test_sync_token_covers_every_date(calendar: FakeGoogleCalendar, monkeypatch):
+    sync_tokens = []
+
+    def get_changes(sync_token=None):
+        sync_tokens.append(sync_token)
+        return get_plex_calendar_event_changes(sync_token)
+
+    monkeypatch.setattr(daily_calendar, "get_plex_calendar_event_changes", get_changes)
+
+    def make_tasks(start: datetime) -> list[Task]:
+        return [
+            Task(
+                f"task {idx}",
+                30,
+                start + timedelta(minutes=30 * idx),
+                start + timedelta(minutes=30 * (idx + 1)),
+                uuid=f"task:{idx}",
+            )
+            for idx in range(4)
+        ]
+
+    next_datestr = "2024-01-16"
+    next_start = START + timedelta(days=1)
+    assert (
+        update_calendar_with_taskgroups([TaskGroup(make_tasks(START))], DATESTR) == []
+    )
+
+    # only the first poll lists the whole calendar, not the first poll of each date
+    next_tasks = make_tasks(next_start)
+    assert update_calendar_with_taskgroups([TaskGroup(next_tasks)], next_datestr) == []
+    assert sync_tokens[0] is None and None not in sync_tokens[1:]
+
+    # edits of a date are kept while another date is polled
+    event = calendar.get_event(generate_event_id("20240116", "task:1"))
+    event.start += timedelta(minutes=10)
+    calendar.update_event(event)
+    assert (
+        update_calendar_with_taskgroups([TaskGroup(make_tasks(START))], DATESTR) == []
+    )
+    taskgroups = update_calendar_with_taskgroups([TaskGroup(next_tasks)], next_datestr)
+    assert taskgroups[0].tasks[1].start_diff == 10
+    assert update_calendar_with_taskgroups([TaskGroup(next_tasks)], next_datestr) == []
+
+
+def test_pushed_events_are_not_edits(calendar: FakeGoogleCalendar) -> None:
+    def make_tasks(minutes: int) -> list[Task]:
+        # a ends and b starts `minutes` later
+        middle = START + timedelta(minutes=30 + minutes)
+        return [
+            Task("a", 30 + minutes, START, middle, uuid="a:0"),
+            Task("b", 30, middle, middle + timedelta(minutes=30), uuid="b:0"),
+        ]
+
+    # each cycle polls the events pushed by the previous one
+    for minutes in (0, 15, 30):
+        tasks = make_tasks(minutes)
+        assert update_calendar_with_taskgroups([TaskGroup(tasks)], DATESTR) == []
+    assert sorted((event.summary, event.end) for event in calendar.get_events()) == [
+        ("a", START + timedelta(minutes=60)),
+        ("b", START + timedelta(minutes=90)),
+    ]
+
+
+def test_event_ids_are_deterministic() -> None:
+    event_id = generate_event_id(DATE_ID, "untitled/1:12")
+    assert event_id == generate_event_id(DATE_ID, "untitled/1:12")
+    assert event_id != generate_event_id(DATE_ID, "untitled/1:13")
+    assert get_task_uuid_from_event_id(event_id, DATE_ID) == "untitled/1:12"
+
+
+def test_upsert_without_cache(calendar: FakeGoogleCalendar) -> None:
+    tasks = [
+        Task(
+            f"task {idx}",
+            30,
+            START + timedelta(minutes=30 * idx),
+            START + timedelta(minutes=30 * (idx + 1)),
+            uuid=f"task:{idx}",
+        )
+        for idx in range(4)
+    ]
+    update_calendar_with_tasks(tasks, DATESTR)
+    assert len(list(calendar.get_events())) == 4
+
+    # no writes if nothing changed
+    requests = calendar.service.num_http_requests
+    update_calendar_with_tasks(tasks, DATESTR)
+    assert calendar.service.num_http_requests == requests + 2  # 2 listing pages
+    assert get_mirror_event_for_task(DATESTR, "task:1").summary == "task 1"
+
+    # or if the local mirror is lost
+    os.remove(MIRROR_FILE)
+    requests = calendar.service.num_http_requests
+    update_calendar_with_tasks(tasks, DATESTR)
+    assert calendar.service.num_http_requests == requests + 2
+
+    # deleted events are restored, removed tasks are deleted
+    calendar.delete_event(generate_event_id(DATE_ID, "task:0"))
+    update_calendar_with_tasks(tasks[:3], DATESTR)
+    assert sorted(event.summary for event in calendar.get_events()) == [
+        "task 0",
+        "task 1",
+        "task 2",
+    ]
+
+
+def test_sync_executor(calendar: FakeGoogleCalendar) -> None:
+    executor = CalendarSyncExecutor(
+        max_workers=2, rate_limiter=TokenBucket(rate=1000, capacity=50), batch_limit=5
+    )
+    callbacks = []
+    future = executor.submit(lambda: make_events(12), callback=callbacks.append)
+    result = future.result(timeout=5)
+    executor.shutdown()
+    assert len(result.succeeded) == 12 and not result.failed
+    assert callbacks == [future]
+    assert len(list(calendar.get_events())) == 12
+
+
+def test_sync_executor_circuit_breaker(calendar: FakeGoogleCalendar, monkeypatch):
+    backend = calendar_base.CALENDAR_BACKEND
+    monkeypatch.setattr(backend, "circuit_breaker", CircuitBreaker(failure_threshold=1))
+    monkeypatch.setattr(backend, "max_delay", 0)
+
+    def fail(batch):
+        calendar.service.num_http_requests += 1
+        raise make_http_error(503, "Backend Error")
+
+    monkeypatch.setattr(FakeBatchHttpRequest, "execute", fail)
+    executor = CalendarSyncExecutor(
+        rate_limiter=TokenBucket(rate=1000, capacity=50), batch_limit=5
+    )
+    result = executor.submit(lambda: make_events(5)).result(timeout=5)
+    executor.shutdown()
+    # the failed batch opens the circuit, the changes are deferred instead of retried
+    assert calendar.service.num_http_requests == 1
+    assert len(result.failed) == 5 and not result.succeeded
+    assert all(isinstance(exc, CircuitOpenError) for _, exc in result.failed)
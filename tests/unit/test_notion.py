@@ -0,0 +1,441 @@
+"""
+Tests notion page lookups
+"""
+
+import itertools
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from notion_client.errors import APIResponseError
+
+from plex.daily.tasks.push_notes import clear_notion_snapshots
+from plex.notion_api import page as notion_page
+from plex.notion_api.fake import FakeNotion, install_fake_notion
+from plex.rate_limit import CircuitBreaker, TokenBucket
+
+
+class StubNotionClient:
+    def __init__(self, pages: dict[str, dict]):
+        self.pages_by_id = {page["id"]: page for page in pages.values()}
+        self.pages_by_name = pages
+        self.num_searches = 0
+        self.num_retrieves = 0
+        self.pages = SimpleNamespace(retrieve=self.retrieve)
+
+    def search(self, query, start_cursor=None, page_size=100):
+        self.num_searches += 1
+        results = [self.pages_by_name[query]] if query in self.pages_by_name else []
+        return {"results": results, "has_more": False, "next_cursor": None}
+
+    def retrieve(self, page_id):
+        self.num_retrieves += 1
+        if page_id not in self.pages_by_id:
+            raise APIResponseError(httpx.Response(404), "Not found", "object_not_found")
+        return self.pages_by_id[page_id]
+
+
+def make_page(page_id: str, title: str) -> dict:
+    return {
+        "object": "page",
+        "id": page_id,
+        "archived": False,
+        "in_trash": False,
+        "properties": {"title": {"title": [{"plain_text": title}]}},
+    }
+
+
+def restart(monkeypatch):
+    monkeypatch.setattr(notion_page, "PAGE_CACHE", {})
+    monkeypatch.setattr(notion_page, "PAGE_CACHE_LOADED", [False])
+
+
+@pytest.fixture
+def notion(tmp_path, monkeypatch):
+    client = StubNotionClient({"Schedule": make_page("schedule-id", "Schedule")})
+    monkeypatch.setattr(notion_page, "get_client", lambda: client)
+    monkeypatch.setattr(
+        notion_page, "PAGE_DIRECTORY_FILE", str(tmp_path / "page_directory.json")
+    )
+    monkeypatch.setattr(notion_page, "PAGE_CACHE_STATS", notion_page.Counter())
+    restart(monkeypatch)
+    return client
+
+
+def test_page_directory(notion, monkeypatch):
+    assert notion_page.get_page("Schedule")["id"] == "schedule-id"
+    assert notion_page.get_page("Schedule")["id"] == "schedule-id"
+    assert notion.num_searches == 1
+
+    # error recovery and restarts check the page instead of searching
+    notion_page.clear_page_cache()
+    assert notion_page.get_page("Schedule")["id"] == "schedule-id"
+    restart(monkeypatch)
+    assert notion_page.get_page("Schedule")["id"] == "schedule-id"
+    assert (notion.num_searches, notion.num_retrieves) == (1, 2)
+
+    # pages that no longer exist are resolved again
+    notion.pages_by_id.pop("schedule-id")
+    notion.pages_by_name["Schedule"] = make_page("new-schedule-id", "Schedule")
+    notion.pages_by_id["new-schedule-id"] = notion.pages_by_name["Schedule"]
+    restart(monkeypatch)
+    assert notion_page.get_page("Schedule")["id"] == "new-schedule-id"
+    assert notion.num_searches == 2
+    assert notion_page.PAGE_CACHE_STATS == {
+        "hits": 3,
+        "misses": 2,
+        "revalidations": 3,
+        "invalidations": 1,
+    }
+
+    with pytest.raises(notion_page.PageNotFoundError):
+        notion_page.get_page("Missing")
+
+
+class StubBlocksClient:
+    def __init__(self):
+        self.appends = []
+        self.blocks = SimpleNamespace(children=SimpleNamespace(append=self.append))
+
+    async def append(self, parent_id, children, after=None):
+        assert len(children) <= notion_page.NOTION_APPEND_LIMIT
+        for child in children:
+            assert not child["to_do"]["children"]
+        results = [
+            {"id": f"{parent_id}/{len(self.appends)}-{idx}"}
+            for idx in range(len(children))
+        ]
+        self.appends.append((parent_id, len(children), after))
+        return {"results": results}
+
+
+def make_todo(children: list = []) -> notion_page.NotionContent:
+    return notion_page.NotionContent(
+        notion_page.NotionType.to_do,
+        sections=[notion_page.NotionSection("task")],
+        children=children,
+    )
+
+
+def test_add_tasks_in_chunks(monkeypatch):
+    client = StubBlocksClient()
+    monkeypatch.setattr(notion_page, "get_async_client", lambda: client)
+    grandchild = make_todo()
+    contents = [make_todo() for _ in range(150)] + [
+        make_todo([make_todo([grandchild]), make_todo()])
+    ]
+    notion_page.add_tasks_after(contents, after_uuid="first", parent_uuid="page")
+
+    # top level is appended in order, after the previous chunk
+    assert client.appends[:2] == [
+        ("page", 100, "first"),
+        ("page", 51, contents[99].notion_uuid),
+    ]
+    # children are appended under the created blocks
+    assert client.appends[2:] == [
+        (contents[-1].notion_uuid, 2, None),
+        (contents[-1].children[0].notion_uuid, 1, None),
+    ]
+    assert grandchild.notion_uuid.startswith(contents[-1].children[0].notion_uuid)
+
+
+def test_link_resolution_is_cached(monkeypatch):
+    row = {
+        "id": "4f3c9f0e-5a2b-4c1d-9e8f-7a6b5c4d3e2f",
+        "properties": {
+            "name": {"title": [{"text": {"content": "task"}}]},
+            "uuid": {"rich_text": [{"text": {"content": "task-uuid"}}]},
+        },
+    }
+    retrieved = []
+    client = SimpleNamespace(
+        pages=SimpleNamespace(retrieve=lambda page_id: retrieved.append(page_id) or row)
+    )
+    monkeypatch.setattr(notion_page, "get_client", lambda: client)
+    notion_page.get_database_content_from_link.cache_clear()
+
+    result = {
+        "id": "block-id",
+        "to_do": {
+            "rich_text": [
+                {
+                    "text": {
+                        "content": "|task-uuid:0|",
+                        "link": {"url": "/" + row["id"].replace("-", "")},
+                    },
+                    "annotations": {"color": "gray"},
+                }
+            ]
+        },
+    }
+    for _ in range(3):
+        content = notion_page.process_notion_result_to_notion_content(result)
+        assert content.sections[0].database_content.entry_uuid == row["id"]
+    assert len(retrieved) == 1
+    notion_page.get_database_content_from_link.cache_clear()
+
+
+@pytest.fixture
+def fake_notion(tmp_path, monkeypatch):
+    fake = FakeNotion(max_page_size=2)
+    # restored after the test, install_fake_notion redirects it to tmp_path
+    monkeypatch.setattr(
+        notion_page, "PAGE_DIRECTORY_FILE", notion_page.PAGE_DIRECTORY_FILE
+    )
+    monkeypatch.setattr(notion_page, "PAGE_CACHE_STATS", notion_page.Counter())
+    backend = notion_page.NOTION_BACKEND
+    monkeypatch.setattr(backend, "rate_limiter", TokenBucket(1000, 1000))
+    monkeypatch.setattr(backend, "max_delay", 0)
+    monkeypatch.setattr(backend, "stats", notion_page.Counter())
+    monkeypatch.setattr(backend, "circuit_breaker", CircuitBreaker())
+    install_fake_notion(fake, str(tmp_path))
+    clear_notion_snapshots()
+    yield fake
+    install_fake_notion(None, str(tmp_path))
+    clear_notion_snapshots()
+
+
+def get_tree(contents: list[notion_page.NotionContent]) -> list:
+    return [
+        (
+            content.sections[0].content,
+            content.sections[0].database_content
+            and content.sections[0].database_content.uuid,
+            get_tree(content.children),
+        )
+        for content in contents
+    ]
+
+
+def make_row_todo(row_uuid: str, children: list = []) -> notion_page.NotionContent:
+    content = make_todo(children)
+    content.sections[0].database_content = notion_page.DatabaseContent("task", row_uuid)
+    return content
+
+
+def test_fake_notion_round_trip(fake_notion):
+    row = notion_page.DatabaseContent("task", "task-uuid")
+    contents = [make_todo() for _ in range(3)] + [make_todo([make_todo(), make_todo()])]
+    contents[0].sections[0].database_content = row
+    notion_page.add_tasks_after(contents, default_page_name="2024-01-01")
+
+    assert notion_page.get_subpages().keys() == {"2024-01-01"}
+    pulled = notion_page.get_contents(default_page_name="2024-01-01")
+    # listings are paginated by the fake
+    assert get_tree(pulled) == get_tree(contents)
+    assert get_tree(pulled)[0][1] == "task-uuid"
+    assert [content.notion_uuid for content in pulled] == [
+        content.notion_uuid for content in contents
+    ]
+    assert fake_notion.requests["GET blocks {id} children"] > 2
+    assert fake_notion.requests["POST pages"] == 2  # subpage and database row
+
+    notion_page.delete_block(contents[1])
+    notion_page.update_task(
+        notion_page.NotionContent(
+            notion_page.NotionType.to_do, [notion_page.NotionSection("renamed")]
+        ),
+        contents[2].notion_uuid,
+    )
+    pulled = notion_page.get_contents(default_page_name="2024-01-01")
+    assert [content.sections[0].content for content in pulled] == [
+        "task",
+        "renamed",
+        "task",
+    ]
+
+
+def test_fake_notion_reinstall(fake_notion, tmp_path):
+    def add_row():
+        content = make_todo()
+        content.sections[0].database_content = notion_page.DatabaseContent(
+            "task", "task-uuid"
+        )
+        notion_page.add_tasks_after([content], default_page_name="2024-01-01")
+
+    add_row()
+    # nothing from the previous fake's workspace is used
+    fake = FakeNotion(max_page_size=2)
+    install_fake_notion(fake, str(tmp_path))
+    add_row()
+    assert fake.requests["POST pages"] == 2
+
+
+def test_fake_notion_rate_limits(fake_notion):
+    fake_notion.rate_limit_every = 2
+    # throttled requests are retried
+    notion_page.get_page(notion_page.PAGE_NAME)
+    assert notion_page.get_subpages() == {}
+    assert fake_notion.num_rate_limited == 1
+    assert notion_page.NOTION_BACKEND.stats["throttled"] == 1
+
+    fake_notion.rate_limit_every = 1
+    with pytest.raises(APIResponseError) as err:
+        notion_page.get_subpages()
+    assert err.value.code == "rate_limited"
+    assert (
+        fake_notion.num_rate_limited == 1 + notion_page.NOTION_BACKEND.max_retries + 1
+    )
+
+
+def test_database_is_pulled_once_per_pull(fake_notion):
+    contents = [
+        make_row_todo("a", [make_row_todo("b", [make_row_todo("c")]), make_todo()]),
+        make_todo([make_row_todo("d")]),
+    ]
+    notion_page.add_tasks_after(contents, default_page_name="2024-01-01")
+    notion_page.DATABASE_INDEX_CACHE.clear()
+    fake_notion.requests.clear()
+
+    pulled = notion_page.get_contents(default_page_name="2024-01-01")
+    assert get_tree(pulled) == get_tree(contents)
+    # 4 rows in pages of 2, for a tree with blocks on 3 levels
+    assert fake_notion.requests["POST databases {id} query"] == 2
+    assert fake_notion.requests["GET pages {id}"] == 0  # links use the index
+
+    # the index is reused by the next pulls, until it expires
+    notion_page.get_contents(default_page_name="2024-01-01")
+    assert fake_notion.requests["POST databases {id} query"] == 2
+    notion_page.get_database_index(ttl=0)
+    assert fake_notion.requests["POST databases {id} query"] == 4
+
+
+def test_block_trees_are_fetched_breadth_first(fake_notion):
+    # 10 blocks with children, 3 levels deep
+    contents = [make_todo([make_todo([make_todo()])]) for _ in range(10)]
+    notion_page.add_tasks_after(contents, default_page_name="2024-01-01")
+    fake_notion.requests.clear()
+    fake_notion.max_in_flight = 0
+    fake_notion.latency = 0.05
+
+    start_time = notion_page.time.monotonic()
+    pulled = notion_page.get_contents(default_page_name="2024-01-01")
+    duration = notion_page.time.monotonic() - start_time
+    assert get_tree(pulled) == get_tree(contents)
+    assert [content.notion_uuid for content in pulled] == [
+        content.notion_uuid for content in contents
+    ]
+    # the page, then the 10 blocks of each level, in pages of 2
+    assert fake_notion.requests["GET blocks {id} children"] == 5 + 10 + 10
+    # each level's listings are sent together, within the concurrency limit
+    assert 1 < fake_notion.max_in_flight <= notion_page.NOTION_MAX_WORKERS
+    assert duration < 25 * fake_notion.latency * 0.75  # faster than one at a time
+
+
+def test_listings_are_paginated(fake_notion):
+    fake_notion.max_page_size = notion_page.NOTION_PAGE_SIZE
+    num_results = notion_page.NOTION_PAGE_SIZE + 1
+    contents = [make_row_todo(f"task {idx}") for idx in range(num_results)]
+    notion_page.add_tasks_after(contents, default_page_name="2024-01-01")
+    for idx in range(num_results - 1):
+        notion_page.create_page(f"page {idx}")
+    notion_page.DATABASE_INDEX_CACHE.clear()
+    fake_notion.requests.clear()
+
+    # blocks, subpages and rows past the first page aren't dropped
+    assert len(notion_page.get_subpages()) == num_results
+    pulled = notion_page.get_contents(default_page_name="2024-01-01")
+    assert get_tree(pulled) == get_tree(contents)
+    assert len(notion_page.pull_database_contents_from_notion()) == num_results
+    assert fake_notion.requests["GET blocks {id} children"] == 2 + 2
+    assert fake_notion.requests["POST databases {id} query"] == 2 + 2
+
+    # pages are requested as results are consumed
+    fake_notion.requests.clear()
+    page_id = notion_page.get_page("2024-01-01")["id"]
+    blocks = itertools.islice(notion_page.iterate_block_children(page_id), 3)
+    assert len(list(blocks)) == 3
+    assert fake_notion.requests["GET blocks {id} children"] == 1
+
+
+def test_block_writes_use_the_row_index(fake_notion):
+    contents = [make_row_todo("a"), make_row_todo("b")]
+    notion_page.add_tasks_after(contents, default_page_name="2024-01-01")
+    fake_notion.requests.clear()
+
+    # existing rows are found in the index, without querying the database
+    updated = make_row_todo("a")
+    notion_page.update_task(updated, contents[0].notion_uuid)
+    notion_page.add_tasks_after([make_row_todo("b")], default_page_name="2024-01-01")
+    assert (
+        updated.sections[0].database_content.entry_uuid
+        == contents[0].sections[0].database_content.entry_uuid
+    )
+    # new rows are created and indexed
+    notion_page.add_tasks_after(
+        [make_row_todo("c"), make_row_todo("d")], default_page_name="2024-01-01"
+    )
+    notion_page.update_task(make_row_todo("c"), contents[1].notion_uuid)
+    assert fake_notion.requests["POST pages"] == 2
+    assert fake_notion.requests["POST databases {id} query"] == 0
+
+    # the index is pulled once after it's cleared
+    notion_page.clear_database_entry_index()
+    for row_uuid in "abcd":
+        notion_page.update_task(make_row_todo(row_uuid), contents[0].notion_uuid)
+    assert fake_notion.requests["POST pages"] == 2
+    assert fake_notion.requests["POST databases {id} query"] == 2  # pages of 2
+
+
+def test_pulls_are_incremental(fake_notion, monkeypatch):
+    # edit times of the fake are taken as settled, edits set them explicitly
+    monkeypatch.setattr(notion_page, "EDIT_TIME_RESOLUTION", 0)
+    contents = [make_todo([make_todo()]), make_todo([make_todo()])]
+    notion_page.add_tasks_after(contents, default_page_name="2024-01-01")
+    pulled, is_changed = notion_page.get_contents_incrementally("2024-01-01")
+    assert is_changed and get_tree(pulled) == get_tree(contents)
+
+    # unchanged page, only its edit time is checked
+    fake_notion.requests.clear()
+    pulled, is_changed = notion_page.get_contents_incrementally("2024-01-01")
+    assert not is_changed and get_tree(pulled) == get_tree(contents)
+    assert fake_notion.requests == {"GET pages {id}": 1}
+
+    # edited outside of plex, only the subtree of the edited block is pulled again
+    edited_id = contents[0].children[0].notion_uuid
+    fake_notion.handle_route(
+        "PATCH",
+        ["blocks", edited_id],
+        {"to_do": {"rich_text": [{"text": {"content": "edited"}}]}},
+    )
+    page_id = notion_page.get_page("2024-01-01")["id"]
+    for record_id in (edited_id, contents[0].notion_uuid, page_id):
+        fake_notion.records[record_id]["last_edited_time"] = "2024-01-01T00:00:00.000Z"
+    fake_notion.requests.clear()
+    pulled, is_changed = notion_page.get_contents_incrementally("2024-01-01")
+    assert is_changed
+    assert pulled[0].children[0].sections[0].content == "edited"
+    assert get_tree(pulled[1:]) == get_tree(contents[1:])
+    # the page and the edited block's parent
+    assert fake_notion.requests["GET blocks {id} children"] == 2
+
+
+def test_subpage_listings_keep_the_directory(fake_notion, monkeypatch):
+    fake_notion.max_page_size = notion_page.NOTION_PAGE_SIZE
+    num_subpages = notion_page.PAGE_DIRECTORY_MAX_SIZE + 16
+    for idx in range(num_subpages):
+        notion_page.create_page(f"page {idx}")
+    notion_page.PAGE_CACHE_STATS.clear()
+    fake_notion.requests.clear()
+    saves = []
+    save_page_directory = notion_page.save_page_directory
+    monkeypatch.setattr(
+        notion_page,
+        "save_page_directory",
+        lambda: saves.append(None) or save_page_directory(),
+    )
+
+    # listed subpages don't evict the main page from the directory
+    for _ in range(3):
+        assert len(notion_page.get_subpages()) == num_subpages
+    assert fake_notion.requests["POST search"] == 0
+    assert not saves and not notion_page.PAGE_CACHE_STATS["evictions"]
+
+    # listed subpages are found without searching, and saved once used
+    assert notion_page.get_page("page 0")["id"] == notion_page.get_subpages()["page 0"]
+    assert fake_notion.requests["POST search"] == 0 and len(saves) == 1
+
+    # deleted subpages are forgotten
+    notion_page.delete_block(notion_uuid=notion_page.get_subpages()["page 1"])
+    with pytest.raises(notion_page.PageNotFoundError):
+        notion_page.get_page("page 1")
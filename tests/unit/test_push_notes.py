@@ -0,0 +1,334 @@
+"""
+Tests queueing of notion changes
+"""
+
+import dataclasses
+import threading
+import time
+
+import pytest
+
+from plex.daily.tasks import push_notes
+from plex.daily.tasks.change_log import ChangeLog
+from plex.daily.tasks.push_notes import (
+    ChangeDispatcher,
+    ChangePriority,
+    ChangeSet,
+    NotionEdit,
+    plan_notion_edits,
+)
+from plex.daily.tasks.str_sections import TaskStringSections
+
+
+def make_change_set(
+    notion_uuid: str, final_state: str = "changed", parent_notion_uuid: str = ""
+) -> ChangeSet:
+    final_states = [final_state] if final_state else []
+    return ChangeSet(
+        "2024-01-01",
+        notion_uuid,
+        "initial",
+        final_states,
+        parent_notion_uuid=parent_notion_uuid or notion_uuid + "-parent",
+    )
+
+
+def test_dispatcher_priority():
+    dispatcher = ChangeDispatcher()
+    dispatcher.put(make_change_set("a"), ChangePriority.regular)
+    dispatcher.put(make_change_set("b", ""), ChangePriority.deletion)
+    dispatcher.put(make_change_set("c"), ChangePriority.preprocessed)
+    dispatcher.put(make_change_set("d"), ChangePriority.regular)
+
+    order = []
+    while not dispatcher.empty():
+        priority, change_set = dispatcher.get()
+        order.append(change_set.notion_uuid)
+        dispatcher.task_done(priority, change_set)
+    assert order == ["c", "b", "a", "d"]
+    dispatcher.join()
+
+
+def test_dispatcher_blocks_when_idle():
+    dispatcher = ChangeDispatcher()
+    received = []
+
+    def worker():
+        priority, change_set = dispatcher.get()
+        received.append(change_set.notion_uuid)
+        dispatcher.task_done(priority, change_set)
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    thread.join(timeout=0.1)
+    assert thread.is_alive() and not received
+
+    dispatcher.put(make_change_set("a"), ChangePriority.preprocessed)
+    dispatcher.join(ChangePriority.preprocessed)
+    thread.join(timeout=1)
+    assert received == ["a"]
+
+
+def test_dispatcher_clear():
+    dispatcher = ChangeDispatcher()
+    for notion_uuid in "abc":
+        dispatcher.put(make_change_set(notion_uuid), ChangePriority.regular)
+    dispatcher.clear()
+    assert dispatcher.empty()
+    dispatcher.join()
+
+
+def test_dispatcher_coalesces_changes():
+    dispatcher = ChangeDispatcher()
+    dispatcher.put(make_change_set("a", "first"), ChangePriority.regular)
+    dispatcher.put(make_change_set("b", "first"), ChangePriority.regular)
+    dispatcher.put(make_change_set("a", "second"), ChangePriority.regular)
+    # deletion replaces the pending update
+    dispatcher.put(make_change_set("b", ""), ChangePriority.deletion)
+    # no-op drops the pending update
+    dispatcher.put(make_change_set("c", "first"), ChangePriority.regular)
+    dispatcher.put(make_change_set("c", "initial"), ChangePriority.regular)
+
+    changes = []
+    while not dispatcher.empty():
+        priority, change_set = dispatcher.get()
+        changes.append((change_set.notion_uuid, change_set.final_states))
+        dispatcher.task_done(priority, change_set)
+    assert changes == [("b", []), ("a", ["second"])]
+    assert dispatcher.num_coalesced == 3
+    dispatcher.join()
+
+
+def test_dispatcher_serializes_parents():
+    dispatcher = ChangeDispatcher()
+    dispatcher.put(make_change_set("a", parent_notion_uuid="p"), ChangePriority.regular)
+    dispatcher.put(make_change_set("b", parent_notion_uuid="p"), ChangePriority.regular)
+    dispatcher.put(make_change_set("c", parent_notion_uuid="q"), ChangePriority.regular)
+
+    # changes of different parents run concurrently
+    first_priority, first = dispatcher.get()
+    second_priority, second = dispatcher.get()
+    assert (first.notion_uuid, second.notion_uuid) == ("a", "c")
+
+    # b waits until a, which has the same parent, is done.
+    received = []
+
+    def worker():
+        priority, change_set = dispatcher.get()
+        received.append(change_set.notion_uuid)
+        dispatcher.task_done(priority, change_set)
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    dispatcher.task_done(second_priority, second)
+    thread.join(timeout=0.1)
+    assert not received
+
+    dispatcher.task_done(first_priority, first)
+    dispatcher.join()
+    thread.join(timeout=1)
+    assert received == ["b"]
+
+
+def test_dispatcher_replays_outstanding_changes(tmp_path):
+    log_file = str(tmp_path / "notion" / "pending_changes.jsonl")
+    dispatcher = ChangeDispatcher(ChangeLog(log_file))
+    for notion_uuid in "abc":
+        dispatcher.put(make_change_set(notion_uuid), ChangePriority.regular)
+    # replaced changes are acknowledged
+    dispatcher.put(make_change_set("c", ""), ChangePriority.deletion)
+
+    priority, change_set = dispatcher.get()
+    dispatcher.task_done(priority, change_set)
+    priority, change_set = dispatcher.get()
+    dispatcher.task_done(priority, change_set, is_applied=False)
+    assert change_set.notion_uuid == "a"
+
+    # restart, a wasn't applied and b wasn't started
+    dispatcher = ChangeDispatcher(ChangeLog(log_file))
+    assert dispatcher.replay() == 2
+    changes = []
+    while not dispatcher.empty():
+        priority, change_set = dispatcher.get()
+        changes.append(change_set)
+        dispatcher.task_done(priority, change_set)
+    assert changes == [make_change_set("a"), make_change_set("b")]
+
+    dispatcher = ChangeDispatcher(ChangeLog(log_file))
+    assert dispatcher.replay() == 0
+
+
+def make_task_section(
+    uuid: str, name: str = "task ", notion_uuid: str = "", children: list = []
+) -> TaskStringSections:
+    return TaskStringSections(
+        start_diff="\t",
+        indentation="",
+        start="9:00-",
+        end="10:00:\t",
+        name=name,
+        uuid=f"|{uuid}:0|",
+        time="(1hr)",
+        end_diff="\t",
+        children=children,
+        notion_uuid=notion_uuid or None,
+    )
+
+
+def get_edit_summary(edits: list[NotionEdit]) -> list[tuple]:
+    return [
+        (
+            edit.operation.value,
+            edit.notion_uuid,
+            edit.parent_notion_uuid,
+            [section.uuid for section in edit.sections],
+        )
+        for edit in edits
+    ]
+
+
+@pytest.mark.parametrize(
+    "local_sections,notion_sections,expected_edits",
+    [
+        # no changes
+        (
+            [make_task_section("a"), make_task_section("b")],
+            [
+                make_task_section("a", notion_uuid="na"),
+                make_task_section("b", notion_uuid="nb"),
+            ],
+            [],
+        ),
+        # update, delete and insert
+        (
+            [make_task_section("a", name="renamed "), make_task_section("c")],
+            [
+                make_task_section("a", notion_uuid="na"),
+                make_task_section("b", notion_uuid="nb"),
+            ],
+            [
+                ("update", "na", None, ["|a:0|"]),
+                ("delete", "nb", None, []),
+                ("insert", "na", None, ["|c:0|"]),
+            ],
+        ),
+        # move is a delete and an insert
+        (
+            [make_task_section("a"), make_task_section("c"), make_task_section("b")],
+            [
+                make_task_section("a", notion_uuid="na"),
+                make_task_section("b", notion_uuid="nb"),
+                make_task_section("c", notion_uuid="nc"),
+            ],
+            [
+                ("insert", "na", None, ["|c:0|"]),
+                ("delete", "nc", None, []),
+            ],
+        ),
+        # children are reconciled under their parent
+        (
+            [make_task_section("a", children=[make_task_section("b")])],
+            [
+                make_task_section(
+                    "a",
+                    notion_uuid="na",
+                    children=[make_task_section("c", notion_uuid="nc")],
+                )
+            ],
+            [
+                ("delete", "nc", "na", []),
+                ("insert", None, "na", ["|b:0|"]),
+            ],
+        ),
+        # inserts before the first kept block go after it, with a copy of it
+        (
+            [make_task_section("c"), make_task_section("a"), make_task_section("b")],
+            [
+                make_task_section("x", notion_uuid="nx"),
+                make_task_section("a", notion_uuid="na"),
+                make_task_section("b", notion_uuid="nb"),
+            ],
+            [
+                ("delete", "nx", None, []),
+                ("insert", "na", None, ["|c:0|", "|a:0|"]),
+                ("delete", "na", None, []),
+            ],
+        ),
+        # inserts right after the copy are part of the same insert
+        (
+            [
+                make_task_section("c"),
+                make_task_section("a"),
+                make_task_section("d"),
+                make_task_section("b"),
+                make_task_section("e"),
+            ],
+            [
+                make_task_section("a", notion_uuid="na"),
+                make_task_section("b", notion_uuid="nb"),
+            ],
+            [
+                ("insert", "na", None, ["|c:0|", "|a:0|", "|d:0|"]),
+                ("delete", "na", None, []),
+                ("insert", "nb", None, ["|e:0|"]),
+            ],
+        ),
+    ],
+)
+def test_plan_notion_edits(local_sections, notion_sections, expected_edits):
+    edits = plan_notion_edits(local_sections, notion_sections)
+    assert get_edit_summary(edits) == expected_edits
+
+
+def test_staleness_checks_share_listings(monkeypatch):
+    listings = []
+
+    def get_child_blocks(parent_id):
+        listings.append(parent_id)
+        return {"a": "block a", "b": "block b"}
+
+    monkeypatch.setattr(push_notes, "get_child_blocks", get_child_blocks)
+    monkeypatch.setattr(push_notes, "BLOCK_SNAPSHOTS", {})
+
+    blocks = [
+        push_notes.get_latest_block(
+            make_change_set(notion_uuid, parent_notion_uuid="p")
+        )
+        for notion_uuid in "abc"
+    ]
+    # c isn't in the listing, so it's listed again to check if it was just created.
+    assert blocks == ["block a", "block b", None]
+    assert listings == ["p", "p"]
+
+    # written blocks are checked again
+    push_notes.drop_block_from_snapshot(make_change_set("a", parent_notion_uuid="p"))
+    push_notes.get_latest_block(make_change_set("b", parent_notion_uuid="p"))
+    assert listings == ["p", "p"]
+    push_notes.get_latest_block(make_change_set("a", parent_notion_uuid="p"))
+    assert listings == ["p", "p", "p"]
+
+
+def test_staleness_checks_see_edits_after_the_change(monkeypatch):
+    listing = {"a": "block a", "b": "block b"}
+    listings = []
+
+    def get_child_blocks(parent_id):
+        listings.append(parent_id)
+        return dict(listing)
+
+    monkeypatch.setattr(push_notes, "get_child_blocks", get_child_blocks)
+    monkeypatch.setattr(push_notes, "BLOCK_SNAPSHOTS", {})
+    assert push_notes.get_latest_block(make_change_set("a", parent_notion_uuid="p"))
+
+    # b is edited in notion, and a change is computed from a pull after the listing
+    listing["b"] = "edited b"
+    change_set = dataclasses.replace(
+        make_change_set("b", parent_notion_uuid="p"), pulled_time=time.time()
+    )
+    assert push_notes.get_latest_block(change_set) == "edited b"
+    assert listings == ["p", "p"]
+
+    # changes computed before the listing share it
+    change_set = make_change_set("a", parent_notion_uuid="p")
+    assert push_notes.get_latest_block(change_set) == "block a"
+    assert listings == ["p", "p"]
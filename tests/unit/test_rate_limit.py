@@ -0,0 +1,147 @@
+"""
+Tests retries and circuit breaking of api calls
+"""
+
+import json
+
+import httpx
+import pytest
+from google.auth.exceptions import RefreshError
+
+from plex.calendar_api.fake import make_http_error
+from plex.rate_limit import (
+    API_BACKENDS,
+    ApiBackend,
+    BackendTransport,
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryableResponseError,
+    TokenBucket,
+    get_google_retry_after,
+    get_response_retry_after,
+    is_retryable_google_error,
+    is_retryable_response_error,
+)
+
+
+def make_backend(**kwargs) -> ApiBackend:
+    return ApiBackend(
+        "test",
+        TokenBucket(rate=1000, capacity=1000),
+        is_retryable_response_error,
+        get_response_retry_after,
+        max_delay=0,
+        register=False,
+        **kwargs,
+    )
+
+
+def make_responder(statuses: list[int]):
+    calls = []
+
+    def respond() -> str:
+        calls.append(None)
+        status = statuses[len(calls) - 1]
+        if status != 200:
+            raise RetryableResponseError(
+                httpx.Response(status, headers={"Retry-After": "5"})
+            )
+        return "ok"
+
+    return respond, calls
+
+
+def test_backend_retries():
+    backend = make_backend()
+    respond, calls = make_responder([429, 503, 200])
+    assert backend.call(respond) == "ok"
+    assert backend.stats == {"calls": 1, "retried": 2, "throttled": 1}
+
+    # errors that aren't retryable are raised right away
+    def fail():
+        raise KeyError("bad request")
+
+    with pytest.raises(KeyError):
+        backend.call(fail)
+    assert backend.stats["failed"] == 1 and backend.stats["retried"] == 2
+
+    respond, calls = make_responder([429] * 5)
+    with pytest.raises(RetryableResponseError):
+        backend.call(respond)
+    assert len(calls) == backend.max_retries + 1
+
+
+def test_transport_retries_idempotent_requests():
+    backend = make_backend()
+    assert "test" not in API_BACKENDS
+    methods = []
+
+    def respond(request: httpx.Request) -> httpx.Response:
+        methods.append(request.method)
+        return httpx.Response(503 if len(methods) % 2 else 200)
+
+    client = httpx.Client(
+        transport=BackendTransport(backend, httpx.MockTransport(respond))
+    )
+    assert client.get("https://api.test/pages/1").status_code == 200
+    assert methods == ["GET", "GET"]
+
+    # writes may have been applied before the server error, they aren't retried
+    assert client.post("https://api.test/pages").status_code == 503
+    assert client.patch("https://api.test/blocks/1/children").status_code == 200
+    assert methods == ["GET", "GET", "POST", "PATCH"]
+
+
+def test_circuit_breaker(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("plex.rate_limit.time.monotonic", lambda: now[0])
+    backend = make_backend(
+        max_retries=0, circuit_breaker=CircuitBreaker(failure_threshold=2)
+    )
+    respond, calls = make_responder([503, 503, 503, 200, 200])
+    for _ in range(2):
+        with pytest.raises(RetryableResponseError):
+            backend.call(respond)
+
+    # open, calls are rejected without being sent
+    with pytest.raises(CircuitOpenError):
+        backend.call(respond)
+    assert len(calls) == 2 and backend.stats["rejected"] == 1
+
+    # a failed trial call opens it again
+    now[0] += backend.circuit_breaker.reset_timeout
+    with pytest.raises(RetryableResponseError):
+        backend.call(respond)
+    with pytest.raises(CircuitOpenError):
+        backend.call(respond)
+
+    # a successful trial call closes it
+    now[0] += backend.circuit_breaker.reset_timeout
+    assert backend.call(respond) == "ok"
+    assert backend.call(respond) == "ok"
+
+
+def make_google_error(status: int, reason: str):
+    content = {"error": {"code": status, "errors": [{"reason": reason}]}}
+    return make_http_error(status, json.dumps(content))
+
+
+def test_google_rate_limit_errors():
+    for reason in ("rateLimitExceeded", "userRateLimitExceeded"):
+        exc = make_google_error(403, reason)
+        assert is_retryable_google_error(exc)
+        assert get_google_retry_after(exc) == 0
+    assert is_retryable_google_error(make_http_error(403, "userRateLimitExceeded"))
+    assert get_google_retry_after(make_google_error(429, "rateLimitExceeded")) == 0
+
+    # permission errors and server errors aren't throttling
+    exc = make_google_error(403, "forbidden")
+    assert not is_retryable_google_error(exc) and get_google_retry_after(exc) is None
+    exc = make_google_error(503, "backendError")
+    assert is_retryable_google_error(exc) and get_google_retry_after(exc) is None
+
+    # only errors of requests that didn't get a response are retried
+    assert is_retryable_google_error(ConnectionResetError())
+    assert is_retryable_google_error(TimeoutError())
+    assert not is_retryable_google_error(KeyError("id"))
+    assert not is_retryable_google_error(RefreshError("invalid_grant"))
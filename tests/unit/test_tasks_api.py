@@ -0,0 +1,261 @@
+"""
+Tests syncing google tasks
+"""
+
+from collections import Counter, defaultdict
+from types import SimpleNamespace
+
+import pytest
+from googleapiclient.errors import HttpError
+
+from plex import tasks_api
+from plex.calendar_api.fake import make_http_error
+from plex.instrumentation import get_phase_timings
+from plex.rate_limit import CircuitBreaker, CircuitOpenError, TokenBucket
+
+
+class StubRequest:
+    def __init__(self, service: "StubTasksService", method: str, function, **kwargs):
+        self.service = service
+        self.method = method
+        self.function = function
+        self.kwargs = kwargs
+
+    def execute(self):
+        self.service.requests[self.method] += 1
+        if self.service.failures[self.method]:
+            raise self.service.failures[self.method].pop(0)
+        return self.function(**self.kwargs)
+
+
+class StubBatch:
+    def __init__(self, service: "StubTasksService", callback):
+        self.service = service
+        self.callback = callback
+        self.requests: list[tuple[str, StubRequest]] = []
+
+    def add(self, request: StubRequest, request_id: str):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.service.requests["batch"] += 1
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.execute(), None)
+            except HttpError as err:
+                self.callback(request_id, None, err)
+        if self.service.failures["batch"]:
+            raise self.service.failures["batch"].pop(0)
+
+
+def paginate(items: list[dict], maxResults: int, pageToken=None) -> dict:
+    start = int(pageToken or 0)
+    end = start + min(maxResults, 2)  # small pages, to check they're all read
+    results = {"items": items[start:end]}
+    if end < len(items):
+        results["nextPageToken"] = str(end)
+    return results
+
+
+class StubTasksService:
+    def __init__(self):
+        self.tasklists_by_id: dict[str, dict] = {}
+        self.tasks_by_id: dict[str, dict] = {}
+        self.requests: Counter = Counter()
+        # errors raised by the next requests of each method
+        self.failures: dict[str, list[Exception]] = defaultdict(list)
+        self.num_ids = 0
+
+    def make_id(self) -> str:
+        self.num_ids += 1
+        return str(self.num_ids)
+
+    def new_batch_http_request(self, callback):
+        return StubBatch(self, callback)
+
+    def tasklists(self):
+        def insert(body):
+            tasklist = {**body, "id": self.make_id()}
+            self.tasklists_by_id[tasklist["id"]] = tasklist
+            return tasklist
+
+        def update(tasklist, body):
+            self.tasklists_by_id[tasklist] = {**body, "id": tasklist}
+            return self.tasklists_by_id[tasklist]
+
+        return SimpleNamespace(
+            list=lambda **kwargs: StubRequest(
+                self,
+                "tasklists.list",
+                lambda **kwargs: paginate(
+                    list(self.tasklists_by_id.values()), **kwargs
+                ),
+                **kwargs,
+            ),
+            insert=lambda **kwargs: StubRequest(
+                self, "tasklists.insert", insert, **kwargs
+            ),
+            update=lambda **kwargs: StubRequest(
+                self, "tasklists.update", update, **kwargs
+            ),
+        )
+
+    def tasks(self):
+        def list_tasks(tasklist, showCompleted, showHidden, **kwargs):
+            return paginate(
+                [
+                    task
+                    for task in self.tasks_by_id.values()
+                    if task["tasklist"] == tasklist
+                ],
+                **kwargs,
+            )
+
+        def insert(tasklist, body, parent=None):
+            task = {**body, "id": self.make_id(), "tasklist": tasklist}
+            task["status"] = "needsAction"
+            if parent:
+                task["parent"] = parent
+            self.tasks_by_id[task["id"]] = task
+            return task
+
+        def delete(tasklist, task):
+            self.tasks_by_id.pop(task)
+            for child in list(self.tasks_by_id.values()):
+                if child.get("parent") == task:
+                    self.tasks_by_id.pop(child["id"])
+            return ""
+
+        return SimpleNamespace(
+            list=lambda **kwargs: StubRequest(self, "tasks.list", list_tasks, **kwargs),
+            insert=lambda **kwargs: StubRequest(self, "tasks.insert", insert, **kwargs),
+            delete=lambda **kwargs: StubRequest(self, "tasks.delete", delete, **kwargs),
+        )
+
+    def get_tree(self) -> list[tuple[str, str]]:
+        titles = {task["id"]: task["title"] for task in self.tasks_by_id.values()}
+        return sorted(
+            (task["title"], titles.get(task.get("parent"), ""))
+            for task in self.tasks_by_id.values()
+        )
+
+
+@pytest.fixture
+def service(monkeypatch) -> StubTasksService:
+    service = StubTasksService()
+    monkeypatch.setattr(tasks_api, "get_task_service", lambda: service)
+    monkeypatch.setattr(
+        tasks_api.TASKS_BACKEND,
+        "rate_limiter",
+        TokenBucket(rate=1000, capacity=tasks_api.TASKS_BATCH_LIMIT),
+    )
+    monkeypatch.setattr(tasks_api.TASKS_BACKEND, "max_delay", 0)
+    tasks_api.clear_tasklist_index()
+    yield service
+    tasks_api.clear_tasklist_index()
+
+
+def test_put_gtasklists(service: StubTasksService):
+    gtasklists = [
+        {"name": f"task {idx}", "subtasks": [f"subtask {idx}"] * 2} for idx in range(30)
+    ]
+    tasks_api.put_gtasklists("1", "list", gtasklists)
+    expected = sorted(
+        [(f"task {idx}", "") for idx in range(30)]
+        + [(f"subtask {idx}", f"task {idx}") for idx in range(30)] * 2
+    )
+    assert service.get_tree() == expected
+    # subtasks are inserted under their parent, without being moved
+    assert service.requests["tasks.insert"] == 90
+    assert service.requests["batch"] == 2 + 3
+    assert set(get_phase_timings("tasks.")) >= {
+        "tasks.diff",
+        "tasks.delete",
+        "tasks.insert_parents",
+        "tasks.insert_children",
+    }
+
+
+def test_put_gtasklists_diff(service: StubTasksService):
+    gtasklists = [
+        {"name": "a", "subtasks": ["x", "x"]},
+        {"name": "b", "subtasks": ["y"]},
+    ]
+    tasks_api.put_gtasklists("1", "list", gtasklists)
+    service.requests.clear()
+
+    # unchanged tasks aren't touched
+    tasks_api.put_gtasklists("1", "list", gtasklists)
+    assert not service.requests["tasks.insert"] + service.requests["tasks.delete"]
+
+    # subtasks are matched by title and parent title, duplicates are counted
+    gtasklists = [
+        {"name": "a", "subtasks": ["x", "y"]},
+        {"name": "c", "subtasks": ["y"]},
+    ]
+    tasks_api.put_gtasklists("1", "list", gtasklists)
+    assert service.get_tree() == [
+        ("a", ""),
+        ("c", ""),
+        ("x", "a"),
+        ("y", "a"),
+        ("y", "c"),
+    ]
+    # b and one x are deleted, c and the subtasks are inserted
+    assert service.requests["tasks.delete"] == 2
+    assert service.requests["tasks.insert"] == 3
+
+
+def test_tasklist_index(service: StubTasksService):
+    for idx in range(5):
+        service.tasklists().insert(body={"title": f"{idx} - list"}).execute()
+    service.tasklists().insert(body={"title": "10 - list"}).execute()
+    assert tasks_api.get_tasklist("4 - list")["title"] == "4 - list"
+
+    # inserted and renamed tasklists are visible without listing again
+    gtasklists = [{"name": "task", "subtasks": []}]
+    tasks_api.put_gtasklists("7", "new", gtasklists)
+    tasks_api.put_gtasklists("1", "renamed", gtasklists)
+    assert tasks_api.get_tasklist("1 - list") is None
+    assert tasks_api.get_tasks("7 - new")[0]["title"] == "task"
+    assert tasks_api.get_tasks("1 - renamed")[0]["title"] == "task"
+    assert tasks_api.get_tasklist("10 - list") is not None
+    assert service.requests["tasklists.list"] == 3  # pages of the first listing
+    assert service.requests["tasklists.insert"] == 7
+    assert service.requests["tasklists.update"] == 1
+
+
+def test_put_gtasklists_retries(service: StubTasksService):
+    gtasklists = [{"name": name, "subtasks": []} for name in "abc"]
+    # throttled inserts are retried, once even if the whole batch failed after it
+    service.failures["tasks.insert"] = [make_http_error(429, "rateLimitExceeded")]
+    service.failures["batch"] = [ConnectionRefusedError()]
+    tasks_api.put_gtasklists("1", "list", gtasklists)
+    assert service.get_tree() == [("a", ""), ("b", ""), ("c", "")]
+    assert service.requests["tasks.insert"] == 4
+
+    # inserts may have been applied on server errors, they aren't retried
+    gtasklists.append({"name": "d", "subtasks": []})
+    service.failures["tasks.insert"] = [make_http_error(503, "backendError")]
+    with pytest.raises(HttpError):
+        tasks_api.put_gtasklists("1", "list", gtasklists)
+    assert service.requests["tasks.insert"] == 5
+
+    # deletes are idempotent, they're retried
+    service.failures["tasks.delete"] = [make_http_error(503, "backendError")]
+    tasks_api.put_gtasklists("1", "list", gtasklists[1:])
+    assert service.get_tree() == [("b", ""), ("c", ""), ("d", "")]
+    assert service.requests["tasks.delete"] == 2
+
+
+def test_put_gtasklists_circuit_breaker(service: StubTasksService, monkeypatch):
+    monkeypatch.setattr(
+        tasks_api.TASKS_BACKEND, "circuit_breaker", CircuitBreaker(failure_threshold=1)
+    )
+    gtasklists = [{"name": name, "subtasks": []} for name in "abc"]
+    # the throttled batch opens the circuit, the retry isn't sent
+    service.failures["tasks.insert"] = [make_http_error(429, "rateLimitExceeded")]
+    with pytest.raises(CircuitOpenError):
+        tasks_api.put_gtasklists("1", "list", gtasklists)
+    assert service.requests["tasks.insert"] == 3
+    assert service.get_tree() == [("b", ""), ("c", "")]